@@ -0,0 +1,205 @@
+from datetime import date, datetime
+import numpy as np
+from metrics import COLUMN_NAMES, DATE_KEY, DATE_LABEL, METRIC_DEFAULTS, METRIC_KEYS
+
+# Номер столбца матрицы значений по ключу показателя
+_COLUMNS = {key: index for index, key in enumerate(METRIC_KEYS)}
+_DEFAULTS = np.array([float(METRIC_DEFAULTS[key]) for key in METRIC_KEYS])
+_UNIX_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def _ordinal(value) -> int:
+    # Firebird может возвращать datetime, а показатели считаются по дням
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+def _python_values(column: np.ndarray) -> list:
+    """Значения столбца для листа и словарей: целое, если сумма целая; NaN -> None."""
+    return [None if value != value else int(value) if value.is_integer() else value for value in column.tolist()]
+
+
+class DailyAggregates:
+    """
+    Дневные показатели в столбцовом виде: индекс дат по возрастанию
+    (date.toordinal, int64) и матрица значений float64 — строка на дату,
+    столбец на показатель в порядке METRIC_KEYS.
+
+    NaN — по показателю за дату нет строк в базе; значение по умолчанию
+    подставляет reindex. Объединение результатов запросов, заполнение
+    периода, сравнение со снимком и строки для листа выполняются над
+    массивами целиком, без словаря на каждую строку.
+    """
+
+    __slots__ = ('ordinals', 'values')
+
+    def __init__(self, ordinals: np.ndarray, values: np.ndarray):
+        self.ordinals = ordinals
+        self.values = values
+
+    @classmethod
+    def empty(cls) -> 'DailyAggregates':
+        return cls(np.empty(0, dtype=np.int64), np.empty((0, len(METRIC_KEYS))))
+
+    @classmethod
+    def from_query(cls, columns: list[str], rows: list[tuple]) -> 'DailyAggregates':
+        """
+        Результат запроса показателей: столбец PRODDATE и столбцы QTY_...,
+        не больше одной строки на дату (GROUP BY). NULL становится NaN,
+        столбцы не из METRIC_KEYS пропускаются.
+        """
+        if not rows:
+            return cls.empty()
+        date_index = columns.index(DATE_KEY)
+        ordinals = np.fromiter((_ordinal(row[date_index]) for row in rows), dtype=np.int64, count=len(rows))
+        values = np.full((len(rows), len(METRIC_KEYS)), np.nan)
+        for index, column in enumerate(columns):
+            if column in _COLUMNS:
+                # None -> NaN, Decimal -> float
+                values[:, _COLUMNS[column]] = np.array([row[index] for row in rows], dtype=np.float64)
+        order = np.argsort(ordinals, kind='stable')
+        return cls(ordinals[order], values[order])
+
+    @classmethod
+    def from_cells(cls, cells: list[tuple]) -> 'DailyAggregates':
+        """Строки (дата, ключ показателя, значение) — по ячейке на строку; неизвестные ключи пропускаются."""
+        if not cells:
+            return cls.empty()
+        ordinals, inverse = np.unique(
+            np.fromiter((_ordinal(cell[0]) for cell in cells), dtype=np.int64, count=len(cells)), return_inverse=True
+        )
+        columns = np.array([_COLUMNS.get(cell[1].strip(), -1) for cell in cells], dtype=np.int64)
+        known = columns >= 0
+        values = np.full((len(ordinals), len(METRIC_KEYS)), np.nan)
+        values[inverse[known], columns[known]] = np.array([cell[2] for cell in cells], dtype=np.float64)[known]
+        return cls(ordinals, values)
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> 'DailyAggregates':
+        """Строки-словари {'PRODDATE': дата, 'QTY_...': значение} (история, очередь записи)."""
+        columns = [DATE_KEY] + METRIC_KEYS
+        return cls.from_query(columns, [tuple(record.get(column) for column in columns) for record in records])
+
+    @classmethod
+    def concat(cls, parts: list['DailyAggregates']) -> 'DailyAggregates':
+        """Склеивает части с непересекающимися датами."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        ordinals = np.concatenate([part.ordinals for part in parts])
+        values = np.concatenate([part.values for part in parts])
+        order = np.argsort(ordinals, kind='stable')
+        return cls(ordinals[order], values[order])
+
+    def __len__(self) -> int:
+        return len(self.ordinals)
+
+    def __getitem__(self, index: slice) -> 'DailyAggregates':
+        return DailyAggregates(self.ordinals[index], self.values[index])
+
+    @property
+    def dates(self) -> list[date]:
+        return [date.fromordinal(ordinal) for ordinal in self.ordinals.tolist()]
+
+    def date_keys(self) -> list[str]:
+        """Даты в виде 'дд.мм.гггг', как в столбце 'Дата' зеркала листа."""
+        iso = np.datetime_as_string((self.ordinals - _UNIX_EPOCH).astype('datetime64[D]'))
+        return [f"{value[8:10]}.{value[5:7]}.{value[:4]}" for value in iso.tolist()]
+
+    def _positions(self, ordinals: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Позиции дат ordinals в своем индексе и маска найденных."""
+        if not len(self.ordinals):
+            return np.zeros(len(ordinals), dtype=np.int64), np.zeros(len(ordinals), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.ordinals, ordinals), len(self.ordinals) - 1)
+        return positions, self.ordinals[positions] == ordinals
+
+    def merge(self, other: 'DailyAggregates') -> 'DailyAggregates':
+        """Объединение по датам: непустые значения other заменяют свои (результаты разных запросов)."""
+        ordinals = np.union1d(self.ordinals, other.ordinals)
+        values = np.full((len(ordinals), len(METRIC_KEYS)), np.nan)
+        values[np.searchsorted(ordinals, self.ordinals)] = self.values
+        rows = np.searchsorted(ordinals, other.ordinals)
+        values[rows] = np.where(np.isnan(other.values), values[rows], other.values)
+        return DailyAggregates(ordinals, values)
+
+    def add(self, other: 'DailyAggregates') -> 'DailyAggregates':
+        """Сумма по датам (частичные суммы по порциям строк); NaN + NaN остается NaN."""
+        ordinals = np.union1d(self.ordinals, other.ordinals)
+        values = np.full((len(ordinals), len(METRIC_KEYS)), np.nan)
+        for part in (self, other):
+            rows = np.searchsorted(ordinals, part.ordinals)
+            current = values[rows]
+            values[rows] = np.where(np.isnan(current), part.values, current + np.nan_to_num(part.values))
+        return DailyAggregates(ordinals, values)
+
+    def reindex(self, dates: list[date]) -> 'DailyAggregates':
+        """Строка на каждую дату из dates; пропущенные даты и показатели — значения по умолчанию."""
+        ordinals = np.unique(np.fromiter((_ordinal(dt) for dt in dates), dtype=np.int64, count=len(dates)))
+        values = np.tile(_DEFAULTS, (len(ordinals), 1))
+        positions, found = self._positions(ordinals)
+        source = self.values[positions[found]]
+        values[found] = np.where(np.isnan(source), _DEFAULTS, source)
+        return DailyAggregates(ordinals, values)
+
+    def diff(self, other: 'DailyAggregates') -> 'DailyAggregates':
+        """Свои строки, которых нет в other или значения которых отличаются."""
+        positions, found = other._positions(self.ordinals)
+        same = found.copy()
+        theirs = other.values[positions[found]]
+        ours = self.values[found]
+        same[found] = ((ours == theirs) | (np.isnan(ours) & np.isnan(theirs))).all(axis=1)
+        return self[~same]
+
+    def compare(self, other: 'DailyAggregates', keys: list[str] | None = None,
+                rel_tol: float = 1e-9) -> list[tuple[date, str, float, float]]:
+        """
+        Расхождения с other по датам обоих наборов (пустые значения
+        сравниваются как значения по умолчанию).
+
+        Returns:
+            Отсортированный список (дата, ключ показателя, свое значение, значение other).
+        """
+        dates = sorted(set(self.dates) | set(other.dates))
+        ours, theirs = self.reindex(dates).values, other.reindex(dates).values
+        mismatches = []
+        for key in keys or METRIC_KEYS:
+            a, b = ours[:, _COLUMNS[key]], theirs[:, _COLUMNS[key]]
+            for row in np.flatnonzero(~np.isclose(a, b, rtol=rel_tol, atol=1e-9)).tolist():
+                mismatches.append((dates[row], key, float(a[row]), float(b[row])))
+        return sorted(mismatches)
+
+    def sheet_rows(self, header: list[str]) -> list[list]:
+        """
+        Строки значений для листа в порядке столбцов header: дата — date,
+        показатель — число, неизвестный столбец и пустое значение — ''.
+        """
+        labels = {label: key for key, label in COLUMN_NAMES.items()}
+        columns = []
+        for label in header:
+            key = labels.get(label)
+            if label == DATE_LABEL:
+                columns.append(self.dates)
+            elif key in _COLUMNS:
+                columns.append(['' if value is None else value
+                                for value in _python_values(self.values[:, _COLUMNS[key]])])
+            else:
+                columns.append([''] * len(self))
+        return [list(row) for row in zip(*columns)]
+
+    def records(self) -> list[dict]:
+        """Строки-словари {'PRODDATE': дата, 'QTY_...': значение} без пустых показателей."""
+        columns = [_python_values(self.values[:, index]) for index in range(len(METRIC_KEYS))]
+        return [
+            {DATE_KEY: proddate, **{key: column[row] for key, column in zip(METRIC_KEYS, columns)
+                                    if column[row] is not None}}
+            for row, proddate in enumerate(self.dates)
+        ]
+
+
+def fill_dates(db_data: DailyAggregates, dates: list[date]) -> DailyAggregates:
+    """
+    Собирает строку на каждую дату из списка; для дат без данных
+    в базе и отсутствующих показателей подставляются значения по умолчанию.
+    """
+    return db_data.reindex(dates)
@@ -0,0 +1,230 @@
+"""
+Историческая загрузка показателей на лист за произвольный период.
+
+Период делится на части по BACKFILL_CONFIG['chunk_days'] дней; несколько
+частей выбираются из базы параллельно (fetchmany порциями), а на лист
+данные уходят последовательно, по порядку дат, записями не больше
+max_write_bytes / max_write_rows. После каждой записи сохраняется
+контрольная точка, поэтому прерванная загрузка продолжается с первой
+незаписанной даты.
+
+Пример:
+    python backfill.py --since 2025-01-01 --until 2025-12-31
+    python backfill.py --since 2025-01-01 --until 2025-12-31 --target site2 --restart
+    python backfill.py --since 2025-01-01 --from-history --restart   # пересборка листа без Firebird
+"""
+import argparse
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from aggregates import DailyAggregates, fill_dates
+from config import BACKFILL_CONFIG
+from database import get_chunk_from_db
+from google_sheets import update_google_sheet
+from history_store import get_store
+from instrumentation import inc, run, span
+from metrics import HEADER
+from sheet_writer import cell_data
+from targets import Target, find_target
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class Checkpoint:
+    """
+    Контрольная точка загрузки: последняя дата, данные по которой
+    (и по всем более ранним датам периода) уже записаны на лист.
+    Действует только для той же цели и того же периода.
+    """
+
+    def __init__(self, path: str, target_name: str, since: date, until: date):
+        self.path = path
+        self.target_name = target_name
+        self.since = since
+        self.until = until
+        self.done_until = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать контрольную точку {self.path}, загрузка начнется сначала: {e}")
+            return
+        if (state.get('target'), state.get('since'), state.get('until')) != \
+                (self.target_name, self.since.isoformat(), self.until.isoformat()):
+            logging.info(f"Контрольная точка {self.path} относится к другой загрузке — начинаем сначала.")
+            return
+        if state.get('done_until'):
+            self.done_until = date.fromisoformat(state['done_until'])
+
+    def save(self, done_until: date):
+        self.done_until = done_until
+        state = {
+            'target': self.target_name,
+            'since': self.since.isoformat(),
+            'until': self.until.isoformat(),
+            'done_until': done_until.isoformat(),
+            'updated': datetime.now().isoformat(timespec='seconds')
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def split_chunks(since: date, until: date, chunk_days: int) -> list[tuple[date, date]]:
+    """Делит период [since, until] на части не длиннее chunk_days дней."""
+    chunks = []
+    start = since
+    while start <= until:
+        end = min(start + timedelta(days=chunk_days - 1), until)
+        chunks.append((start, end))
+        start = end + timedelta(days=1)
+    return chunks
+
+
+def _row_sizes(rows: DailyAggregates) -> list[int]:
+    """Примерный объем каждой строки в теле batchUpdate."""
+    return [len(json.dumps({'values': [cell_data(value) for value in row]})) for row in rows.sheet_rows(HEADER)]
+
+
+def backfill(target: Target, since: date, until: date, restart: bool = False, from_history: bool = False) -> bool:
+    """
+    Загружает на лист цели показатели за период [since, until].
+
+    Args:
+        from_history: Брать данные из локальной истории вместо Firebird
+            (пересборка листа без нагрузки на базу). Даты, которых нет
+            в истории, пропускаются.
+
+    Returns:
+        True, если весь период записан на лист.
+    """
+    store = get_store()
+    if from_history and store is None:
+        logging.error("Локальная история отключена (HISTORY_STORE=0) — пересборка из истории невозможна.")
+        return False
+
+    checkpoint = Checkpoint(target.local_file(BACKFILL_CONFIG['checkpoint_file']), target.name, since, until)
+    if not restart:
+        checkpoint.load()
+    start = since
+    if checkpoint.done_until is not None:
+        start = checkpoint.done_until + timedelta(days=1)
+        logging.info(f"[{target.name}] Продолжение загрузки с {start.strftime('%d.%m.%Y')} "
+                     f"(записано до {checkpoint.done_until.strftime('%d.%m.%Y')}).")
+    if start > until:
+        logging.info(f"[{target.name}] Период уже загружен полностью.")
+        checkpoint.clear()
+        return True
+
+    chunks = split_chunks(start, until, BACKFILL_CONFIG['chunk_days'])
+    parallel = max(1, BACKFILL_CONFIG['parallel_chunks'])
+    logging.info(f"[{target.name}] Историческая загрузка {start.strftime('%d.%m.%Y')} — {until.strftime('%d.%m.%Y')}: "
+                 f"частей {len(chunks)}, параллельно {parallel}.")
+
+    # Части DailyAggregates, которые уйдут на лист следующей записью
+    buffer = []
+    buffer_rows = 0
+    buffer_bytes = 0
+
+    def write_buffer() -> bool:
+        nonlocal buffer, buffer_rows, buffer_bytes
+        data = DailyAggregates.concat(buffer)
+        dates = data.dates
+        logging.info(f"[{target.name}] Запись {len(data)} строк "
+                     f"({dates[0].strftime('%d.%m.%Y')} — {dates[-1].strftime('%d.%m.%Y')}, "
+                     f"~{buffer_bytes // 1024} КБ)...")
+        with span('stage', stage='backfill_write'):
+            ok = update_google_sheet(data, target.sheets_config)
+        if not ok:
+            return False
+        inc('backfill_rows_written', len(data))
+        checkpoint.save(dates[-1])
+        buffer, buffer_rows, buffer_bytes = [], 0, 0
+        return True
+
+    def fetch(chunk: tuple[date, date]) -> DailyAggregates | None:
+        """Строки части периода по возрастанию даты."""
+        dates = [chunk[0] + timedelta(days=x) for x in range((chunk[1] - chunk[0]).days + 1)]
+        if from_history:
+            with span('history_load'):
+                stored = store.load(target.name, dates)
+            if len(stored) < len(dates):
+                logging.warning(f"[{target.name}] В истории нет {len(dates) - len(stored)} дат из периода "
+                                f"{chunk[0].strftime('%d.%m.%Y')} — {chunk[1].strftime('%d.%m.%Y')}, они пропущены.")
+            return DailyAggregates.from_records(list(stored.values()))
+
+        with span('stage', stage='backfill_fetch'):
+            db_data = get_chunk_from_db(chunk[0], chunk[1], target.db_config, BACKFILL_CONFIG['fetch_batch_size'])
+        if db_data is None:
+            return None
+        rows = fill_dates(db_data, dates)
+        if store is not None:
+            with span('history_save'):
+                store.save(target.name, rows.records())
+        return rows
+
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='backfill') as executor:
+        # Из базы выбирается не более parallel частей вперед записи на лист
+        in_flight = deque()
+        pending = deque(chunks)
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < parallel:
+                    chunk = pending.popleft()
+                    in_flight.append((chunk, executor.submit(fetch, chunk)))
+                (chunk_start, chunk_end), future = in_flight.popleft()
+                rows = future.result()
+                if rows is None:
+                    logging.error(f"[{target.name}] Не удалось выбрать данные за {chunk_start.strftime('%d.%m.%Y')} — "
+                                  f"{chunk_end.strftime('%d.%m.%Y')}. Загрузку можно продолжить повторным запуском.")
+                    return False
+
+                start = 0
+                for index, size in enumerate(_row_sizes(rows)):
+                    pending_rows = buffer_rows + index - start
+                    if pending_rows and (buffer_bytes + size > BACKFILL_CONFIG['max_write_bytes']
+                                         or pending_rows >= BACKFILL_CONFIG['max_write_rows']):
+                        buffer.append(rows[start:index])
+                        start = index
+                        if not write_buffer():
+                            return False
+                    buffer_bytes += size
+                buffer.append(rows[start:])
+                buffer_rows += len(rows) - start
+            if buffer_rows and not write_buffer():
+                return False
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+    logging.info(f"[{target.name}] Историческая загрузка завершена.")
+    checkpoint.clear()
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Историческая загрузка показателей на лист")
+    parser.add_argument('--since', type=date.fromisoformat, required=True, help="Начало периода, ГГГГ-ММ-ДД")
+    parser.add_argument('--until', type=date.fromisoformat, default=date.today(), help="Конец периода, ГГГГ-ММ-ДД")
+    parser.add_argument('--target', help="Имя цели из TARGETS_FILE (по умолчанию первая)")
+    parser.add_argument('--restart', action='store_true', help="Игнорировать контрольную точку и начать сначала")
+    parser.add_argument('--from-history', action='store_true',
+                        help="Пересобрать лист из локальной истории, без запросов к Firebird")
+    args = parser.parse_args()
+
+    backfill_target = find_target(args.target)
+    with run('backfill', backfill_target.name):
+        ok = backfill(backfill_target, args.since, args.until, args.restart, args.from_history)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,626 @@
+"""
+Офлайн-бенчмарк одного запуска main.job() без рабочей базы и таблицы.
+
+Вместо Firebird используется синтетическая база SQLite со схемой Altawin
+(orders, orderitems, models, fillings, itemsdetail, itemssets и справочники),
+вместо Google Sheets — поддельный лист, который применяет batchUpdate
+к значениям в памяти, записывает каждое обращение и добавляет задержку.
+
+Для каждого размера листа выполняется два запуска: первый — с пустым
+зеркалом (полное чтение листа), второй — повторный, без изменений в базе.
+Отчет: время по этапам, число SQL-запросов и строк, обращения к Sheets API
+и объем переданных данных.
+
+С ключом --startup измеряется время запуска процесса: импорт main
+и разбор аргументов (путь python main.py --once) в отдельных процессах,
+отдельно первый запуск и медиана повторных.
+
+Пример:
+    python benchmark.py --sizes 100,1000,10000,50000 --orders-per-day 200 --output bench_output.txt
+    python benchmark.py --startup
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import fdb
+
+import database
+import google_sheets
+import history_store
+import main
+import outbox
+import sheet_state
+import sheets_client
+from config import FETCH_CONFIG, GOOGLE_SHEETS_CONFIG, HISTORY_CONFIG, INCREMENTAL_CONFIG, INSTRUMENTATION_CONFIG, OUTBOX_CONFIG
+from metrics import HEADER
+from sheet_state import cell_str
+from sheet_writer import SHEETS_EPOCH
+from sheets_quota import scheduler
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+
+sqlite3.register_converter('DATE', lambda raw: date.fromisoformat(raw.decode()))
+
+
+# --- Замена Firebird: SQLite с интерфейсом fdb в объеме, который использует db_pool ---
+
+class DbStats:
+    """Счетчики обращений к базе: запросы, подготовки, строки и объем результата."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def add(self, **values):
+        with self._lock:
+            self.counters.update(values)
+
+
+class _Statement:
+    def __init__(self, sql: str):
+        self.sql = sql
+
+
+class _Cursor:
+    def __init__(self, con: sqlite3.Connection, stats: DbStats):
+        self._con = con
+        self._stats = stats
+        self._rows = []
+        self.description = None
+
+    def prep(self, sql: str) -> _Statement:
+        self._stats.add(prepared=1)
+        return _Statement(sql)
+
+    def execute(self, statement, params: tuple = ()):
+        sql = statement.sql if isinstance(statement, _Statement) else statement
+        try:
+            cursor = self._con.execute(sql, params)
+            self._rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            raise fdb.DatabaseError(str(e))
+        # Firebird возвращает имена столбцов в верхнем регистре
+        self.description = [(desc[0].upper(),) + tuple(desc[1:]) for desc in cursor.description or []]
+        self._stats.add(queries=1, rows=len(self._rows), bytes=len(repr(self._rows).encode()))
+
+    def fetchall(self) -> list[tuple]:
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size: int) -> list[tuple]:
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+
+class _Transaction:
+    def __init__(self, con: sqlite3.Connection, stats: DbStats):
+        self._con = con
+        self._stats = stats
+
+    def begin(self, tpb: bytes | None = None):
+        self._con.execute('BEGIN')
+
+    def commit(self):
+        if self._con.in_transaction:
+            self._con.execute('COMMIT')
+
+    def rollback(self):
+        if self._con.in_transaction:
+            self._con.execute('ROLLBACK')
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self._con, self._stats)
+
+    def close(self):
+        self.rollback()
+
+
+class SqliteConnection:
+    """Соединение SQLite, которое ведет себя как fdb.Connection для пула соединений."""
+
+    def __init__(self, path: str, stats: DbStats):
+        self._con = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES,
+                                    check_same_thread=False, isolation_level=None)
+        self._stats = stats
+        stats.add(connections=1)
+
+    def trans(self, default_tpb: bytes | None = None) -> _Transaction:
+        return _Transaction(self._con, self._stats)
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self._con, self._stats)
+
+    def db_info(self, request):
+        self._con.execute('SELECT 1').fetchone()
+        return 0
+
+    def close(self):
+        self._con.close()
+
+
+SCHEMA = [
+    "CREATE TABLE orders (orderid INTEGER PRIMARY KEY, proddate DATE)",
+    "CREATE TABLE orderitems (orderitemsid INTEGER PRIMARY KEY, orderid INTEGER, qty INTEGER)",
+    "CREATE TABLE r_systems (rsystemid INTEGER PRIMARY KEY, systemtype INTEGER)",
+    "CREATE TABLE models (modelid INTEGER PRIMARY KEY, orderitemsid INTEGER, sysprofid INTEGER)",
+    "CREATE TABLE modelparts (modelpartid INTEGER PRIMARY KEY, modelid INTEGER)",
+    "CREATE TABLE gpackettypes (gptypeid INTEGER PRIMARY KEY, rsystemid INTEGER)",
+    "CREATE TABLE modelfillings (modelfillingid INTEGER PRIMARY KEY, modelpartid INTEGER, gptypeid INTEGER)",
+    "CREATE TABLE groupgoods (grgoodsid INTEGER PRIMARY KEY, ggtypeid INTEGER, isggset INTEGER, marking VARCHAR(255))",
+    "CREATE TABLE goods (goodsid INTEGER PRIMARY KEY, grgoodsid INTEGER)",
+    "CREATE TABLE itemsdetail (itemsdetailid INTEGER PRIMARY KEY, orderitemsid INTEGER, grgoodsid INTEGER, "
+    "goodsid INTEGER, qty DOUBLE PRECISION)",
+    "CREATE TABLE itemssets (itemssetid INTEGER PRIMARY KEY, orderitemsid INTEGER, setid INTEGER, qty INTEGER)",
+    "CREATE INDEX orders_proddate ON orders (proddate)",
+    "CREATE INDEX orderitems_orderid ON orderitems (orderid)",
+    "CREATE INDEX models_orderitemsid ON models (orderitemsid)",
+    "CREATE INDEX modelparts_modelid ON modelparts (modelid)",
+    "CREATE INDEX modelfillings_modelpartid ON modelfillings (modelpartid)",
+    "CREATE INDEX itemsdetail_orderitemsid ON itemsdetail (orderitemsid)",
+    "CREATE INDEX itemssets_orderitemsid ON itemssets (orderitemsid)",
+]
+
+# Системы профиля и заполнений: (rsystemid, systemtype)
+R_SYSTEMS = [(1, 0), (2, 0), (3, 2), (8, 0), (11, 1), (21, 2), (22, 2), (30, 2)]
+PROFILE_SYSTEMS = [1, 2, 8, 11]
+GPACKET_TYPES = [(1, 3), (2, 21), (3, 22), (4, 30)]
+# Группы комплектующих: (grgoodsid, ggtypeid, isggset, marking)
+GROUP_GOODS = [
+    (46110, 5, 0, 'Москитная сетка'),
+    (500, 42, 0, 'Подоконник ПВХ'),
+    (501, 7, 0, 'Ручка'),
+    (600, 0, 1, 'Водоотлив 150'),
+    (601, 0, 1, 'Козырек'),
+    (602, 0, 1, 'Нащельник'),
+    (603, 0, 1, 'Монтажный комплект'),
+]
+
+
+def build_database(path: str, days: int, orders_per_day: int, seed: int) -> Counter:
+    """
+    Создает синтетическую базу: заказы на days дней в обе стороны от сегодня,
+    orders_per_day заказов в день, по 1–5 позиций с изделиями, заполнениями,
+    комплектующими и наборами.
+    """
+    rnd = random.Random(seed)
+    con = sqlite3.connect(path)
+    for ddl in SCHEMA:
+        con.execute(ddl)
+    con.executemany("INSERT INTO r_systems VALUES (?, ?)", R_SYSTEMS)
+    con.executemany("INSERT INTO gpackettypes VALUES (?, ?)", GPACKET_TYPES)
+    con.executemany("INSERT INTO groupgoods VALUES (?, ?, ?, ?)", GROUP_GOODS)
+    con.executemany("INSERT INTO goods VALUES (?, ?)", [(g[0], g[0]) for g in GROUP_GOODS])
+
+    sizes = Counter()
+    rows = {name: [] for name in ('orders', 'orderitems', 'models', 'modelparts', 'modelfillings',
+                                  'itemsdetail', 'itemssets')}
+    today = date.today()
+    ids = Counter()
+    for offset in range(-days, days + 1):
+        proddate = (today + timedelta(days=offset)).isoformat()
+        for _ in range(orders_per_day):
+            ids['order'] += 1
+            rows['orders'].append((ids['order'], proddate))
+            for _ in range(rnd.randint(1, 5)):
+                ids['item'] += 1
+                item_id = ids['item']
+                rows['orderitems'].append((item_id, ids['order'], rnd.randint(1, 4)))
+                if rnd.random() < 0.8:
+                    ids['model'] += 1
+                    rows['models'].append((ids['model'], item_id, rnd.choice(PROFILE_SYSTEMS)))
+                    for _ in range(rnd.randint(1, 3)):
+                        ids['part'] += 1
+                        rows['modelparts'].append((ids['part'], ids['model']))
+                        ids['filling'] += 1
+                        rows['modelfillings'].append((ids['filling'], ids['part'], rnd.choice(GPACKET_TYPES)[0]))
+                for _ in range(rnd.randint(0, 3)):
+                    group = rnd.choice(GROUP_GOODS[:3])[0]
+                    ids['detail'] += 1
+                    rows['itemsdetail'].append((ids['detail'], item_id, group, group, rnd.randint(1, 3)))
+                if rnd.random() < 0.3:
+                    ids['set'] += 1
+                    rows['itemssets'].append((ids['set'], item_id, rnd.choice(GROUP_GOODS[3:])[0], rnd.randint(1, 2)))
+
+    for table, table_rows in rows.items():
+        if table_rows:
+            placeholders = ', '.join('?' * len(table_rows[0]))
+            con.executemany(f"INSERT INTO {table} VALUES ({placeholders})", table_rows)
+        sizes[table] = len(table_rows)
+    con.commit()
+    con.close()
+    return sizes
+
+
+# --- Замена Google Sheets: лист в памяти с записью всех обращений ---
+
+class SheetsRecorder:
+    """Журнал обращений к поддельному API: метод, байты в обе стороны, длительность."""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+        self.calls = []
+
+    def record(self, method: str, sent, received, started: float):
+        time.sleep(self.latency_seconds)
+        self.calls.append({
+            'method': method,
+            'sent': len(json.dumps(sent, ensure_ascii=False, default=str).encode()) if sent is not None else 0,
+            'received': len(json.dumps(received, ensure_ascii=False, default=str).encode()) if received is not None else 0,
+            'seconds': time.perf_counter() - started
+        })
+
+
+class FakeWorksheet:
+    def __init__(self, recorder: SheetsRecorder, values: list[list[str]], title: str):
+        self._recorder = recorder
+        self.values = values
+        self.title = title
+        self.id = 0
+        self.grid_rows = max(1000, len(values))
+
+    @property
+    def row_count(self) -> int:
+        return max(self.grid_rows, len(self.values))
+
+    def get_all_values(self) -> list[list[str]]:
+        started = time.perf_counter()
+        result = copy.deepcopy(self.values)
+        self._recorder.record('get_all_values', None, result, started)
+        return result
+
+    def batch_get(self, ranges: list[str]) -> list[list[list[str]]]:
+        """Диапазоны вида '2:2' (строки) и 'A:A' (столбец), как их запрашивает зеркало."""
+        started = time.perf_counter()
+        result = []
+        for a1 in ranges:
+            first, last = a1.split(':')
+            if first.isdigit():
+                rows = copy.deepcopy(self.values[int(first) - 1:int(last)])
+            else:
+                col = sum((ord(ch) - ord('A') + 1) * 26 ** i for i, ch in enumerate(reversed(first))) - 1
+                rows = [[row[col]] if col < len(row) and row[col] != '' else [] for row in self.values]
+                while rows and not rows[-1]:
+                    rows.pop()
+            result.append(rows)
+        self._recorder.record('batch_get', ranges, result, started)
+        return result
+
+    def col_values(self, col: int) -> list[str]:
+        started = time.perf_counter()
+        result = [row[col - 1] if col - 1 < len(row) else '' for row in self.values]
+        while result and result[-1] == '':
+            result.pop()
+        self._recorder.record('col_values', None, result, started)
+        return result
+
+
+class FakeSpreadsheet:
+    def __init__(self, recorder: SheetsRecorder, worksheet: FakeWorksheet):
+        self._recorder = recorder
+        self.worksheet_obj = worksheet
+        self.id = 'benchmark-spreadsheet'
+        self.request_types = Counter()
+        self.conditional_formats = []
+        # Листы архива: sheetId -> (название, строки)
+        self.archive_sheets = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self._recorder.record('worksheet', None, None, time.perf_counter())
+        return self.worksheet_obj
+
+    def get_worksheet_by_id(self, worksheet_id: int) -> FakeWorksheet:
+        self._recorder.record('get_worksheet_by_id', None, None, time.perf_counter())
+        return self.worksheet_obj
+
+    def fetch_sheet_metadata(self, params: dict | None = None) -> dict:
+        started = time.perf_counter()
+        result = {'sheets': [{'properties': {'sheetId': self.worksheet_obj.id, 'title': self.worksheet_obj.title},
+                              'conditionalFormats': copy.deepcopy(self.conditional_formats)}]}
+        result['sheets'] += [{'properties': {'sheetId': sheet_id, 'title': title}}
+                             for sheet_id, (title, _) in self.archive_sheets.items()]
+        self._recorder.record('fetch_sheet_metadata', params, result, started)
+        return result
+
+    def batch_update(self, body: dict) -> dict:
+        started = time.perf_counter()
+        for request in body.get('requests', []):
+            (kind, payload), = request.items()
+            self.request_types[kind] += 1
+            self._apply(kind, payload)
+        response = {'spreadsheetId': self.id, 'replies': [{} for _ in body.get('requests', [])]}
+        self._recorder.record('batch_update', body, response, started)
+        return response
+
+    def _apply(self, kind: str, payload: dict):
+        values = self.worksheet_obj.values
+        if kind == 'updateCells':
+            start_row = payload['start']['rowIndex']
+            start_col = payload['start'].get('columnIndex', 0)
+            for r, row in enumerate(payload['rows']):
+                while len(values) <= start_row + r:
+                    values.append([])
+                target = values[start_row + r]
+                cells = row.get('values', [])
+                target.extend([''] * (start_col + len(cells) - len(target)))
+                for c, cell in enumerate(cells):
+                    target[start_col + c] = self._display(cell, start_row + r, start_col + c)
+        elif kind == 'insertDimension':
+            start, end = payload['range']['startIndex'], payload['range']['endIndex']
+            values[start:start] = [[] for _ in range(end - start)]
+            self.worksheet_obj.grid_rows += end - start
+        elif kind == 'appendDimension':
+            self.worksheet_obj.grid_rows += payload['length']
+        elif kind == 'deleteDimension':
+            del values[payload['range']['startIndex']:payload['range']['endIndex']]
+            self.worksheet_obj.grid_rows -= payload['range']['endIndex'] - payload['range']['startIndex']
+        elif kind == 'addSheet':
+            self.archive_sheets[payload['properties']['sheetId']] = (payload['properties']['title'], [])
+        elif kind == 'appendCells':
+            self.archive_sheets[payload['sheetId']][1].extend(
+                [self._display(cell, sheet_state.HEADER_ROW, c) for c, cell in enumerate(row.get('values', []))]
+                for row in payload['rows'])
+        elif kind == 'addConditionalFormatRule':
+            self.conditional_formats.insert(payload.get('index', 0), payload['rule'])
+
+    @staticmethod
+    def _display(cell: dict, row_index: int, column_index: int) -> str:
+        """Отображаемое значение ячейки: в столбце даты числа показываются как дд.мм.гггг."""
+        value = cell.get('userEnteredValue', {})
+        if 'numberValue' in value:
+            number = value['numberValue']
+            if column_index == 0 and row_index >= sheet_state.HEADER_ROW:
+                return (SHEETS_EPOCH + timedelta(days=int(number))).strftime('%d.%m.%Y')
+            return cell_str(float(number))
+        if 'boolValue' in value:
+            return 'TRUE' if value['boolValue'] else 'FALSE'
+        return str(value.get('stringValue', ''))
+
+
+class FakeClient:
+    def __init__(self, recorder: SheetsRecorder, spreadsheet: FakeSpreadsheet):
+        self._recorder = recorder
+        self._spreadsheet = spreadsheet
+
+    def open(self, title: str) -> FakeSpreadsheet:
+        self._recorder.record('open', None, None, time.perf_counter())
+        return self._spreadsheet
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self._recorder.record('open_by_key', None, None, time.perf_counter())
+        return self._spreadsheet
+
+
+def build_sheet(rows: int, seed: int) -> list[list[str]]:
+    """Лист с историей: rows строк по одной дате, последняя — сегодня."""
+    rnd = random.Random(seed)
+    today = date.today()
+    values = [['', '', '', '', 'Последнее обновление: —'], list(HEADER)]
+    for offset in range(rows - 1, -1, -1):
+        row_date = today - timedelta(days=offset)
+        values.append([row_date.strftime('%d.%m.%Y')] + [str(rnd.randint(0, 500)) for _ in HEADER[1:]])
+    return values
+
+
+# --- Запуск и отчет ---
+
+def _timed(stage_times: dict, name: str, fn):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stage_times[name] = stage_times.get(name, 0.0) + time.perf_counter() - started
+    return wrapper
+
+
+def run_case(sheet_rows: int, db_stats: DbStats, latency_seconds: float, seed: int, workdir: str) -> list[dict]:
+    """
+    Два запуска main.job() на листе из sheet_rows строк: с пустым зеркалом
+    и локальной историей и повторный.
+    """
+    recorder = SheetsRecorder(latency_seconds)
+    worksheet = FakeWorksheet(recorder, build_sheet(sheet_rows, seed), GOOGLE_SHEETS_CONFIG['worksheet_name'])
+    spreadsheet = FakeSpreadsheet(recorder, worksheet)
+
+    # Свежие сессия, зеркало, локальная история и очередь записи для каждого размера листа
+    if history_store._store is not None:
+        history_store._store.close()
+        history_store._store = None
+    HISTORY_CONFIG['path'] = os.path.join(workdir, f'history_{sheet_rows}.sqlite3')
+    if outbox._outbox is not None:
+        outbox._outbox.close()
+        outbox._outbox = None
+    OUTBOX_CONFIG['path'] = os.path.join(workdir, f'outbox_{sheet_rows}.sqlite3')
+    sheet_state._mirrors.clear()
+    sheets_client._sessions.clear()
+    sheets_client._clients[GOOGLE_SHEETS_CONFIG['credentials_file']] = FakeClient(recorder, spreadsheet)
+    scheduler.pending.clear()
+
+    results = []
+    for run in ('cold', 'warm'):
+        stage_times = {}
+        db_before = Counter(db_stats.counters)
+        calls_before = len(recorder.calls)
+        requests_before = sum(spreadsheet.request_types.values())
+
+        original_fetch, original_update = database.get_data_from_db, google_sheets.update_google_sheet
+        database.get_data_from_db = _timed(stage_times, 'db', original_fetch)
+        google_sheets.update_google_sheet = _timed(stage_times, 'sheets', original_update)
+        try:
+            started = time.perf_counter()
+            main.job()
+            total = time.perf_counter() - started
+        finally:
+            database.get_data_from_db, google_sheets.update_google_sheet = original_fetch, original_update
+
+        db = db_stats.counters - db_before
+        calls = recorder.calls[calls_before:]
+        results.append({
+            'sheet_rows': sheet_rows,
+            'run': run,
+            'total_s': total,
+            'db_s': stage_times.get('db', 0.0),
+            'sheets_s': stage_times.get('sheets', 0.0),
+            'api_s': sum(call['seconds'] for call in calls),
+            'db_queries': db['queries'],
+            'db_rows': db['rows'],
+            'db_bytes': db['bytes'],
+            'api_calls': len(calls),
+            'api_reads': sum(1 for call in calls if call['method'] != 'batch_update'),
+            'api_writes': sum(1 for call in calls if call['method'] == 'batch_update'),
+            'batch_requests': sum(spreadsheet.request_types.values()) - requests_before,
+            'bytes_sent': sum(call['sent'] for call in calls),
+            'bytes_received': sum(call['received'] for call in calls),
+        })
+    return results
+
+
+COLUMNS = [
+    ('sheet_rows', 'строк', '{:>7}'), ('run', 'запуск', '{:>6}'), ('total_s', 'всего,с', '{:>8.3f}'),
+    ('db_s', 'БД,с', '{:>7.3f}'), ('sheets_s', 'Sheets,с', '{:>8.3f}'), ('api_s', 'API,с', '{:>7.3f}'),
+    ('db_queries', 'SQL', '{:>4}'), ('db_rows', 'строк БД', '{:>8}'), ('api_calls', 'API', '{:>4}'),
+    ('api_reads', 'чтен.', '{:>5}'), ('api_writes', 'зап.', '{:>4}'), ('batch_requests', 'batch', '{:>5}'),
+    ('bytes_sent', 'отпр.,Б', '{:>10}'), ('bytes_received', 'получ.,Б', '{:>10}'),
+]
+
+
+def format_report(results: list[dict], header_lines: list[str]) -> str:
+    lines = list(header_lines)
+    widths = [len(fmt.format(results[0][key])) if results else len(title) for key, title, fmt in COLUMNS]
+    widths = [max(width, len(title)) for width, (_, title, _) in zip(widths, COLUMNS)]
+    lines.append('  '.join(title.rjust(width) for (_, title, _), width in zip(COLUMNS, widths)))
+    for result in results:
+        lines.append('  '.join(fmt.format(result[key]).rjust(width)
+                               for (key, _, fmt), width in zip(COLUMNS, widths)))
+    return '\n'.join(lines)
+
+
+# Сценарии запуска: (название, аргументы интерпретатора)
+STARTUP_CASES = [
+    ('import main', ['-c', 'import main']),
+    ('main.py --help', ['main.py', '--help']),
+    # Для сравнения: что стоил бы запуск, если бы база и Sheets импортировались сразу
+    ('import main + БД и Sheets', ['-c', 'import main, database, google_sheets']),
+]
+
+
+def startup_benchmark(repeats: int) -> list[dict]:
+    """Время запуска отдельного процесса Python для каждого сценария STARTUP_CASES."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for name, argv in STARTUP_CASES:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, *argv], cwd=root, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - started)
+        results.append({
+            'case': name,
+            'first_seconds': round(timings[0], 3),
+            'median_seconds': round(statistics.median(timings[1:] or timings), 3)
+        })
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк запуска синхронизации")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="Размеры листа в строках через запятую")
+    parser.add_argument('--orders-per-day', type=int, default=100, help="Заказов на одну дату производства")
+    parser.add_argument('--days', type=int, default=30, help="Дней заказов в обе стороны от сегодня")
+    parser.add_argument('--latency-ms', type=float, default=50, help="Задержка одного обращения к Sheets API")
+    parser.add_argument('--mode', default=FETCH_CONFIG['mode'], choices=['sequential', 'parallel', 'single_scan'],
+                        help="Режим выборки из базы (FETCH_CONFIG['mode'])")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Дописать отчет в файл (например, bench_output.txt)")
+    parser.add_argument('--json', action='store_true', help="Вывести результаты в JSON")
+    parser.add_argument('--verbose', action='store_true', help="Показывать журнал приложения")
+    parser.add_argument('--startup', action='store_true', help="Измерить время запуска процесса вместо цикла")
+    parser.add_argument('--repeats', type=int, default=5, help="Повторов каждого сценария запуска (--startup)")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = startup_benchmark(max(1, args.repeats))
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        lines = [f"Запуск процесса {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}: повторов {args.repeats}",
+                 f"{'сценарий':<30}{'первый,с':>10}{'медиана,с':>11}"]
+        lines += [f"{r['case']:<30}{r['first_seconds']:>10.3f}{r['median_seconds']:>11.3f}" for r in results]
+        report = '\n'.join(lines)
+        print(report)
+        if args.output:
+            with open(args.output, 'a', encoding='utf-8') as f:
+                f.write(report + '\n\n')
+        return
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    FETCH_CONFIG['mode'] = args.mode
+    # Отпечатки дат используют RDB$RECORD_VERSION, которого нет в SQLite
+    INCREMENTAL_CONFIG['enabled'] = False
+    # Повторный запуск измеряется с локальной историей и очередью записи (по умолчанию выключены)
+    HISTORY_CONFIG['enabled'] = True
+    OUTBOX_CONFIG['enabled'] = True
+    # Сводка запуска бенчмарка не должна затирать сводку рабочего процесса
+    INSTRUMENTATION_CONFIG['summary_file'] = ''
+    # Измеряем число обращений, а не ожидание квоты
+    scheduler.budgets = {'read': 10 ** 9, 'write': 10 ** 9}
+
+    db_stats = DbStats()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'altawin.sqlite')
+        started = time.perf_counter()
+        table_sizes = build_database(db_path, args.days, args.orders_per_day, args.seed)
+        build_seconds = time.perf_counter() - started
+
+        original_connect = fdb.connect
+        fdb.connect = lambda **kwargs: SqliteConnection(db_path, db_stats)
+        try:
+            results = []
+            for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+                results.extend(run_case(size, db_stats, args.latency_ms / 1000, args.seed, tmp))
+        finally:
+            fdb.connect = original_connect
+            if history_store._store is not None:
+                history_store._store.close()
+            if outbox._outbox is not None:
+                outbox._outbox.close()
+            from db_pool import close_all_pools
+            close_all_pools()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    header_lines = [
+        f"Бенчмарк {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}: режим {args.mode}, "
+        f"задержка API {args.latency_ms:g} мс, база построена за {build_seconds:.1f} с",
+        "База: " + ', '.join(f"{table} {count}" for table, count in table_sizes.items()),
+    ]
+    report = format_report(results, header_lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(report + '\n\n')
+
+
+if __name__ == '__main__':
+    main_cli()
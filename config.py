@@ -1,118 +1,410 @@
+import json
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Настройки подключения к базе данных Altawin
+# Настройки подключения к базе данных Altawin.
+# Для локальной встроенной (embedded) базы оставьте DB_HOST и DB_PORT пустыми.
 DB_CONFIG = {
-    'host': os.getenv('DB_HOST', '10.8.0.3'),
-    'port': int(os.getenv('DB_PORT', '3050')),
+    'host': os.getenv('DB_HOST', '10.8.0.3') or None,
+    'port': int(os.getenv('DB_PORT', '3050')) if os.getenv('DB_PORT', '3050') else None,
     'database': os.getenv('DB_DATABASE', 'D:/altAwinDB/ppk.gdb'),
     'user': os.getenv('DB_USER', 'sysdba'),
     'password': os.getenv('DB_PASSWORD', 'masterkey'),
     'charset': os.getenv('DB_CHARSET', 'WIN1251')
 }
 
+# Режим выборки данных из базы:
+#   sequential — все запросы показателей (metrics.py) по очереди на одном соединении;
+#   parallel   — каждый запрос в своем потоке на соединении из пула,
+#                все потоки читают один согласованный снимок;
+#   single_scan — один проход по orders/orderitems (RAW_EXTRACT_QUERY),
+#                показатели считаются в Python (pandas);
+#   summary    — чтение сводной таблицы в базе, которую поддерживают
+#                триггеры и процедура пересчета (установка: python summary.py install);
+#                без установленной сводной таблицы — как sequential.
+FETCH_CONFIG = {
+    'mode': os.getenv('DB_FETCH_MODE', 'sequential'),
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '4')),
+    # Объединять показатели с общими соединениями в один запрос (metrics.py);
+    # 0 — отдельный запрос на каждый показатель
+    'fuse_metrics': os.getenv('DB_FUSE_METRICS', '1') == '1'
+}
+
+# Переподключение к базе данных при обрыве связи
+RECONNECT_CONFIG = {
+    'attempts': int(os.getenv('DB_RECONNECT_ATTEMPTS', '5')),
+    'backoff_seconds': float(os.getenv('DB_RECONNECT_BACKOFF', '2')),
+    'max_backoff_seconds': float(os.getenv('DB_RECONNECT_MAX_BACKOFF', '60'))
+}
+
+# Инкрементальная синхронизация: по каждой дате хранится отпечаток строк
+# orders/orderitems и последние значения показателей, пересчитываются
+# и отправляются в таблицу только изменившиеся даты
+INCREMENTAL_CONFIG = {
+    'enabled': os.getenv('INCREMENTAL_SYNC', '0') == '1',
+    'state_file': os.getenv('INCREMENTAL_STATE_FILE', 'sync_state.json'),
+    # Полный пересчет всего периода раз в N минут — страховка от изменений,
+    # которые не затрагивают orders/orderitems (например, правка состава изделия),
+    # и от правок листа вручную: лист перечитывается и все строки сверяются с ним
+    'full_refresh_minutes': int(os.getenv('INCREMENTAL_FULL_REFRESH_MINUTES', '60'))
+}
+
+# Локальная история дневных показателей (SQLite, history_store.py):
+# пополняется после каждой выборки из базы, отдает устоявшиеся даты
+# без запросов к Firebird и служит источником для пересборки листа.
+# Включается явно: HISTORY_STORE=1
+HISTORY_CONFIG = {
+    'enabled': os.getenv('HISTORY_STORE', '0') == '1',
+    'path': os.getenv('HISTORY_STORE_PATH', 'history.sqlite3'),
+    # Дата считается устоявшейся, если она раньше сегодняшней на N дней и более
+    'settled_after_days': int(os.getenv('HISTORY_SETTLED_AFTER_DAYS', '3')),
+    # Как долго устоявшаяся дата берется из истории, прежде чем перечитать ее из базы
+    'settled_max_age_minutes': int(os.getenv('HISTORY_SETTLED_MAX_AGE_MINUTES', '60'))
+}
+
+# Очередь записи на лист (SQLite, outbox.py): строки, не записанные из-за
+# ошибки Google Sheets, сохраняются с последним значением каждой ячейки
+# и отправляются одной записью после восстановления API.
+# Включается явно: SHEETS_OUTBOX=1
+OUTBOX_CONFIG = {
+    'enabled': os.getenv('SHEETS_OUTBOX', '0') == '1',
+    'path': os.getenv('SHEETS_OUTBOX_PATH', 'outbox.sqlite3')
+}
+
+# Историческая загрузка (python backfill.py --since ... --until ...)
+BACKFILL_CONFIG = {
+    # Длина одного периода выборки в днях
+    'chunk_days': int(os.getenv('BACKFILL_CHUNK_DAYS', '31')),
+    # Сколько периодов выбирается из базы одновременно
+    'parallel_chunks': int(os.getenv('BACKFILL_PARALLEL_CHUNKS', '2')),
+    # Размер порции fetchmany
+    'fetch_batch_size': int(os.getenv('BACKFILL_FETCH_BATCH_SIZE', '1000')),
+    # Ограничения одной записи на лист: объем тела batchUpdate (Google
+    # рекомендует не более 2 МБ) и количество строк
+    'max_write_bytes': int(os.getenv('BACKFILL_MAX_WRITE_BYTES', '1000000')),
+    'max_write_rows': int(os.getenv('BACKFILL_MAX_WRITE_ROWS', '2000')),
+    # Файл контрольной точки: с него продолжается прерванная загрузка
+    'checkpoint_file': os.getenv('BACKFILL_CHECKPOINT_FILE', 'backfill_checkpoint.json')
+}
+
+# Обновление по событиям Firebird (POST_EVENT из триггеров на orders/orderitems,
+# установка: python events.py install). Таймер остается резервным запуском.
+EVENTS_CONFIG = {
+    'enabled': os.getenv('DB_EVENTS', '0') == '1',
+    # Пауза без новых событий, после которой запускается обновление
+    'debounce_seconds': float(os.getenv('DB_EVENTS_DEBOUNCE', '5')),
+    # Максимальная задержка обновления при непрерывном потоке изменений;
+    # через столько же секунд повторяется неудавшееся обновление по событию
+    'max_delay_seconds': float(os.getenv('DB_EVENTS_MAX_DELAY', '60'))
+}
+
+# Метрики и сводка запусков (instrumentation.py)
+INSTRUMENTATION_CONFIG = {
+    # Порт HTTP-сервера с /metrics (Prometheus) и /summary (JSON); 0 — не запускать
+    'port': int(os.getenv('METRICS_PORT', '0')),
+    'host': os.getenv('METRICS_HOST', '127.0.0.1'),
+    # Файл с JSON-сводками последних запусков по каждой цели; пусто — не сохранять
+    'summary_file': os.getenv('RUN_SUMMARY_FILE', 'run_summary.json'),
+    # Бюджет одного цикла (интервал расписания) и доля, после которой пишется предупреждение
+    'cycle_budget_seconds': float(os.getenv('CYCLE_BUDGET_SECONDS', '300')),
+    'budget_warning_ratio': float(os.getenv('CYCLE_BUDGET_WARNING_RATIO', '0.8'))
+}
+
 # Настройки Google Sheets
 GOOGLE_SHEETS_CONFIG = {
     'credentials_file': os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json'),
     'spreadsheet_name': os.getenv('GOOGLE_SPREADSHEET_NAME', 'FMO Altawin'),
-    'worksheet_name': os.getenv('GOOGLE_WORKSHEET_NAME', 'Лист1')
+    'worksheet_name': os.getenv('GOOGLE_WORKSHEET_NAME', 'Лист1'),
+    # Ключ таблицы и идентификатор листа: если заданы, таблица открывается
+    # напрямую по ключу, без поиска по имени через Drive
+    'spreadsheet_id': os.getenv('GOOGLE_SPREADSHEET_ID', ''),
+    'worksheet_id': int(os.environ['GOOGLE_WORKSHEET_ID']) if os.getenv('GOOGLE_WORKSHEET_ID') else None,
+    # Окно отображения: видны строки от сегодня минус window_days_before
+    # до сегодня плюс window_days_after, остальные скрыты
+    'window_days_before': int(os.getenv('SHEET_WINDOW_DAYS_BEFORE', '2')),
+    'window_days_after': int(os.getenv('SHEET_WINDOW_DAYS_AFTER', '5')),
+    # Архивация: строки старше archive_after_days дней переносятся на лист
+    # архива (шаблон имени, {year} — год даты строки), чтобы рабочий лист
+    # не рос. 0 — архивация отключена. Значение должно быть больше периода
+    # выгрузки (14 дней), иначе архивные даты будут снова добавляться на лист
+    'archive_after_days': int(os.getenv('SHEET_ARCHIVE_AFTER_DAYS', '0')),
+    'archive_worksheet': os.getenv('SHEET_ARCHIVE_WORKSHEET', 'Архив {year}'),
+    # Перенос выполняется пачкой, когда набирается не меньше стольких строк
+    'archive_min_rows': int(os.getenv('SHEET_ARCHIVE_MIN_ROWS', '30'))
 }
 
-# SQL-запросы
-SQL_QUERIES = {
-    'izd_pvh': """
-        SELECT
-            o.proddate,
-            SUM(oi.qty) AS qty_izd_pvh
-        FROM orders o
-        JOIN orderitems oi ON oi.orderid = o.orderid
+# Цели синхронизации: каждая — своя база Altawin и свой лист Google Sheets.
+# Список задается JSON-файлом TARGETS_FILE:
+#   [{"name": "site1", "db": {"host": "10.8.0.3", "database": "D:/db/ppk.gdb"},
+#     "sheets": {"spreadsheet_id": "...", "worksheet_name": "Лист1"}}, ...]
+# Поля db и sheets дополняют DB_CONFIG и GOOGLE_SHEETS_CONFIG. Без файла
+# обслуживается одна цель 'default' из настроек выше.
+TARGETS_CONFIG = {
+    'file': os.getenv('TARGETS_FILE', ''),
+    # Сколько целей обрабатывается одновременно
+    'max_parallel': int(os.getenv('TARGETS_MAX_PARALLEL', '4'))
+}
+
+
+def _load_targets() -> list[dict]:
+    if not TARGETS_CONFIG['file']:
+        return [{'name': 'default', 'db': DB_CONFIG, 'sheets': GOOGLE_SHEETS_CONFIG}]
+    with open(TARGETS_CONFIG['file'], encoding='utf-8') as f:
+        targets = json.load(f)
+    names = [target['name'] for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Имена целей в {TARGETS_CONFIG['file']} должны быть уникальны: {names}")
+    return [
+        {
+            'name': target['name'],
+            'db': {**DB_CONFIG, **target.get('db', {})},
+            'sheets': {**GOOGLE_SHEETS_CONFIG, **target.get('sheets', {})}
+        }
+        for target in targets
+    ]
+
+
+TARGETS = _load_targets()
+
+# Расписание циклов (scheduling.py). Даты периода выгрузки делятся на полосы
+# со своей частотой обновления:
+#   hot     — сегодня и завтра: раз в hot_seconds в часы смены
+#             [shift_start, shift_end), вне смены — раз в hot_offshift_seconds;
+#   recent  — остальные неустоявшиеся даты: раз в recent_seconds;
+#   settled — устоявшиеся даты (HISTORY_CONFIG['settled_after_days']): раз в settled_seconds.
+SCHEDULER_CONFIG = {
+    'shift_start': os.getenv('SHIFT_START', '07:00'),
+    'shift_end': os.getenv('SHIFT_END', '20:00'),
+    'hot_seconds': int(os.getenv('SCHEDULE_HOT_SECONDS', '60')),
+    'hot_offshift_seconds': int(os.getenv('SCHEDULE_HOT_OFFSHIFT_SECONDS', '300')),
+    'recent_seconds': int(os.getenv('SCHEDULE_RECENT_SECONDS', '300')),
+    'settled_seconds': int(os.getenv('SCHEDULE_SETTLED_SECONDS', '3600')),
+    # Сторожевой таймер: цикл дольше стольких секунд считается зависшим
+    'cycle_timeout_seconds': int(os.getenv('SCHEDULE_CYCLE_TIMEOUT_SECONDS', '240')),
+    # Завершить процесс при зависшем цикле. Зависший поток нельзя прервать, и цель
+    # остается занятой; выход помогает, только если процесс перезапускает служба
+    # (systemd, NSSM, планировщик заданий). Без нее — 0: зависание только в журнал
+    'exit_on_hang': os.getenv('SCHEDULE_EXIT_ON_HANG', '0') == '1',
+    # Повтор полосы после неудачного цикла — не позже чем через столько секунд
+    'retry_seconds': int(os.getenv('SCHEDULE_RETRY_SECONDS', '60')),
+    # Таймаут HTTP-запросов к Google Sheets, секунд
+    'sheets_http_timeout_seconds': float(os.getenv('SHEETS_HTTP_TIMEOUT', '60'))
+}
+
+# Квота Sheets API (по умолчанию — лимиты Google на пользователя в минуту)
+# и повторы при ошибках 429/5xx
+SHEETS_QUOTA_CONFIG = {
+    'read_per_minute': int(os.getenv('SHEETS_READS_PER_MINUTE', '60')),
+    'write_per_minute': int(os.getenv('SHEETS_WRITES_PER_MINUTE', '60')),
+    'max_retries': int(os.getenv('SHEETS_MAX_RETRIES', '5')),
+    'backoff_seconds': float(os.getenv('SHEETS_BACKOFF', '1')),
+    'max_backoff_seconds': float(os.getenv('SHEETS_MAX_BACKOFF', '64'))
+}
+
+# Реестр показателей. Каждый показатель — один столбец таблицы:
+#   name    — короткое имя для логов;
+#   key     — имя столбца результата запроса;
+#   label   — заголовок столбца в Google Sheets;
+#   default — значение для дат, по которым в базе нет строк;
+#   joins   — соединения после "orders o JOIN orderitems oi";
+#   filter  — условие отбора строк;
+#   value   — суммируемое выражение.
+# Показатели с одинаковыми joins считаются одним запросом (см. metrics.py),
+# поэтому новый показатель на уже используемых таблицах не добавляет
+# проходов по базе. Порядок в списке — порядок столбцов в таблице.
+# Режимы sequential и parallel правок кода не требуют; для single_scan нужно
+# условие в single_scan.METRIC_MASKS (и, если нужно, столбцы в RAW_EXTRACT_QUERY),
+# иначе процесс в этом режиме не запустится; для summary — python summary.py install
+# (до установки режим summary выбирает данные как sequential).
+MODELS_JOINS = """
         JOIN models m ON m.orderitemsid = oi.orderitemsid
         JOIN r_systems rs ON rs.rsystemid = m.sysprofid
-        WHERE o.proddate BETWEEN ? AND ?
-            AND rs.systemtype = 0
-            AND rs.rsystemid <> 8
-        GROUP BY o.proddate
-    """,
-    'razdv': """
-        SELECT
-            o.proddate,
-            SUM(oi.qty) AS qty_razdv
-        FROM orders o
-        JOIN orderitems oi ON oi.orderid = o.orderid
+"""
+
+FILLINGS_JOINS = """
         JOIN models m ON m.orderitemsid = oi.orderitemsid
+        JOIN modelparts mp ON mp.modelid = m.modelid
+        JOIN modelfillings mf ON mf.modelpartid = mp.modelpartid
+        JOIN gpackettypes gp ON gp.gptypeid = mf.gptypeid
+        JOIN r_systems rs ON rs.rsystemid = gp.rsystemid
+"""
+
+METRICS = [
+    {
+        'name': 'izd_pvh',
+        'key': 'QTY_IZD_PVH',
+        'label': 'Изделия',
+        'default': 0,
+        'joins': MODELS_JOINS,
+        'filter': "rs.systemtype = 0 AND rs.rsystemid <> 8",
+        'value': "oi.qty"
+    },
+    {
+        'name': 'razdv',
+        'key': 'QTY_RAZDV',
+        'label': 'Раздвижки',
+        'default': 0,
+        'joins': MODELS_JOINS,
+        'filter': "(rs.systemtype = 1) OR (rs.rsystemid = 8)",
+        'value': "oi.qty"
+    },
+    {
+        'name': 'mosnet',
+        'key': 'QTY_MOSNET',
+        'label': 'МС',
+        'default': 0,
+        'joins': """
+        JOIN itemsdetail itd ON itd.orderitemsid = oi.orderitemsid
+""",
+        'filter': "itd.grgoodsid = 46110",
+        'value': "oi.qty * itd.qty"
+    },
+    {
+        'name': 'glass_packs',
+        'key': 'QTY_GLASS_PACKS',
+        'label': 'СП и стекла',
+        'default': 0,
+        'joins': FILLINGS_JOINS,
+        'filter': "rs.rsystemid IN (3, 21)",
+        'value': "oi.qty"
+    },
+    {
+        'name': 'sandwiches',
+        'key': 'QTY_SANDWICHES',
+        'label': 'Сэндвичи',
+        'default': 0,
+        'joins': FILLINGS_JOINS,
+        'filter': "rs.rsystemid IN (22)",
+        'value': "oi.qty"
+    },
+    {
+        'name': 'windowsills',
+        'key': 'QTY_WINDOWSILLS',
+        'label': 'Подоконники',
+        'default': 0,
+        'joins': """
+        JOIN itemsdetail i ON i.orderitemsid = oi.orderitemsid
+        JOIN goods g ON i.goodsid = g.goodsid
+        JOIN groupgoods gg ON i.grgoodsid = gg.grgoodsid
+""",
+        'filter': "gg.ggtypeid = 42",
+        'value': "i.qty * oi.qty"
+    },
+    {
+        'name': 'iron',
+        'key': 'QTY_IRON',
+        'label': 'Железо',
+        'default': 0,
+        'joins': """
+        JOIN itemssets its ON its.orderitemsid = oi.orderitemsid
+        JOIN groupgoods gg ON gg.grgoodsid = its.setid
+""",
+        'filter': "gg.isggset = 1 AND ((gg.marking LIKE '%Водоотлив%') OR (gg.marking LIKE '%Железо%') "
+                  "OR (gg.marking LIKE '%Козырек%') OR (gg.marking LIKE '%Нащельник%'))",
+        'value': "oi.qty * its.qty"
+    }
+]
+
+# Выборка фактов уровня позиции заказа за один проход по orders/orderitems
+# для режима single_scan. Каждая строка — одна связанная запись
+# (модель, заполнение, комплектующая или набор) с атрибутами, по которым
+# в single_scan.py вычисляются все показатели METRICS.
+#   SOURCE: 1 — models, 2 — modelfillings, 3 — itemsdetail, 4 — itemssets
+RAW_EXTRACT_QUERY = """
+    SELECT
+        o.proddate,
+        CAST(oi.qty AS DOUBLE PRECISION) AS item_qty,
+        f.source,
+        f.rsystemid,
+        f.systemtype,
+        f.grgoodsid,
+        f.ggtypeid,
+        f.marking,
+        f.detail_qty
+    FROM orders o
+    JOIN orderitems oi ON oi.orderid = o.orderid
+    JOIN (
+        SELECT
+            m.orderitemsid,
+            1 AS source,
+            rs.rsystemid,
+            rs.systemtype,
+            CAST(NULL AS INTEGER) AS grgoodsid,
+            CAST(NULL AS INTEGER) AS ggtypeid,
+            CAST(NULL AS VARCHAR(255)) AS marking,
+            CAST(1 AS DOUBLE PRECISION) AS detail_qty
+        FROM models m
         JOIN r_systems rs ON rs.rsystemid = m.sysprofid
-        WHERE o.proddate BETWEEN ? AND ?
-            AND ((rs.systemtype = 1) OR (rs.rsystemid = 8))
-        GROUP BY o.proddate
-    """,
-    'mosnet': """
+        WHERE rs.systemtype IN (0, 1) OR rs.rsystemid = 8
+
+        UNION ALL
+
         SELECT
-            o.proddate,
-            SUM(oi.qty * itd.qty) AS qty_mosnet
-        FROM orders o
-        JOIN orderitems oi ON oi.orderid = o.orderid
-        JOIN itemsdetail itd ON itd.orderitemsid = oi.orderitemsid
-        WHERE o.proddate BETWEEN ? AND ?
-            AND itd.grgoodsid = 46110
-        GROUP BY o.proddate
-    """,
-    'glass_packs': """
-        select
-            o.proddate,
-            sum(oi.qty) as qty_glass_packs
-        from orders o
-        join orderitems oi on oi.orderid = o.orderid
-        join models m on m.orderitemsid = oi.orderitemsid
-        join modelparts mp on mp.modelid = m.modelid
-        join modelfillings mf on mf.modelpartid = mp.modelpartid
-        join gpackettypes gp on gp.gptypeid = mf.gptypeid
-        join r_systems rs on rs.rsystemid = gp.rsystemid
-        where o.proddate between ? and ?
-        and rs.rsystemid in (3, 21)
-        group by o.proddate
-    """,
-    'sandwiches': """
-        select
-            o.proddate,
-            sum(oi.qty) as qty_sandwiches
-        from orders o
-        join orderitems oi on oi.orderid = o.orderid
-        join models m on m.orderitemsid = oi.orderitemsid
-        join modelparts mp on mp.modelid = m.modelid
-        join modelfillings mf on mf.modelpartid = mp.modelpartid
-        join gpackettypes gp on gp.gptypeid = mf.gptypeid
-        join r_systems rs on rs.rsystemid = gp.rsystemid
-        where o.proddate between ? and ?
-        and rs.rsystemid in (22)
-        group by o.proddate
-    """,
-    'windowsills': """
-        select
-            o.proddate,
-            sum(i.qty * oi.qty) as qty_windowsills
-        from orderitems oi
-        join orders o on o.orderid = oi.orderid
-        join itemsdetail i on i.orderitemsid = oi.orderitemsid
-        join goods g on i.goodsid = g.goodsid
-        join groupgoods gg on i.grgoodsid = gg.grgoodsid
-        where o.proddate between ? and ?
-        and gg.ggtypeid = 42
-        group by
-            o.proddate
-    """,
-    'iron': """
-        select
-            o.proddate,
-            sum(oi.qty * its.qty) as qty_iron
-        from orderitems oi
-        join orders o on o.orderid = oi.orderid
-        join itemssets its on its.orderitemsid = oi.orderitemsid
-        join groupgoods gg on gg.grgoodsid = its.setid
-        where o.proddate between ? and ?
-        and gg.isggset = 1
-        and ((gg.marking like '%Водоотлив%') or (gg.marking like '%Железо%') or (gg.marking like '%Козырек%') or (gg.marking like '%Нащельник%'))
-        group by o.proddate
-    """
-}
+            m.orderitemsid,
+            2,
+            rs.rsystemid,
+            rs.systemtype,
+            NULL,
+            NULL,
+            NULL,
+            1
+        FROM models m
+        JOIN modelparts mp ON mp.modelid = m.modelid
+        JOIN modelfillings mf ON mf.modelpartid = mp.modelpartid
+        JOIN gpackettypes gp ON gp.gptypeid = mf.gptypeid
+        JOIN r_systems rs ON rs.rsystemid = gp.rsystemid
+        WHERE rs.rsystemid IN (3, 21, 22)
+
+        UNION ALL
+
+        SELECT
+            itd.orderitemsid,
+            3,
+            NULL,
+            NULL,
+            itd.grgoodsid,
+            CASE WHEN g.goodsid IS NOT NULL THEN gg.ggtypeid END,
+            NULL,
+            itd.qty
+        FROM itemsdetail itd
+        LEFT JOIN goods g ON g.goodsid = itd.goodsid
+        LEFT JOIN groupgoods gg ON gg.grgoodsid = itd.grgoodsid
+        WHERE itd.grgoodsid = 46110 OR gg.ggtypeid = 42
+
+        UNION ALL
+
+        SELECT
+            its.orderitemsid,
+            4,
+            NULL,
+            NULL,
+            NULL,
+            NULL,
+            gg.marking,
+            its.qty
+        FROM itemssets its
+        JOIN groupgoods gg ON gg.grgoodsid = its.setid
+        WHERE gg.isggset = 1
+    ) f ON f.orderitemsid = oi.orderitemsid
+    WHERE o.proddate BETWEEN ? AND ?
+"""
+
+# Отпечаток строк orders/orderitems по каждой дате для инкрементальной
+# синхронизации. RDB$RECORD_VERSION (Firebird 3.0+) — номер транзакции,
+# последней изменившей запись; количество и суммы ловят удаление строк.
+FINGERPRINT_QUERY = """
+    SELECT
+        o.proddate,
+        COUNT(DISTINCT o.orderid) AS orders_count,
+        COUNT(oi.orderitemsid) AS items_count,
+        SUM(oi.orderitemsid) AS items_id_sum,
+        SUM(oi.qty) AS items_qty_sum,
+        MAX(o.rdb$record_version) AS orders_version,
+        MAX(oi.rdb$record_version) AS items_version
+    FROM orders o
+    LEFT JOIN orderitems oi ON oi.orderid = o.orderid
+    WHERE o.proddate BETWEEN ? AND ?
+    GROUP BY o.proddate
+"""
@@ -1,72 +1,314 @@
+import contextvars
 import fdb
 import logging
-from config import DB_CONFIG, SQL_QUERIES
+import queue
+from aggregates import DailyAggregates
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from config import DB_CONFIG, FETCH_CONFIG, FINGERPRINT_QUERY, RAW_EXTRACT_QUERY
 from datetime import date, datetime
+from db_pool import ConnectionPool, PooledConnection, get_pool, snapshot_tpb
+from instrumentation import inc, span
+from metrics import SQL_QUERIES
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_data_from_db(start_date: date, end_date: date) -> list[dict] | None:
+def _execute(pooled: PooledConnection, name: str, query: str, params: tuple) -> tuple[list[str], list[tuple]]:
+    """Выполняет запрос с замером времени и учетом выбранных строк."""
+    with span('db_query', query=name):
+        columns, rows = pooled.execute(query, params)
+    inc('db_rows_fetched', len(rows), query=name)
+    return columns, rows
+
+def _query_metrics(pooled: PooledConnection, date1_str: str, date2_str: str) -> DailyAggregates:
+    """Выполняет все запросы показателей по очереди в текущей транзакции соединения."""
+    all_data = DailyAggregates.empty()
+    for key, query in SQL_QUERIES.items():
+        logging.info(f"Выполнение SQL-запроса для: {key}...")
+        columns, rows = _execute(pooled, key, query, (date1_str, date2_str))
+        with span('db_merge'):
+            # Пустые (NULL) показатели не переносятся — для них подставится значение по умолчанию
+            all_data = all_data.merge(DailyAggregates.from_query(columns, rows))
+    return all_data
+
+def _fetch_sequential(pool: ConnectionPool, date1_str: str, date2_str: str) -> DailyAggregates:
+    """
+    Выполняет все запросы по очереди на одном соединении из пула.
+    """
+    with pool.connection() as pooled:
+        pooled.begin()
+        try:
+            return _query_metrics(pooled, date1_str, date2_str)
+        finally:
+            pooled.commit()
+
+def _get_snapshot_number(pooled: PooledConnection) -> int | None:
+    """
+    Возвращает номер снимка текущей транзакции (Firebird 4.0+) или None,
+    если сервер не поддерживает общие снимки.
+    """
+    try:
+        _, rows = pooled.execute("SELECT RDB$GET_CONTEXT('SYSTEM', 'SNAPSHOT_NUMBER') FROM RDB$DATABASE")
+        value = rows[0][0]
+        return int(value) if value is not None else None
+    except fdb.Error:
+        return None
+
+def _fetch_parallel(pool: ConnectionPool, date1_str: str, date2_str: str) -> DailyAggregates:
+    """
+    Выполняет каждый запрос в отдельном потоке на своем соединении из пула.
+
+    Все транзакции открываются до начала выполнения запросов. В Firebird 4.0+
+    они присоединяются к снимку первой транзакции, поэтому все потоки видят
+    одно и то же состояние базы. На более старых серверах транзакции
+    стартуют одновременно, но каждая получает собственный снимок.
+
+    Ожидает свободного места в пуле только первое соединение; остальные
+    берутся без ожидания, сколько есть свободных. Иначе две одновременные
+    выборки на общем пуле (несколько целей на одной базе, обновление по
+    событию во время цикла) могли бы держать часть соединений и ждать
+    друг друга бесконечно. Без свободных соединений все запросы
+    выполняются на первом.
+    """
+    workers = min(pool.max_size, len(SQL_QUERIES))
+    with ExitStack() as stack:
+        connections = queue.Queue()
+
+        leader = stack.enter_context(pool.connection())
+        leader.begin()
+        stack.callback(leader.commit)
+        snapshot_number = _get_snapshot_number(leader)
+        if snapshot_number is None:
+            logging.warning("Сервер не поддерживает общий снимок (нужен Firebird 4.0+). "
+                            "Потоки будут читать каждый свой снимок.")
+        connections.put(leader)
+
+        for _ in range(workers - 1):
+            pooled = stack.enter_context(pool.connection(blocking=False))
+            if pooled is None:
+                break
+            pooled.begin(snapshot_tpb(snapshot_number))
+            stack.callback(pooled.commit)
+            connections.put(pooled)
+        workers = connections.qsize()
+
+        def run_query(key: str, query: str):
+            pooled = connections.get()
+            try:
+                logging.info(f"Выполнение SQL-запроса для: {key}...")
+                return _execute(pooled, key, query, (date1_str, date2_str))
+            finally:
+                connections.put(pooled)
+
+        logging.info(f"Параллельное выполнение {len(SQL_QUERIES)} запросов в {workers} потоках...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Копия контекста переносит в поток текущий запуск (метка цели в метриках)
+            futures = [executor.submit(contextvars.copy_context().run, run_query, key, query)
+                       for key, query in SQL_QUERIES.items()]
+            results = [future.result() for future in futures]
+
+    # Объединяем в порядке SQL_QUERIES, как и при последовательной выборке
+    all_data = DailyAggregates.empty()
+    with span('db_merge'):
+        for columns, rows in results:
+            all_data = all_data.merge(DailyAggregates.from_query(columns, rows))
+    return all_data
+
+def _fetch_single_scan(pool: ConnectionPool, date1_str: str, date2_str: str) -> DailyAggregates:
+    """
+    Выбирает факты уровня позиции заказа за период одним запросом
+    и вычисляет показатели на стороне приложения.
+    """
+    # pandas нужен только в этом режиме
+    from single_scan import aggregate_facts
+
+    with pool.connection() as pooled:
+        pooled.begin()
+        try:
+            logging.info("Выполнение единого SQL-запроса выборки фактов...")
+            columns, rows = _execute(pooled, 'raw_extract', RAW_EXTRACT_QUERY, (date1_str, date2_str))
+        finally:
+            pooled.commit()
+    logging.info(f"Получено строк фактов: {len(rows)}. Расчет показателей...")
+    with span('db_merge'):
+        return aggregate_facts(columns, rows)
+
+def _fetch_summary(pool: ConnectionPool, date1_str: str, date2_str: str) -> DailyAggregates | None:
+    """
+    Пересчитывает отмеченные триггерами даты сводной таблицы (summary.py)
+    и читает период из нее одним проходом по индексу.
+
+    Returns:
+        None, если сводная таблица не установлена, устарела или пересчет
+        не удался (например, его одновременно выполняет другой процесс).
+    """
+    from summary import REFRESH_SQL, REFRESH_TPB, SIGNATURE_QUERY, SUMMARY_QUERY, procedure_signature
+
+    try:
+        with pool.connection() as pooled:
+            pooled.begin(REFRESH_TPB)
+            try:
+                _, rows = pooled.execute(SIGNATURE_QUERY)
+                if not rows or rows[0][0].strip() != procedure_signature():
+                    logging.warning("Сводная таблица не установлена или устарела (python summary.py install) — "
+                                    "выборка выполняется запросами показателей.")
+                    return None
+                with span('db_query', query='summary_refresh'):
+                    _, rows = pooled.execute(REFRESH_SQL)
+                refreshed = rows[0][0]
+                columns, rows = _execute(pooled, 'summary', SUMMARY_QUERY, (date1_str, date2_str))
+            finally:
+                pooled.commit()
+    except fdb.Error as e:
+        logging.warning(f"Сводная таблица недоступна, выборка выполняется запросами показателей: {e}")
+        inc('summary_fallbacks')
+        return None
+
+    logging.info(f"Сводная таблица: пересчитано измененных дат {refreshed}.")
+    inc('summary_dates_refreshed', refreshed)
+    with span('db_merge'):
+        return DailyAggregates.from_cells(rows)
+
+def get_data_from_db(start_date: date, end_date: date, db_config: dict = DB_CONFIG) -> DailyAggregates | None:
     """
-    Подключается к базе данных Firebird, выполняет 5 отдельных запросов,
-    объединяет результаты и возвращает их.
+    Выполняет запросы показателей (metrics.SQL_QUERIES) на постоянном
+    соединении с базой данных Firebird, объединяет результаты и возвращает их.
+
+    В режиме FETCH_CONFIG['mode'] == 'parallel' запросы выполняются
+    одновременно на пуле соединений, в режиме 'single_scan' данные
+    выбираются одним запросом и агрегируются в приложении, в режиме
+    'summary' читаются из сводной таблицы в базе (summary.py).
 
     Args:
         start_date: Начальная дата для выборки.
         end_date: Конечная дата для выборки.
+        db_config: База цели (по умолчанию DB_CONFIG).
 
     Returns:
-        Список словарей с данными или None в случае ошибки.
+        Показатели по датам, где в базе есть строки, или None в случае ошибки.
     """
     try:
-        logging.info("Подключение к базе данных Firebird...")
-        con = fdb.connect(**DB_CONFIG)
-        cur = con.cursor()
-        
         date1_str = start_date.strftime('%Y-%m-%d')
         date2_str = end_date.strftime('%Y-%m-%d')
-        
-        all_data = {}
-
-        for key, query in SQL_QUERIES.items():
-            logging.info(f"Выполнение SQL-запроса для: {key}...")
-            cur.execute(query, (date1_str, date2_str))
-            
-            columns = [desc[0] for desc in cur.description]
-            
-            for row in cur.fetchall():
-                row_dict = dict(zip(columns, row))
-                proddate = row_dict.pop('PRODDATE')
-                
-                if isinstance(proddate, datetime):
-                    proddate = proddate.date()
-
-                if proddate not in all_data:
-                    all_data[proddate] = {'PRODDATE': proddate}
-                
-                all_data[proddate].update(row_dict)
+
+        # Пул живет все время работы процесса: соединения и подготовленные
+        # запросы переиспользуются между запусками по расписанию
+        pool = get_pool(db_config, FETCH_CONFIG['pool_size'])
+
+        if FETCH_CONFIG['mode'] == 'parallel':
+            all_data = _fetch_parallel(pool, date1_str, date2_str)
+        elif FETCH_CONFIG['mode'] == 'single_scan':
+            all_data = _fetch_single_scan(pool, date1_str, date2_str)
+        elif FETCH_CONFIG['mode'] == 'summary':
+            all_data = _fetch_summary(pool, date1_str, date2_str)
+            if all_data is None:
+                all_data = _fetch_sequential(pool, date1_str, date2_str)
+        else:
+            all_data = _fetch_sequential(pool, date1_str, date2_str)
 
         logging.info(f"Получено и объединено данных по {len(all_data)} датам.")
-        
-        # Преобразуем словарь в список, который ожидает остальная часть приложения
-        return list(all_data.values())
+        return all_data
 
     except fdb.Error as e:
         logging.error(f"Ошибка при работе с базой данных Firebird: {e}")
+        inc('db_errors')
+        return None
+
+def get_chunk_from_db(start_date: date, end_date: date, db_config: dict = DB_CONFIG,
+                      batch_size: int = 1000) -> DailyAggregates | None:
+    """
+    Выборка за период для исторической загрузки: результат каждого запроса
+    читается порциями по batch_size строк (fetchmany) и сразу сворачивается,
+    поэтому память не растет с длиной периода. В режиме 'single_scan'
+    показатели считаются по каждой порции фактов и суммируются.
+
+    Args:
+        start_date: Начальная дата для выборки.
+        end_date: Конечная дата для выборки.
+        db_config: База цели (по умолчанию DB_CONFIG).
+        batch_size: Размер порции fetchmany.
+
+    Returns:
+        Показатели по датам, где в базе есть строки, или None в случае ошибки.
+    """
+    params = (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+    try:
+        pool = get_pool(db_config, FETCH_CONFIG['pool_size'])
+        if FETCH_CONFIG['mode'] == 'summary':
+            # Сводная таблица компактна — ее период читается целиком
+            all_data = _fetch_summary(pool, *params)
+            if all_data is not None:
+                return all_data
+        all_data = DailyAggregates.empty()
+        with pool.connection() as pooled:
+            pooled.begin()
+            try:
+                if FETCH_CONFIG['mode'] == 'single_scan':
+                    from single_scan import aggregate_facts
+                    with span('db_query', query='raw_extract'):
+                        for columns, rows in pooled.stream(RAW_EXTRACT_QUERY, params, batch_size):
+                            inc('db_rows_fetched', len(rows), query='raw_extract')
+                            all_data = all_data.add(aggregate_facts(columns, rows))
+                else:
+                    for key, query in SQL_QUERIES.items():
+                        with span('db_query', query=key):
+                            for columns, rows in pooled.stream(query, params, batch_size):
+                                inc('db_rows_fetched', len(rows), query=key)
+                                all_data = all_data.merge(DailyAggregates.from_query(columns, rows))
+            finally:
+                pooled.commit()
+        return all_data
+
+    except fdb.Error as e:
+        logging.error(f"Ошибка при выборке периода {params[0]} — {params[1]} из Firebird: {e}")
+        inc('db_errors')
+        return None
+
+def get_date_fingerprints(start_date: date, end_date: date, db_config: dict = DB_CONFIG) -> dict | None:
+    """
+    Возвращает отпечаток строк orders/orderitems по каждой дате периода.
+    Даты без заказов в результат не попадают.
+
+    Args:
+        start_date: Начальная дата для выборки.
+        end_date: Конечная дата для выборки.
+        db_config: База цели (по умолчанию DB_CONFIG).
+
+    Returns:
+        Словарь {дата: строка-отпечаток} или None в случае ошибки.
+    """
+    try:
+        pool = get_pool(db_config, FETCH_CONFIG['pool_size'])
+        with pool.connection() as pooled:
+            pooled.begin()
+            try:
+                columns, rows = _execute(
+                    pooled, 'fingerprints', FINGERPRINT_QUERY,
+                    (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+                )
+            finally:
+                pooled.commit()
+
+        fingerprints = {}
+        for row in rows:
+            proddate = row[0]
+            if isinstance(proddate, datetime):
+                proddate = proddate.date()
+            fingerprints[proddate] = '|'.join(str(value) for value in row[1:])
+        return fingerprints
+
+    except fdb.Error as e:
+        logging.error(f"Ошибка при получении отпечатков дат из Firebird: {e}")
         return None
-    finally:
-        if 'con' in locals() and con:
-            cur.close()
-            con.close()
-            logging.info("Соединение с базой данных закрыто.")
 
 if __name__ == '__main__':
     # Пример использования: получить данные за текущий месяц
     today = date.today()
     first_day_of_month = today.replace(day=1)
-    
+
     db_data = get_data_from_db(first_day_of_month, today)
-    
+
     if db_data:
         print("Данные успешно получены:")
-        for row in db_data:
+        for row in db_data.records():
             print(row)
@@ -0,0 +1,224 @@
+import atexit
+import fdb
+import logging
+import queue
+import threading
+import time
+from config import RECONNECT_CONFIG
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Параметр TPB из Firebird 4.0: начать транзакцию на снимке с заданным номером
+isc_tpb_at_snapshot_number = 23
+
+# Транзакция только для чтения с изоляцией SNAPSHOT (concurrency)
+SNAPSHOT_READ_TPB = bytes([fdb.isc_tpb_version3, fdb.isc_tpb_read, fdb.isc_tpb_concurrency, fdb.isc_tpb_wait])
+
+
+def snapshot_tpb(snapshot_number: int | None = None) -> bytes:
+    """
+    Формирует TPB для транзакции SNAPSHOT только для чтения.
+
+    Args:
+        snapshot_number: Номер снимка, к которому нужно присоединиться
+            (поддерживается начиная с Firebird 4.0). Если не указан,
+            транзакция получает собственный снимок.
+
+    Returns:
+        Байтовая строка TPB.
+    """
+    if snapshot_number is None:
+        return SNAPSHOT_READ_TPB
+    return SNAPSHOT_READ_TPB + bytes([isc_tpb_at_snapshot_number, 8]) + int(snapshot_number).to_bytes(8, 'little')
+
+
+class PooledConnection:
+    """
+    Долгоживущее соединение пула.
+
+    Хранит собственную транзакцию и курсор, а также кэш подготовленных
+    запросов: каждый SQL готовится на сервере один раз за время жизни
+    соединения, при последующих запусках передаются только параметры.
+    """
+
+    def __init__(self, con):
+        self.con = con
+        self.transaction = con.trans(default_tpb=SNAPSHOT_READ_TPB)
+        self._cursor = self.transaction.cursor()
+        self._statements = {}
+
+    def is_alive(self) -> bool:
+        """Проверяет соединение одним лёгким запросом к серверу."""
+        try:
+            self.con.db_info(fdb.isc_info_ods_version)
+            return True
+        except fdb.Error:
+            return False
+
+    def begin(self, tpb: bytes | None = None):
+        """Начинает транзакцию соединения (по умолчанию SNAPSHOT только для чтения)."""
+        self.transaction.begin(tpb=tpb or SNAPSHOT_READ_TPB)
+
+    def commit(self):
+        self.transaction.commit()
+
+    def _prepare(self, sql: str):
+        statement = self._statements.get(sql)
+        if statement is None:
+            statement = self._cursor.prep(sql)
+            self._statements[sql] = statement
+        return statement
+
+    def execute(self, sql: str, params: tuple = ()) -> tuple[list[str], list[tuple]]:
+        """
+        Выполняет запрос в текущей транзакции соединения.
+
+        Returns:
+            Кортеж (имена столбцов, строки результата).
+        """
+        self._cursor.execute(self._prepare(sql), params)
+        columns = [desc[0] for desc in self._cursor.description]
+        return columns, self._cursor.fetchall()
+
+    def stream(self, sql: str, params: tuple = (), batch_size: int = 1000):
+        """
+        Выполняет запрос и отдает результат частями (fetchmany), не держа
+        в памяти всю выборку.
+
+        Yields:
+            Кортежи (имена столбцов, не более batch_size строк).
+        """
+        self._cursor.execute(self._prepare(sql), params)
+        columns = [desc[0] for desc in self._cursor.description]
+        while True:
+            rows = self._cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield columns, rows
+
+    def close(self):
+        self._statements.clear()
+        try:
+            self.transaction.rollback()
+        finally:
+            self.con.close()
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул долгоживущих соединений с базой данных Firebird.
+
+    Одновременно может быть выдано не более max_size соединений;
+    остальные потоки ждут, пока соединение не вернется в пул.
+    Соединения остаются открытыми между запусками и проверяются
+    перед каждой выдачей; при обрыве связи выполняется переподключение
+    с экспоненциальной задержкой.
+    """
+
+    def __init__(self, db_config: dict, max_size: int = 4):
+        self._db_config = db_config
+        self.max_size = max(1, max_size)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+
+    def _connect(self) -> PooledConnection:
+        attempts = RECONNECT_CONFIG['attempts']
+        delay = RECONNECT_CONFIG['backoff_seconds']
+        for attempt in range(1, attempts + 1):
+            try:
+                logging.info("Открытие нового соединения с базой данных Firebird...")
+                return PooledConnection(fdb.connect(**self._db_config))
+            except fdb.Error as e:
+                if attempt == attempts:
+                    raise
+                logging.warning(f"Не удалось подключиться к базе данных (попытка {attempt} из {attempts}): {e}. "
+                                f"Повтор через {delay:.0f} с.")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_CONFIG['max_backoff_seconds'])
+
+    def _acquire(self) -> PooledConnection:
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if pooled.is_alive():
+                return pooled
+            logging.warning("Соединение с базой данных потеряно, выполняется переподключение...")
+            self._discard(pooled)
+
+    @contextmanager
+    def connection(self, blocking: bool = True):
+        """
+        Выдает соединение из пула на время блока with.
+        Соединение, на котором произошла ошибка Firebird, закрывается
+        и в пул не возвращается.
+
+        Args:
+            blocking: False — не ждать свободного места в пуле: если все
+                соединения выданы, блок with получает None.
+        """
+        if not self._slots.acquire(blocking=blocking):
+            yield None
+            return
+        pooled = None
+        try:
+            pooled = self._acquire()
+            yield pooled
+        except fdb.Error:
+            self._discard(pooled)
+            pooled = None
+            raise
+        finally:
+            if pooled is not None:
+                self._idle.put(pooled)
+            self._slots.release()
+
+    def _discard(self, pooled: PooledConnection | None):
+        if pooled is None:
+            return
+        try:
+            pooled.close()
+        except fdb.Error as e:
+            logging.warning(f"Не удалось корректно закрыть соединение: {e}")
+
+    def close(self):
+        """Закрывает все свободные соединения пула."""
+        closed = 0
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+            closed += 1
+        if closed:
+            logging.info(f"Закрыто соединений пула: {closed}.")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_config: dict, max_size: int) -> ConnectionPool:
+    """
+    Возвращает общий для процесса пул соединений для указанной базы,
+    создавая его при первом обращении.
+    """
+    key = (db_config.get('host'), db_config.get('port'), db_config.get('database'), db_config.get('user'))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_config, max_size=max_size)
+            _pools[key] = pool
+        return pool
+
+
+@atexit.register
+def close_all_pools():
+    """Закрывает соединения всех пулов при завершении процесса."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,225 @@
+import fdb
+import logging
+import sys
+import threading
+import time
+from config import DB_CONFIG, EVENTS_CONFIG, RECONNECT_CONFIG
+from datetime import date, datetime
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EVENT_NAME = 'ALTAWIN_ORDERS_CHANGED'
+
+# Журнал измененных дат: триггеры пишут сюда proddate затронутых заказов,
+# приложение забирает его после каждого события и очищает после обновления
+CHANGES_TABLE_DDL = """
+    CREATE TABLE ALTAWIN_SYNC_CHANGES (
+        PRODDATE DATE NOT NULL
+    )
+"""
+
+CHANGES_INDEX_DDL = """
+    CREATE INDEX ALTAWIN_SYNC_CHANGES_PRODDATE ON ALTAWIN_SYNC_CHANGES (PRODDATE)
+"""
+
+ORDERS_TRIGGER_DDL = f"""
+    CREATE OR ALTER TRIGGER ALTAWIN_SYNC_ORDERS FOR ORDERS
+    ACTIVE AFTER INSERT OR UPDATE OR DELETE POSITION 100
+    AS
+    BEGIN
+        IF (NOT INSERTING AND OLD.PRODDATE IS NOT NULL) THEN
+            INSERT INTO ALTAWIN_SYNC_CHANGES (PRODDATE) VALUES (OLD.PRODDATE);
+        IF (NOT DELETING AND NEW.PRODDATE IS NOT NULL
+            AND (INSERTING OR NEW.PRODDATE IS DISTINCT FROM OLD.PRODDATE)) THEN
+            INSERT INTO ALTAWIN_SYNC_CHANGES (PRODDATE) VALUES (NEW.PRODDATE);
+        POST_EVENT '{EVENT_NAME}';
+    END
+"""
+
+ORDERITEMS_TRIGGER_DDL = f"""
+    CREATE OR ALTER TRIGGER ALTAWIN_SYNC_ORDERITEMS FOR ORDERITEMS
+    ACTIVE AFTER INSERT OR UPDATE OR DELETE POSITION 100
+    AS
+    BEGIN
+        INSERT INTO ALTAWIN_SYNC_CHANGES (PRODDATE)
+        SELECT o.proddate
+        FROM orders o
+        WHERE o.proddate IS NOT NULL
+            AND (o.orderid = IIF(DELETING, OLD.orderid, NEW.orderid)
+                 OR (UPDATING AND o.orderid = OLD.orderid AND OLD.orderid <> NEW.orderid));
+        POST_EVENT '{EVENT_NAME}';
+    END
+"""
+
+UNINSTALL_DDL = [
+    "DROP TRIGGER ALTAWIN_SYNC_ORDERITEMS",
+    "DROP TRIGGER ALTAWIN_SYNC_ORDERS",
+    "DROP TABLE ALTAWIN_SYNC_CHANGES",
+]
+
+
+def install(con):
+    """Создает журнал изменений и триггеры на orders/orderitems."""
+    cur = con.cursor()
+    cur.execute("SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'ALTAWIN_SYNC_CHANGES'")
+    if cur.fetchone() is None:
+        logging.info("Создание таблицы ALTAWIN_SYNC_CHANGES...")
+        con.execute_immediate(CHANGES_TABLE_DDL)
+        con.execute_immediate(CHANGES_INDEX_DDL)
+        con.commit()
+    logging.info("Создание триггеров ALTAWIN_SYNC_ORDERS и ALTAWIN_SYNC_ORDERITEMS...")
+    con.execute_immediate(ORDERS_TRIGGER_DDL)
+    con.execute_immediate(ORDERITEMS_TRIGGER_DDL)
+    con.commit()
+    logging.info("Объекты для событийного обновления установлены.")
+
+
+def uninstall(con):
+    """Удаляет триггеры и журнал изменений."""
+    for ddl in UNINSTALL_DDL:
+        try:
+            con.execute_immediate(ddl)
+            con.commit()
+        except fdb.Error as e:
+            con.rollback()
+            logging.warning(f"Не удалось выполнить '{ddl}': {e}")
+    logging.info("Объекты для событийного обновления удалены.")
+
+
+def drain_changes(con, on_change) -> bool:
+    """
+    Забирает из журнала даты, измененные с прошлого вызова, и передает
+    их on_change(dates). Записи удаляются в той же транзакции, которая
+    фиксируется только после успешного on_change: если обновление не
+    удалось, даты остаются в журнале до следующего события. Записи,
+    появившиеся после начала транзакции, в нее не попадают.
+
+    Returns:
+        False, если on_change вернул False или завершился ошибкой.
+    """
+    tr = con.trans(default_tpb=fdb.ISOLATION_LEVEL_SNAPSHOT)
+    try:
+        cur = tr.cursor()
+        cur.execute("SELECT DISTINCT PRODDATE FROM ALTAWIN_SYNC_CHANGES")
+        dates = sorted(row[0].date() if isinstance(row[0], datetime) else row[0] for row in cur.fetchall())
+        if not dates:
+            return True
+        cur.execute("DELETE FROM ALTAWIN_SYNC_CHANGES")
+        logging.info(f"Получено событие изменения заказов, затронуто дат: {len(dates)}.")
+        try:
+            ok = bool(on_change(dates))
+        except Exception as e:
+            logging.error(f"Ошибка при обновлении по событию: {e}")
+            ok = False
+        if ok:
+            tr.commit()
+        else:
+            logging.warning("Обновление по событию не выполнено — даты остаются в журнале изменений.")
+            tr.rollback()
+        return ok
+    finally:
+        # close() фиксирует незавершенную транзакцию — при ошибке журнал не очищаем
+        if tr.active:
+            tr.rollback()
+        tr.close()
+
+
+class EventListener(threading.Thread):
+    """
+    Фоновый поток, ожидающий событий Firebird об изменении заказов.
+
+    После первого события ждет, пока поток изменений не утихнет
+    (debounce_seconds без новых событий, но не дольше max_delay_seconds),
+    забирает из журнала затронутые даты и вызывает on_change(dates);
+    on_change возвращает False, если обновление не удалось, — тогда даты
+    остаются в журнале и забираются снова со следующим событием или
+    через max_delay_seconds. При обрыве связи переподключается с экспоненциальной задержкой.
+    """
+
+    def __init__(self, on_change, db_config: dict = DB_CONFIG):
+        super().__init__(name='firebird-events', daemon=True)
+        self.on_change = on_change
+        self.db_config = db_config
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    @staticmethod
+    def _wait_event(conduit, timeout: float) -> bool:
+        """
+        Ждет события не дольше timeout секунд. fdb.EventConduit.wait()
+        возвращает счетчики событий и по таймауту (нулевые), а признак
+        готовности держит до flush() — поэтому счетчики проверяются и после
+        каждого события канал очищается.
+        """
+        counts = conduit.wait(timeout=timeout) or {}
+        if not any(counts.values()):
+            return False
+        conduit.flush()
+        return True
+
+    def _debounce(self, conduit):
+        started = time.monotonic()
+        while time.monotonic() - started < EVENTS_CONFIG['max_delay_seconds']:
+            if not self._wait_event(conduit, EVENTS_CONFIG['debounce_seconds']):
+                return
+        logging.info("Поток изменений не утихает — обновление запускается без ожидания паузы.")
+
+    def _listen(self):
+        con = fdb.connect(**self.db_config)
+        try:
+            conduit = con.event_conduit([EVENT_NAME])
+            conduit.begin()
+            try:
+                logging.info(f"Ожидание событий {EVENT_NAME} от Firebird...")
+                # Изменения, накопленные пока приложение не слушало события
+                retry_at = self._dispatch(con)
+                while not self._stop_event.is_set():
+                    if not self._wait_event(conduit, 1):
+                        if retry_at is not None and time.monotonic() >= retry_at:
+                            retry_at = self._dispatch(con)
+                        continue
+                    self._debounce(conduit)
+                    retry_at = self._dispatch(con)
+            finally:
+                conduit.close()
+        finally:
+            con.close()
+
+    def _dispatch(self, con) -> float | None:
+        """Обновляет даты из журнала; после неудачи возвращает время повторной попытки."""
+        if drain_changes(con, self.on_change):
+            return None
+        return time.monotonic() + EVENTS_CONFIG['max_delay_seconds']
+
+    def run(self):
+        delay = RECONNECT_CONFIG['backoff_seconds']
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                delay = RECONNECT_CONFIG['backoff_seconds']
+            except fdb.Error as e:
+                logging.error(f"Ошибка соединения для событий Firebird: {e}. Повтор через {delay:.0f} с.")
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, RECONNECT_CONFIG['max_backoff_seconds'])
+
+
+if __name__ == '__main__':
+    # Установка и удаление объектов в базе:
+    #   python events.py install
+    #   python events.py uninstall
+    # Проверка установки, триггеров, событий и журнала на встроенном Firebird:
+    #   FIREBIRD_EMBEDDED_LIB=/opt/firebird/lib/libfbclient.so python -m pytest tests/test_events.py
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command not in ('install', 'uninstall'):
+        print("Использование: python events.py install|uninstall")
+        sys.exit(2)
+    connection = fdb.connect(**DB_CONFIG)
+    try:
+        if command == 'install':
+            install(connection)
+        else:
+            uninstall(connection)
+    finally:
+        connection.close()
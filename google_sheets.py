@@ -1,370 +1,564 @@
-import gspread
+import bisect
 import logging
-from oauth2client.service_account import ServiceAccountCredentials
-from config import GOOGLE_SHEETS_CONFIG
+import random
+from aggregates import DailyAggregates
+from config import GOOGLE_SHEETS_CONFIG, SHEETS_QUOTA_CONFIG
+from instrumentation import inc
+from metrics import HEADER
+from sheet_state import HEADER_ROW, SheetMirror, column_letter, get_mirror
+from sheet_writer import WritePlan
+from sheets_quota import is_outcome_unknown, scheduler, thread_api_calls
+from sheets_client import get_session, is_session_error
 from datetime import date, datetime, timedelta
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def update_google_sheet(data: list[dict]):
+# Ячейка F1 с отметкой времени последнего обновления
+TIMESTAMP_ROW = 1
+TIMESTAMP_COLUMN = 5
+
+
+def _group_contiguous(indices: list[int]) -> list[tuple[int, int]]:
+    """Группирует индексы строк в непрерывные диапазоны [start, end)."""
+    if not indices:
+        return []
+    indices.sort()
+    ranges = []
+    start = prev = indices[0]
+    for idx in indices[1:]:
+        if idx == prev + 1:
+            prev = idx
+            continue
+        ranges.append((start, prev + 1))  # end exclusive
+        start = prev = idx
+    ranges.append((start, prev + 1))
+    return ranges
+
+
+def _plan_insert_positions(mirror: SheetMirror, new_dates: list[date]) -> list[tuple[int, list[date]]]:
     """
-    Авторизуется в Google Sheets и обновляет данные на листе,
-    сохраняя существующее форматирование таблицы.
-    Ищет строки по дате и обновляет их. Если дата не найдена,
-    добавляет новую строку в конец таблицы, наследуя форматирование.
+    Определяет, куда вставить строки новых дат (отсортированных по возрастанию):
+    перед первой строкой листа с более поздней датой, иначе в конец таблицы.
 
-    Args:
-        data: Полный список словарей с данными для загрузки.
+    Returns:
+        Список (номер строки 1-based, даты) по возрастанию номера строки.
     """
-    try:
-        logging.info("Авторизация в Google Sheets...")
-        scope = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/spreadsheets',
-                 "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
-        
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            GOOGLE_SHEETS_CONFIG['credentials_file'], scope
-        )
-        client = gspread.authorize(creds)
-
-        logging.info(f"Открытие таблицы '{GOOGLE_SHEETS_CONFIG['spreadsheet_name']}'...")
-        spreadsheet = client.open(GOOGLE_SHEETS_CONFIG['spreadsheet_name'])
-        sheet = spreadsheet.worksheet(GOOGLE_SHEETS_CONFIG['worksheet_name'])
-        
-        logging.info("Получение существующих данных из таблицы...")
+    date_column_index = mirror.date_column_index
+    existing = []
+    for row_number, row in enumerate(mirror.values[HEADER_ROW:], start=HEADER_ROW + 1):
         try:
-            sheet_values = sheet.get_all_values()
-        except gspread.exceptions.GSpreadException as e:
-            logging.warning(f"Не удалось прочитать лист (возможно, он пуст): {e}")
-            sheet_values = []
-
-        # 1. Подготавливаем новые данные
-        header = ['Дата', 'Изделия', 'Раздвижки', 'МС', 'СП и стекла', 'Сэндвичи', 'Подоконники', 'Железо']
-        processed_new_data = []
-        for row in data:
-            processed_row = {}
-            for key, value in row.items():
-                # Приводим ключи БД к названиям столбцов в таблице
-                new_key = {'PRODDATE': 'Дата', 'QTY_IZD_PVH': 'Изделия', 'QTY_RAZDV': 'Раздвижки', 'QTY_MOSNET': 'МС', 'QTY_GLASS_PACKS': 'СП и стекла', 'QTY_SANDWICHES': 'Сэндвичи', 'QTY_WINDOWSILLS': 'Подоконники', 'QTY_IRON': 'Железо'}.get(key, key)
-                if isinstance(value, (date, datetime)):
-                    processed_row[new_key] = value.strftime('%d.%m.%Y')
-                else:
-                    processed_row[new_key] = value
-            processed_new_data.append(processed_row)
-
-        if not processed_new_data and not sheet_values:
-            logging.info("Нет ни существующих, ни новых данных. Лист оставлен пустым.")
-            return
-
-        # Если лист пуст, просто вставляем все данные с заголовком
-        if not sheet_values:
-            logging.info("Лист пуст. Вставляем все данные с заголовком.")
-            
-            now = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
-            sheet.update('F1', [[f"Последнее обновление: {now}"]], value_input_option='USER_ENTERED')
-            
-            rows_to_insert = [header]
-            
-            for i, row_dict in enumerate(processed_new_data):
-                row_values = [row_dict.get(h, '') for h in header]
-                rows_to_insert.append(row_values)
-            
-            sheet.update('A2', rows_to_insert, value_input_option='USER_ENTERED')
-            logging.info("Данные успешно загружены.")
-            return
+            existing.append((datetime.strptime(row[date_column_index], '%d.%m.%Y').date(), row_number))
+        except (IndexError, ValueError):
+            continue
+    existing.sort()
+    sheet_dates = [row_date for row_date, _ in existing]
+    # first_row_after[i] — наименьший номер строки среди дат existing[i:]
+    first_row_after = [0] * len(existing)
+    smallest = len(mirror.values) + 1
+    for i in range(len(existing) - 1, -1, -1):
+        smallest = min(smallest, existing[i][1])
+        first_row_after[i] = smallest
 
-        # Если лист не пуст, выполняем обновление/добавление
-        current_header = [str(h).strip() for h in sheet_values[1]] if len(sheet_values) > 1 else []
+    end_of_sheet = len(mirror.values) + 1
+    positions = []
+    for new_date in new_dates:
+        i = bisect.bisect_right(sheet_dates, new_date)
+        insert_at = first_row_after[i] if i < len(existing) else end_of_sheet
+        if positions and positions[-1][0] == insert_at:
+            positions[-1][1].append(new_date)
+        else:
+            positions.append((insert_at, [new_date]))
+    positions.sort(key=lambda position: position[0])
+    return positions
+
+
+def _typed_value(value: str, is_date: bool):
+    """Значение ячейки из зеркала (строка) в виде, пригодном для повторной записи."""
+    if is_date:
         try:
-            date_column_index = current_header.index('Дата')
+            return datetime.strptime(value, '%d.%m.%Y').date()
         except ValueError:
-            logging.error("На листе в строке 2 отсутствует столбец 'Дата'. Невозможно выполнить обновление.")
-            return
+            return value
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            continue
+    return value
 
-        # Создаем карту существующих дат и их номеров строк (1-based index)
-        date_to_row_map = {row[date_column_index]: i for i, row in enumerate(sheet_values[2:], start=3)}
 
-        updates_batch = []
-        new_rows_to_insert = []
+def _plan_archive(plan: WritePlan, spreadsheet, sheet, mirror: SheetMirror, sheets_config: dict,
+                  keep_dates: set[str]) -> int:
+    """
+    Планирует перенос строк старше archive_after_days дней на листы архива
+    (по шаблону archive_worksheet, обычно по листу на год), чтобы рабочий
+    лист оставался размером около окна отображения.
 
-        for row_dict in processed_new_data:
-            date_str = row_dict.get('Дата')
-            if not date_str:
-                continue
+    Перенос идет пачками не меньше archive_min_rows строк: недостающие листы
+    архива создаются, строки дописываются в их конец и удаляются с рабочего
+    листа — все в том же запросе batchUpdate, который выполняется атомарно.
+    Планируется до остальных изменений, пока номера строк в зеркале
+    совпадают с листом: значения переносимых строк дочитываются с листа.
+    Даты из keep_dates (записываемые в этом запуске) не переносятся.
+
+    Returns:
+        Количество переносимых строк.
+    """
+    archive_after_days = sheets_config['archive_after_days']
+    if archive_after_days <= 0 or not mirror.values:
+        return 0
+    date_column_index = mirror.date_column_index
+    if date_column_index is None:
+        return 0
+
+    cutoff = date.today() - timedelta(days=archive_after_days)
+    # 0-based индексы строк рабочего листа, которые переносятся, по листам архива
+    by_archive = {}
+    for row_index, row in enumerate(mirror.values[HEADER_ROW:], start=HEADER_ROW):
+        try:
+            row_date = datetime.strptime(row[date_column_index], '%d.%m.%Y').date()
+        except (IndexError, ValueError):
+            continue
+        if row_date < cutoff and row[date_column_index] not in keep_dates:
+            title = sheets_config['archive_worksheet'].format(year=row_date.year)
+            by_archive.setdefault(title, []).append(row_index)
+
+    total = sum(len(indices) for indices in by_archive.values())
+    if total < sheets_config['archive_min_rows']:
+        return 0
+
+    metadata = scheduler.call('read', spreadsheet.fetch_sheet_metadata,
+                              {'fields': 'sheets(properties(sheetId,title))'})
+    sheet_ids = {sheet['properties']['title']: sheet['properties']['sheetId']
+                 for sheet in metadata.get('sheets', [])}
+    header = mirror.values[HEADER_ROW - 1]
+    mirror.fill_rows(sheet, [row_index for indices in by_archive.values() for row_index in indices])
+
+    for title, indices in sorted(by_archive.items()):
+        archive_id = sheet_ids.get(title)
+        if archive_id is None:
+            archive_id = random.randint(1, 2 ** 31 - 1)
+            while archive_id in sheet_ids.values():
+                archive_id = random.randint(1, 2 ** 31 - 1)
+            sheet_ids[title] = archive_id
+            logging.info(f"Создание листа архива '{title}'...")
+            plan.add_sheet(archive_id, title)
+            plan.append_rows(archive_id, [header])
+            plan.add({
+                'repeatCell': {
+                    'range': {
+                        'sheetId': archive_id,
+                        'startRowIndex': 1,
+                        'startColumnIndex': date_column_index,
+                        'endColumnIndex': date_column_index + 1
+                    },
+                    'cell': {'userEnteredFormat': {'numberFormat': {'type': 'DATE', 'pattern': 'dd.mm.yyyy'}}},
+                    'fields': 'userEnteredFormat.numberFormat'
+                }
+            })
+        plan.append_rows(archive_id, [
+            [_typed_value(value, i == date_column_index) for i, value in enumerate(mirror.values[row_index])]
+            for row_index in indices
+        ])
+        logging.info(f"Перенос {len(indices)} строк старше {cutoff.strftime('%d.%m.%Y')} на лист '{title}'.")
+
+    # Снизу вверх: удаление ниже не сдвигает еще не удаленные строки выше
+    archived = [row_index for indices in by_archive.values() for row_index in indices]
+    for start_idx, end_idx in reversed(_group_contiguous(archived)):
+        plan.delete_rows(start_idx, end_idx)
+        mirror.delete_rows(start_idx, end_idx)
+    return total
+
+
+def _plan_display_window(plan: WritePlan, mirror: SheetMirror, sheets_config: dict):
+    """
+    Планирует окно отображения: от window_days_before дней до сегодня
+    и window_days_after дней после.
+    Реализуется через скрытие строк вне окна, чтобы избежать конфликтов базового фильтра.
+
+    Видимость строк хранится в зеркале, поэтому в план попадают только
+    строки, которые входят в окно или выходят из него (обычно по одной в день),
+    и строки с неизвестной видимостью (новые или после полного чтения листа).
+    """
+    days_before = sheets_config['window_days_before']
+    days_after = sheets_config['window_days_after']
+    logging.info(f"Применение окна отображения по дате (−{days_before} до +{days_after} дней)...")
+
+    # Зеркало уже отражает все запланированные изменения, перечитывать лист не нужно
+    latest_values = mirror.values
+    if not latest_values:
+        logging.info("Лист пуст после обновления — нечего фильтровать.")
+        return
+
+    date_column_index = mirror.date_column_index
+    if date_column_index is None:
+        logging.error("Столбец 'Дата' не найден — пропускаю применение окна отображения.")
+        return
+
+    # Границы окна
+    today = date.today()
+    start_date = today - timedelta(days=days_before)
+    end_date = today + timedelta(days=days_after)
+
+    # Индексы строк (0-based в API; 1-я строка — отметка времени, 2-я — заголовок),
+    # видимость которых нужно изменить
+    to_hide = []
+    to_show = []
+    for row_1_based, row in enumerate(latest_values[2:], start=3):
+        raw_date = row[date_column_index] if date_column_index < len(row) else ''
+        try:
+            row_date = datetime.strptime(raw_date, '%d.%m.%Y').date()
+            in_window = (start_date <= row_date <= end_date)
+        except Exception:
+            # Если дата не парсится — скрываем
+            in_window = False
+
+        row_index = row_1_based - 1
+        hidden = mirror.is_hidden(row_index)
+        if hidden is None or hidden == in_window:
+            (to_show if in_window else to_hide).append(row_index)
+
+    # Группируем строки в непрерывные диапазоны для минимизации запросов
+    show_ranges = _group_contiguous(to_show)
+    hide_ranges = _group_contiguous(to_hide)
+    for ranges, hidden in ((show_ranges, False), (hide_ranges, True)):
+        for start_idx, end_idx in ranges:
+            # Не трогаем заголовок; start_idx >= 2 гарантированно
+            plan.set_rows_hidden(start_idx, end_idx, hidden)
+            mirror.set_hidden(start_idx, end_idx, hidden)
+
+    logging.info(
+        "Окно отображения: даты от %s до %s; показано строк: %d, скрыто строк: %d (диапазонов: %d)",
+        start_date.strftime('%d.%m.%Y'), end_date.strftime('%d.%m.%Y'),
+        len(to_show), len(to_hide), len(show_ranges) + len(hide_ranges)
+    )
+
+
+def _today_rule_formula(date_column_index: int) -> str:
+    """
+    Формула правила выделения текущего дня для строки 3 (первой строки данных).
+    Сравнение через TEXT работает и для дат-чисел, и для дат, записанных текстом.
+    """
+    cell = f"${column_letter(date_column_index)}{HEADER_ROW + 1}"
+    return f'=TEXT({cell},"dd.mm.yyyy")=TEXT(TODAY(),"dd.mm.yyyy")'
+
+
+def _plan_formatting(plan: WritePlan, spreadsheet, mirror: SheetMirror):
+    """
+    Один раз настраивает форматирование листа: шрифт 14 жирный для всей таблицы,
+    белый фон строк данных и правило условного форматирования, которое
+    выделяет строку текущего дня светло-зеленым.
+
+    Правило вычисляется самой таблицей, поэтому выделение остается верным
+    и после полуночи, без запуска приложения. Наличие правила проверяется
+    по метаданным листа один раз (и после полного перечитывания листа);
+    обычные запуски запросов форматирования не отправляют.
+    """
+    if mirror.formatting_ready:
+        return
+    date_column_index = mirror.date_column_index
+    if date_column_index is None:
+        logging.warning("Столбец 'Дата' не найден — форматирование листа не настроено.")
+        return
+    sheet_id = plan.sheet_id
+    formula = _today_rule_formula(date_column_index)
+
+    metadata = scheduler.call('read', spreadsheet.fetch_sheet_metadata,
+                              {'fields': 'sheets(properties(sheetId),conditionalFormats)'})
+    for sheet_meta in metadata.get('sheets', []):
+        if sheet_meta.get('properties', {}).get('sheetId') != sheet_id:
+            continue
+        for rule in sheet_meta.get('conditionalFormats', []):
+            values = rule.get('booleanRule', {}).get('condition', {}).get('values', [])
+            if any(value.get('userEnteredValue') == formula for value in values):
+                logging.info("Условное форматирование листа уже настроено.")
+                mirror.formatting_ready = True
+                return
+
+    logging.info("Настройка форматирования листа: шрифт 14 жирный и правило выделения текущего дня...")
+    # Диапазоны без endRowIndex действуют до конца сетки, в том числе на будущие строки
+    plan.add({
+        'repeatCell': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': 1
+            },
+            'cell': {
+                'userEnteredFormat': {
+                    'textFormat': {
+                        'fontSize': 14,
+                        'bold': True
+                    }
+                }
+            },
+            'fields': 'userEnteredFormat.textFormat.fontSize,userEnteredFormat.textFormat.bold'
+        }
+    })
+    # Белый фон снимает статичное зеленое выделение, которое ставили прежние версии
+    plan.add({
+        'repeatCell': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': 2,  # С третьей строки
+                'startColumnIndex': 0,  # Столбец A
+                'endColumnIndex': 8      # До столбца H включительно
+            },
+            'cell': {
+                'userEnteredFormat': {
+                    'backgroundColor': {
+                        'red': 1.0,
+                        'green': 1.0,
+                        'blue': 1.0
+                    }
+                }
+            },
+            'fields': 'userEnteredFormat.backgroundColor'
+        }
+    })
+    plan.add({
+        'addConditionalFormatRule': {
+            'index': 0,
+            'rule': {
+                'ranges': [{
+                    'sheetId': sheet_id,
+                    'startRowIndex': 2,
+                    'startColumnIndex': 0,
+                    'endColumnIndex': 8
+                }],
+                'booleanRule': {
+                    'condition': {
+                        'type': 'CUSTOM_FORMULA',
+                        'values': [{'userEnteredValue': formula}]
+                    },
+                    'format': {
+                        'backgroundColor': {
+                            'red': 0.85,
+                            'green': 0.92,
+                            'blue': 0.83
+                        }
+                    }
+                }
+            }
+        }
+    })
+    # Если запись не удастся, зеркало будет сброшено вместе с этим флагом
+    mirror.formatting_ready = True
+
+
+def _log_quota():
+    stats = scheduler.stats()
+    logging.info(
+        f"Квота Sheets API за минуту: потрачено чтений {stats['minute_spent']['read']}, записей {stats['minute_spent']['write']}; "
+        f"осталось чтений {stats['minute_remaining']['read']}, записей {stats['minute_remaining']['write']}; "
+        f"повторов всего {stats.get('retries', 0)}, отложенных записей {stats['pending_writes']}."
+    )
+
+
+def _write_sheet(session, mirror: SheetMirror, data: DailyAggregates, sheets_config: dict) -> bool:
+    """
+    Сверяет зеркало с листом, собирает план записи и отправляет его.
+
+    Returns:
+        False, если лист нельзя обновить (нет столбца 'Дата').
+
+    Raises:
+        Ошибку API или сети, если план не отправлен.
+    """
+    # Сессия живет между запусками: повторная авторизация и поиск таблицы не нужны
+    spreadsheet = session.spreadsheet
+    sheet = session.worksheet
+    sheet_id = sheet.id if hasattr(sheet, 'id') else sheet._properties.get('sheetId')
+
+    # Зеркало листа живет между запусками; здесь оно только сверяется с листом
+    mirror.sync(sheet)
+    sheet_values = mirror.values
+
+    if not len(data) and not sheet_values:
+        logging.info("Нет ни существующих, ни новых данных. Лист оставлен пустым.")
+        return True
+
+    plan = WritePlan(sheet_id)
+    archived_rows = 0
+    now = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
 
-            # Собираем значения в том порядке, как они в заголовке на листе
-            row_values = [row_dict.get(h, '') for h in current_header]
+    # Если лист пуст, просто вставляем все данные с заголовком
+    if not sheet_values:
+        logging.info("Лист пуст. Вставляем все данные с заголовком.")
 
+        rows_to_insert = [HEADER] + data.sheet_rows(HEADER)
+
+        # Строка 1 — отметка времени, строка 2 — заголовок, далее данные
+        missing_rows = 1 + len(rows_to_insert) - sheet.row_count
+        if missing_rows > 0:
+            plan.append_grid_rows(missing_rows)
+        plan.set_rows(2, rows_to_insert)
+        plan.add({
+            'repeatCell': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'startRowIndex': 2,
+                    'startColumnIndex': 0,
+                    'endColumnIndex': 1
+                },
+                'cell': {'userEnteredFormat': {'numberFormat': {'type': 'DATE', 'pattern': 'dd.mm.yyyy'}}},
+                'fields': 'userEnteredFormat.numberFormat'
+            }
+        })
+        mirror.values = []
+        mirror.insert_rows(1, rows_to_insert)
+        mirror.insert_rows(1, [[]])
+    else:
+        # Если лист не пуст, выполняем обновление/добавление
+        current_header = mirror.header
+        date_column_index = mirror.date_column_index
+        if date_column_index is None:
+            logging.error("На листе в строке 2 отсутствует столбец 'Дата'. Невозможно выполнить обновление.")
+            return False
+
+        date_keys = data.date_keys()
+        # После загрузки зеркала известны только даты: строки периода дочитываются
+        # одним запросом, чтобы совпадающие с листом не переписывать (до архивации —
+        # пока номера строк в зеркале совпадают с листом)
+        date_to_row_map = mirror.date_to_row()
+        mirror.fill_rows(sheet, [date_to_row_map[key] - 1 for key in date_keys if key in date_to_row_map])
+        try:
+            archived_rows = _plan_archive(plan, spreadsheet, sheet, mirror, sheets_config, set(date_keys))
+        except Exception as e:
+            logging.error(f"Ошибка при архивации старых строк: {e}")
+
+        # Создаем карту существующих дат и их номеров строк (1-based index)
+        date_to_row_map = mirror.date_to_row()
+
+        updated_rows = 0
+        new_rows_to_insert = {}
+
+        # Значения в том порядке, как столбцы в заголовке на листе
+        for row_date, date_str, row_values in zip(data.dates, date_keys, data.sheet_rows(current_header)):
             if date_str in date_to_row_map:
                 row_number = date_to_row_map[date_str]
-                
-                updates_batch.append({
-                    'range': f'A{row_number}:{chr(ord("A")+len(current_header)-1)}{row_number}',
-                    'values': [row_values]
-                })
+                if mirror.row_matches(row_number, row_values):
+                    # Значения на листе уже совпадают — повторно не пишем
+                    continue
+                plan.set_rows(row_number, [row_values])
+                mirror.set_row(row_number, row_values)
+                updated_rows += 1
             else:
                 # Если такой даты нет, это новая строка
-                # Проверяем, чтобы эта дата не была уже в списке на добавление
-                if date_str not in [r[date_column_index] for r in new_rows_to_insert]:
-                     new_rows_to_insert.append(row_values)
-        
-        if updates_batch:
-            logging.info(f"Обновление {len(updates_batch)} существующих строк...")
-            sheet.batch_update(updates_batch, value_input_option='USER_ENTERED')
+                new_rows_to_insert[row_date] = row_values
+
+        if updated_rows:
+            logging.info(f"Обновление {updated_rows} существующих строк...")
+        else:
+            logging.info("Значения существующих строк не изменились.")
 
         if new_rows_to_insert:
-            # Сортируем новые строки по дате перед вставкой
-            try:
-                new_rows_to_insert.sort(key=lambda r: datetime.strptime(r[date_column_index], '%d.%m.%Y'))
-            except (ValueError, IndexError):
-                logging.warning("Не удалось отсортировать новые строки перед вставкой.")
-
-            logging.info(f"Добавление {len(new_rows_to_insert)} новых строк в конец таблицы...")
-            # Вставляем строки после последней существующей строки, наследуя форматирование
-            sheet.insert_rows(
-                new_rows_to_insert,
-                row=len(sheet_values) + 1,
-                value_input_option='USER_ENTERED',
-                inherit_from_before=True
-            )
-            
-        # Отображаем только записи в окне: от 2 дней до сегодня и +5 дней
-        # Реализуем через скрытие строк вне окна, чтобы избежать конфликтов базового фильтра
-        try:
-            logging.info("Применение окна отображения по дате (−2 до +5 дней)...")
+            # Новые даты обычно позже всех на листе и добавляются в конец;
+            # более ранние (историческая загрузка) встают перед первой более поздней датой
+            positions = _plan_insert_positions(mirror, sorted(new_rows_to_insert))
+            logging.info(f"Добавление {len(new_rows_to_insert)} новых строк "
+                         f"(мест вставки: {len(positions)})...")
+            # Снизу вверх: вставка выше не сдвигает уже вставленные ниже строки
+            for insert_at, dates in reversed(positions):
+                rows = [new_rows_to_insert[d] for d in dates]
+                plan.insert_rows(insert_at, rows)
+                mirror.insert_rows(insert_at, rows)
 
-            # Перечитываем данные после всех изменений, чтобы получить актуальные строки
-            latest_values = sheet.get_all_values()
-            if not latest_values:
-                logging.info("Лист пуст после обновления — нечего фильтровать.")
-            else:
-                current_header = [str(h).strip() for h in latest_values[1]] if len(latest_values) > 1 else []
-                try:
-                    date_column_index = current_header.index('Дата')
-                except ValueError:
-                    logging.error("Столбец 'Дата' не найден — пропускаю применение окна отображения.")
-                    date_column_index = None
-
-                if date_column_index is not None:
-                    # Границы окна
-                    today = date.today()
-                    start_date = today - timedelta(days=2)
-                    end_date = today + timedelta(days=5)
-
-                    # Собираем индексы строк (0-based в API; 1-я строка — заголовок) вне окна
-                    rows_outside_window_zero_based = []
-                    for row_1_based, row in enumerate(latest_values[2:], start=3):
-                        raw_date = row[date_column_index] if date_column_index < len(row) else ''
-                        try:
-                            row_date = datetime.strptime(raw_date, '%d.%m.%Y').date()
-                            in_window = (start_date <= row_date <= end_date)
-                        except Exception:
-                            # Если дата не парсится — скрываем
-                            in_window = False
-
-                        if not in_window:
-                            # Преобразуем в 0-based индекс строки для API
-                            rows_outside_window_zero_based.append(row_1_based - 1)
-
-                    # Сначала показываем все строки (снимаем скрытие)
-                    sheet_id = sheet.id if hasattr(sheet, 'id') else sheet._properties.get('sheetId')
-                    total_rows = len(latest_values)
-
-                    requests = []
-                    if total_rows > 1:
-                        requests.append({
-                            'updateDimensionProperties': {
-                                'range': {
-                                    'sheetId': sheet_id,
-                                    'dimension': 'ROWS',
-                                    'startIndex': 2,   # пропускаем заголовок и инфо
-                                    'endIndex': total_rows
-                                },
-                                'properties': {
-                                    'hiddenByUser': False
-                                },
-                                'fields': 'hiddenByUser'
-                            }
-                        })
-
-                    # Группируем внеоконные строки в непрерывные диапазоны для минимизации запросов
-                    def group_contiguous(indices: list[int]) -> list[tuple[int, int]]:
-                        if not indices:
-                            return []
-                        indices.sort()
-                        ranges = []
-                        start = prev = indices[0]
-                        for idx in indices[1:]:
-                            if idx == prev + 1:
-                                prev = idx
-                                continue
-                            ranges.append((start, prev + 1))  # end exclusive
-                            start = prev = idx
-                        ranges.append((start, prev + 1))
-                        return ranges
-
-                    hide_ranges_zero_based = group_contiguous(rows_outside_window_zero_based)
-                    for start_idx, end_idx in hide_ranges_zero_based:
-                        # Не скрываем заголовок; start_idx >= 2 гарантированно
-                        if start_idx >= end_idx:
-                            continue
-                        requests.append({
-                            'updateDimensionProperties': {
-                                'range': {
-                                    'sheetId': sheet_id,
-                                    'dimension': 'ROWS',
-                                    'startIndex': start_idx,
-                                    'endIndex': end_idx
-                                },
-                                'properties': {
-                                    'hiddenByUser': True
-                                },
-                                'fields': 'hiddenByUser'
-                            }
-                        })
-
-                    if requests:
-                        spreadsheet.batch_update({'requests': requests})
-                        logging.info(
-                            "Окно отображения применено: показаны даты от %s до %s, скрыто диапазонов: %d",
-                            start_date.strftime('%d.%m.%Y'), end_date.strftime('%d.%m.%Y'),
-                            max(0, len(requests) - 1) if total_rows > 1 else 0
-                        )
+        try:
+            _plan_display_window(plan, mirror, sheets_config)
         except Exception as e:
             logging.error(f"Произошла ошибка при применении окна отображения: {e}")
 
-        try:
-            logging.info("Обновление времени последнего обновления в ячейке F1...")
-            now = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
-            sheet.update('F1', [[f"Последнее обновление: {now}"]])
-            logging.info("Время последнего обновления успешно записано в F1.")
-        except Exception as e:
-            logging.error(f"Не удалось обновить ячейку F1: {e}")
+    try:
+        _plan_formatting(plan, spreadsheet, mirror)
+    except Exception as e:
+        logging.error(f"Ошибка при настройке форматирования: {e}")
+
+    plan.set_cell(TIMESTAMP_ROW, TIMESTAMP_COLUMN, f"Последнее обновление: {now}")
+    mirror.set_cell(TIMESTAMP_ROW, TIMESTAMP_COLUMN, f"Последнее обновление: {now}")
+
+    plan.execute(spreadsheet)
+    if archived_rows:
+        inc('sheet_rows_archived', archived_rows)
+    return True
+
+
+def update_google_sheet(data: DailyAggregates | list[dict], sheets_config: dict = GOOGLE_SHEETS_CONFIG,
+                        reread: bool = False) -> bool:
+    """
+    Обновляет данные на листе Google Sheets через постоянную сессию,
+    сохраняя существующее форматирование таблицы.
+    Ищет строки по дате и обновляет их. Если дата не найдена,
+    добавляет новую строку в конец таблицы, наследуя форматирование.
 
-        # Применяем форматирование: шрифт 14 жирный для всей таблицы
+    Все изменения запуска (значения, новые строки, перенос старых строк
+    в архив, окно отображения, отметка времени и, при первой настройке
+    листа, форматирование) отправляются одним запросом spreadsheets.batchUpdate.
+    Если после отправки неизвестно, применен ли он (5xx, обрыв соединения),
+    лист перечитывается и план собирается заново, а не отправляется повторно.
+
+    Args:
+        data: Показатели по датам (DailyAggregates или список словарей
+            {'PRODDATE': дата, 'QTY_...': значение}).
+        sheets_config: Таблица и лист цели (по умолчанию GOOGLE_SHEETS_CONFIG).
+        reread: Перечитать лист, не сверяясь с зеркалом: значения на листе
+            могли изменить или очистить вручную, а зеркало сверяет только даты.
+
+    Returns:
+        True, если данные записаны на лист, иначе False.
+    """
+    api_calls = thread_api_calls()
+    api_calls.clear()
+    session = get_session(sheets_config)
+    mirror = get_mirror(sheets_config.get('spreadsheet_id') or sheets_config['spreadsheet_name'],
+                        sheets_config.get('worksheet_id') or sheets_config['worksheet_name'])
+    if not isinstance(data, DailyAggregates):
+        data = DailyAggregates.from_records(data)
+    if reread:
+        mirror.invalidate()
+    for attempt in range(SHEETS_QUOTA_CONFIG['max_retries'] + 1):
         try:
-            logging.info("Применение форматирования шрифта (14, жирный)...")
-            sheet_id = sheet.id if hasattr(sheet, 'id') else sheet._properties.get('sheetId')
-            
-            # Перечитываем данные для получения актуального количества строк
-            latest_values = sheet.get_all_values()
-            total_rows = len(latest_values)
-            
-            format_requests = []
-            
-            # Применяем шрифт 14 и жирный ко всей таблице
-            if total_rows > 0:
-                format_requests.append({
-                    'repeatCell': {
-                        'range': {
-                            'sheetId': sheet_id,
-                            'startRowIndex': 1,
-                            'endRowIndex': total_rows
-                        },
-                        'cell': {
-                            'userEnteredFormat': {
-                                'textFormat': {
-                                    'fontSize': 14,
-                                    'bold': True
-                                }
-                            }
-                        },
-                        'fields': 'userEnteredFormat.textFormat.fontSize,userEnteredFormat.textFormat.bold'
-                    }
-                })
-            
-            # Сначала убираем зеленое выделение со всех строк (кроме заголовка)
-            # Сбрасываем фон на белый для всех строк с данными (первые 4 столбца)
-            if total_rows > 2:
-                format_requests.append({
-                    'repeatCell': {
-                        'range': {
-                            'sheetId': sheet_id,
-                            'startRowIndex': 2,  # С третьей строки 
-                            'endRowIndex': total_rows,
-                            'startColumnIndex': 0,  # Столбец A
-                            'endColumnIndex': 8      # До столбца H включительно
-                        },
-                        'cell': {
-                            'userEnteredFormat': {
-                                'backgroundColor': {
-                                    'red': 1.0,
-                                    'green': 1.0,
-                                    'blue': 1.0
-                                },
-                                'textFormat': {
-                                    'fontSize': 14,
-                                    'bold': True
-                                }
-                            }
-                        },
-                        'fields': 'userEnteredFormat.backgroundColor,userEnteredFormat.textFormat.fontSize,userEnteredFormat.textFormat.bold'
-                    }
-                })
-            
-            # Находим строку с текущей датой и выделяем только первые 6 ячеек светло-зеленым
-            today_str = date.today().strftime('%d.%m.%Y')
-            current_header = [str(h).strip() for h in latest_values[1]] if len(latest_values) > 1 else []
-            
-            try:
-                date_column_index = current_header.index('Дата')
-                for row_idx, row in enumerate(latest_values[2:], start=2):
-                    if row[date_column_index] == today_str:
-                        # Выделяем только первые 6 ячейки строки светло-зеленым цветом
-                        format_requests.append({
-                            'repeatCell': {
-                                'range': {
-                                    'sheetId': sheet_id,
-                                    'startRowIndex': row_idx,
-                                    'endRowIndex': row_idx + 1,
-                                    'startColumnIndex': 0,  # Столбец A
-                                    'endColumnIndex': 8      # До столбца H включительно
-                                },
-                                'cell': {
-                                    'userEnteredFormat': {
-                                        'backgroundColor': {
-                                            'red': 0.85,
-                                            'green': 0.92,
-                                            'blue': 0.83
-                                        },
-                                        'textFormat': {
-                                            'fontSize': 14,
-                                            'bold': True
-                                        }
-                                    }
-                                },
-                                'fields': 'userEnteredFormat.backgroundColor,userEnteredFormat.textFormat.fontSize,userEnteredFormat.textFormat.bold'
-                            }
-                        })
-                        logging.info(f"Найдена и выделена строка с текущей датой: {today_str} (строка {row_idx + 1}, столбцы A-H)")
-                        break
-            except (ValueError, IndexError):
-                logging.warning("Столбец 'Дата' не найден для выделения текущего дня.")
-            
-            if format_requests:
-                spreadsheet.batch_update({'requests': format_requests})
-                logging.info("Форматирование успешно применено.")
-        except Exception as e:
-            logging.error(f"Ошибка при применении форматирования: {e}")
+            ok = _write_sheet(session, mirror, data, sheets_config)
+            if ok:
+                logging.info(f"Обновление данных в Google Sheets завершено. "
+                             f"Запросов к API: чтение — {api_calls['read']}, запись — {api_calls['write']}.")
+                _log_quota()
+            return ok
 
-        logging.info("Обновление данных в Google Sheets завершено.")
+        except FileNotFoundError:
+            logging.error(f"Файл {sheets_config['credentials_file']} не найден. "
+                          f"Пожалуйста, убедитесь, что он находится в корневом каталоге проекта.")
+            return False
+        except Exception as e:
+            # Зеркало уже содержит запланированные, но не записанные изменения —
+            # лист нужно перечитать
+            mirror.invalidate()
+            if is_outcome_unknown(e) and attempt < SHEETS_QUOTA_CONFIG['max_retries']:
+                # batchUpdate мог примениться: план собирается заново по перечитанному листу,
+                # а не отправляется повторно
+                logging.warning(f"Неизвестно, записан ли план на лист ({e}); лист будет перечитан, "
+                                f"план собран заново (попытка {attempt + 2} из {SHEETS_QUOTA_CONFIG['max_retries'] + 1}).")
+                inc('sheet_write_replans')
+                if is_session_error(e):
+                    session.reset()
+                continue
+            logging.error(f"Произошла ошибка при работе с Google Sheets: {e}")
+            if is_session_error(e):
+                session.reset()
+            _log_quota()
+            return False
 
-    except FileNotFoundError:
-        logging.error(f"Файл {GOOGLE_SHEETS_CONFIG['credentials_file']} не найден. "
-                      f"Пожалуйста, убедитесь, что он находится в корневом каталоге проекта.")
-    except Exception as e:
-        logging.error(f"Произошла ошибка при работе с Google Sheets: {e}")
 
 if __name__ == '__main__':
     # Пример использования:
     # Для запуска этого примера, убедитесь, что у вас есть credentials.json
     # и вы предоставили доступ сервисному аккаунту к вашей таблице.
-    
+
     # Пример данных
     sample_data = [
         {'PRODDATE': date(2023, 10, 1), 'QTY_IZD_PVH': 10, 'QTY_RAZDV': 5, 'QTY_MOSNET': 20},
         {'PRODDATE': date(2023, 10, 2), 'QTY_IZD_PVH': 12, 'QTY_RAZDV': 8, 'QTY_MOSNET': 22},
     ]
-    
+
     update_google_sheet(sample_data)
     # print("Для тестирования этого модуля раскомментируйте вызов update_google_sheet "
     #       "и убедитесь в наличии credentials.json")
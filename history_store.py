@@ -0,0 +1,139 @@
+import logging
+import numbers
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from config import HISTORY_CONFIG
+from metrics import METRIC_KEYS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS daily_aggregates (
+        target TEXT NOT NULL,
+        proddate TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value REAL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (target, proddate, metric)
+    ) WITHOUT ROWID
+"""
+
+
+def _to_value(value):
+    """Число из SQLite в том виде, в котором его вернул бы Firebird: целое, если сумма целая."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _to_stored(value):
+    if isinstance(value, numbers.Number) and not isinstance(value, (bool, int, float)):
+        # Decimal из NUMERIC-столбцов Firebird
+        return float(value)
+    return value
+
+
+class HistoryStore:
+    """
+    Локальная история дневных показателей (SQLite), ключ — (цель, дата, показатель).
+
+    Пополняется после каждой выборки из базы и служит кэшем для
+    устоявшихся дат, базой для сравнения с новыми результатами и источником
+    для пересборки листа без обращения к Firebird.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        with self._con:
+            self._con.execute(SCHEMA)
+
+    def _rows_between(self, target: str, start_date: date, end_date: date) -> dict[date, dict]:
+        """Сырые записи {дата: {показатель: (значение, время обновления)}} за период."""
+        cursor = self._con.execute(
+            "SELECT proddate, metric, value, updated_at FROM daily_aggregates "
+            "WHERE target = ? AND proddate BETWEEN ? AND ?",
+            (target, start_date.isoformat(), end_date.isoformat())
+        )
+        result = {}
+        for proddate, metric, value, updated_at in cursor:
+            result.setdefault(date.fromisoformat(proddate), {})[metric] = (_to_value(value), updated_at)
+        return result
+
+    def load(self, target: str, dates: list[date], max_age: timedelta | None = None) -> dict[date, dict]:
+        """
+        Возвращает сохраненные строки по датам в формате fill_dates.
+        Дата попадает в результат, только если по ней сохранены все показатели
+        и (при заданном max_age) они обновлялись не раньше max_age назад.
+
+        Returns:
+            Словарь {дата: {'PRODDATE': дата, 'QTY_...': значение}}.
+        """
+        if not dates:
+            return {}
+        wanted = set(dates)
+        oldest = (datetime.now() - max_age).isoformat(timespec='seconds') if max_age else None
+        with self._lock:
+            stored = self._rows_between(target, min(dates), max(dates))
+
+        rows = {}
+        for proddate, metrics in stored.items():
+            if proddate not in wanted or any(key not in metrics for key in METRIC_KEYS):
+                continue
+            if oldest and min(metrics[key][1] for key in METRIC_KEYS) < oldest:
+                continue
+            rows[proddate] = {'PRODDATE': proddate, **{key: metrics[key][0] for key in METRIC_KEYS}}
+        return rows
+
+    def save(self, target: str, rows: list[dict]) -> list[date]:
+        """
+        Сохраняет строки показателей (после fill_dates) и отмечает время обновления.
+
+        Returns:
+            Даты, значения которых отличаются от ранее сохраненных (или новые).
+        """
+        if not rows:
+            return []
+        now = datetime.now().isoformat(timespec='seconds')
+        dates = [row['PRODDATE'] for row in rows]
+        with self._lock:
+            stored = self._rows_between(target, min(dates), max(dates))
+            changed = []
+            records = []
+            for row in rows:
+                proddate = row['PRODDATE']
+                previous = stored.get(proddate, {})
+                values = {key: _to_stored(row.get(key)) for key in METRIC_KEYS}
+                if any(key not in previous or previous[key][0] != _to_value(values[key]) for key in METRIC_KEYS):
+                    changed.append(proddate)
+                records.extend((target, proddate.isoformat(), key, value, now) for key, value in values.items())
+            with self._con:
+                self._con.executemany(
+                    "INSERT INTO daily_aggregates (target, proddate, metric, value, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (target, proddate, metric) DO UPDATE SET "
+                    "value = excluded.value, updated_at = excluded.updated_at",
+                    records
+                )
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> HistoryStore | None:
+    """Общее для процесса хранилище истории или None, если оно отключено."""
+    global _store
+    if not HISTORY_CONFIG['enabled']:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore(HISTORY_CONFIG['path'])
+        return _store
@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from aggregates import DailyAggregates
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class SyncState:
+    """
+    Локальное состояние инкрементальной синхронизации.
+
+    По каждой дате хранит отпечаток исходных строк orders/orderitems
+    и последние отправленные в таблицу значения показателей.
+    Сохраняется в JSON-файл, поэтому переживает перезапуск приложения.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fingerprints = {}
+        self.rows = {}
+        self.last_full_refresh = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.fingerprints = state.get('fingerprints', {})
+            self.rows = state.get('rows', {})
+            if state.get('last_full_refresh'):
+                self.last_full_refresh = datetime.fromisoformat(state['last_full_refresh'])
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать состояние синхронизации {self.path}, оно будет создано заново: {e}")
+            self.fingerprints, self.rows, self.last_full_refresh = {}, {}, None
+
+    def save(self):
+        state = {
+            'fingerprints': self.fingerprints,
+            'rows': self.rows,
+            'last_full_refresh': self.last_full_refresh.isoformat() if self.last_full_refresh else None
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def full_refresh_due(self, interval_minutes: int) -> bool:
+        if self.last_full_refresh is None:
+            return True
+        return datetime.now() - self.last_full_refresh >= timedelta(minutes=interval_minutes)
+
+    def changed_dates(self, dates: list[date], fingerprints: dict) -> list[date]:
+        """
+        Возвращает даты, отпечаток которых отличается от сохраненного,
+        а также даты, по которым состояние еще не сохранялось.
+        """
+        changed = []
+        for dt in dates:
+            key = dt.isoformat()
+            if key not in self.rows or self.fingerprints.get(key) != fingerprints.get(dt):
+                changed.append(dt)
+        return changed
+
+    def changed_rows(self, rows: 'DailyAggregates') -> 'DailyAggregates':
+        """Отбирает строки, значения которых отличаются от последних отправленных."""
+        from aggregates import DailyAggregates
+        sent = DailyAggregates.from_records([{'PRODDATE': date.fromisoformat(key), **values}
+                                             for key, values in self.rows.items()])
+        return rows.diff(sent)
+
+    def record(self, dates: list[date], fingerprints: dict, rows: 'DailyAggregates'):
+        """Запоминает отпечатки и значения для пересчитанных дат."""
+        for dt in dates:
+            self.fingerprints[dt.isoformat()] = fingerprints.get(dt)
+        for row in rows.records():
+            self.rows[row['PRODDATE'].isoformat()] = _row_values(row)
+
+    def forget_before(self, first_date: date):
+        """Удаляет из состояния даты, вышедшие за начало окна."""
+        first_key = first_date.isoformat()
+        for store in (self.fingerprints, self.rows):
+            for key in [k for k in store if k < first_key]:
+                del store[key]
+
+
+def _row_values(row: dict) -> dict:
+    return {key: float(value) for key, value in row.items() if key != 'PRODDATE'}
+
+
+def date_ranges(dates: list[date]) -> list[tuple[date, date]]:
+    """Группирует даты в непрерывные диапазоны (начало, конец включительно)."""
+    ranges = []
+    for dt in sorted(dates):
+        if ranges and dt == ranges[-1][1] + timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], dt)
+        else:
+            ranges.append((dt, dt))
+    return ranges
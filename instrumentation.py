@@ -0,0 +1,238 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from config import INSTRUMENTATION_CONFIG
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+METRIC_PREFIX = 'altawin'
+
+_lock = threading.Lock()
+# (имя, метки) -> [количество, сумма секунд, максимум, последнее]
+_spans = {}
+# (имя, метки) -> значение
+_counters = defaultdict(float)
+_gauges = {}
+
+# Текущий запуск: спаны и счетчики копятся отдельно для JSON-сводки.
+# Цели обрабатываются параллельно, поэтому запуск хранится в контексте потока
+_current_run = contextvars.ContextVar('instrumentation_run', default=None)
+# '<запуск>:<цель>' -> сводка последнего запуска
+_summaries = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    current = _current_run.get()
+    if current is not None and current['target'] is not None and 'target' not in labels:
+        labels = {**labels, 'target': current['target']}
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+@contextmanager
+def span(name: str, **labels):
+    """
+    Замеряет длительность блока. Результат попадает в метрику
+    altawin_span_seconds{span=name, ...} и в сводку текущего запуска.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        key = _key(name, labels)
+        current = _current_run.get()
+        with _lock:
+            stats = _spans.setdefault(key, [0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] = elapsed
+            if current is not None:
+                run_stats = current['spans'].setdefault(key, [0, 0.0])
+                run_stats[0] += 1
+                run_stats[1] += elapsed
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличивает счетчик altawin_<name>_total."""
+    key = _key(name, labels)
+    current = _current_run.get()
+    with _lock:
+        _counters[key] += value
+        if current is not None:
+            current['counters'][key] += value
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+@contextmanager
+def run(name: str, target: str | None = None):
+    """
+    Оборачивает один цикл синхронизации: замеряет его длительность,
+    сравнивает с бюджетом цикла и сохраняет JSON-сводку запуска.
+    Все спаны и счетчики внутри цикла получают метку target.
+    """
+    budget = INSTRUMENTATION_CONFIG['cycle_budget_seconds']
+    started_at = datetime.now()
+    current = {'target': target, 'spans': {}, 'counters': defaultdict(float)}
+    token = _current_run.set(current)
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        duration = time.perf_counter() - started
+        _current_run.reset(token)
+        _record_cycle(name, target, duration, ok)
+        summary = {
+            'run': name,
+            'target': target,
+            'started': started_at.isoformat(timespec='seconds'),
+            'duration_seconds': round(duration, 3),
+            'budget_seconds': budget,
+            'budget_used': round(duration / budget, 3) if budget else None,
+            'ok': ok,
+            'spans': [
+                {'span': key[0], **dict(key[1]), 'count': count, 'seconds': round(seconds, 3)}
+                for key, (count, seconds) in sorted(current['spans'].items(), key=lambda item: -item[1][1])
+            ],
+            'counters': [
+                {'counter': key[0], **dict(key[1]), 'value': value}
+                for key, value in sorted(current['counters'].items())
+            ]
+        }
+        with _lock:
+            _summaries[f"{name}:{target}" if target else name] = summary
+        _write_summaries()
+
+        title = f"{name}:{target}" if target else name
+        if budget and duration >= budget * INSTRUMENTATION_CONFIG['budget_warning_ratio']:
+            logging.warning(f"Цикл '{title}' занял {duration:.1f} с — это {duration / budget:.0%} "
+                            f"бюджета {budget:.0f} с.")
+        else:
+            logging.info(f"Цикл '{title}' занял {duration:.2f} с.")
+
+
+def _record_cycle(name: str, target: str | None, duration: float, ok: bool):
+    labels = {'run': name, 'target': target or ''}
+    set_gauge('cycle_duration_seconds', duration, **labels)
+    set_gauge('cycle_budget_seconds', INSTRUMENTATION_CONFIG['cycle_budget_seconds'], **labels)
+    set_gauge('cycle_last_timestamp_seconds', time.time(), **labels)
+    set_gauge('cycle_last_success', 1 if ok else 0, **labels)
+    inc('cycles', status='ok' if ok else 'error', **labels)
+
+
+def _write_summaries():
+    path = INSTRUMENTATION_CONFIG['summary_file']
+    if not path:
+        return
+    summaries = last_summaries()
+    with _lock:
+        # Потоки целей не должны одновременно писать один временный файл
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(summaries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить сводку запуска в {path}: {e}")
+
+
+def last_summaries() -> dict:
+    """Сводки последних запусков по ключу '<запуск>:<цель>'."""
+    with _lock:
+        return dict(_summaries)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: tuple, **extra) -> str:
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + '}'
+
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    with _lock:
+        spans = {key: list(stats) for key, stats in _spans.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = []
+    name = f'{METRIC_PREFIX}_span_seconds'
+    lines += [f'# HELP {name} Длительность этапов синхронизации.', f'# TYPE {name} summary']
+    for (span_name, labels), (count, total, _, _) in sorted(spans.items()):
+        lines.append(f'{name}_sum{_labels(labels, span=span_name)} {total:.6f}')
+        lines.append(f'{name}_count{_labels(labels, span=span_name)} {count}')
+    for suffix, index in (('max', 2), ('last', 3)):
+        gauge_name = f'{METRIC_PREFIX}_span_{suffix}_seconds'
+        lines.append(f'# TYPE {gauge_name} gauge')
+        for (span_name, labels), stats in sorted(spans.items()):
+            lines.append(f'{gauge_name}{_labels(labels, span=span_name)} {stats[index]:.6f}')
+
+    for counter_name in sorted({key[0] for key in counters}):
+        full_name = f'{METRIC_PREFIX}_{counter_name}_total'
+        lines.append(f'# TYPE {full_name} counter')
+        for (name_, labels), value in sorted(counters.items()):
+            if name_ == counter_name:
+                lines.append(f'{full_name}{_labels(labels)} {float(value)!r}')
+
+    for gauge_name in sorted({key[0] for key in gauges}):
+        full_name = f'{METRIC_PREFIX}_{gauge_name}'
+        lines.append(f'# TYPE {full_name} gauge')
+        for (name_, labels), value in sorted(gauges.items()):
+            if name_ == gauge_name:
+                lines.append(f'{full_name}{_labels(labels)} {float(value)!r}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _handler_class():
+    # http.server (с ssl и email) импортируется только при включенном HTTP-сервере
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = render_prometheus().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path == '/summary':
+                body = json.dumps(last_summaries(), ensure_ascii=False, indent=2).encode('utf-8')
+                content_type = 'application/json; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Запросы Prometheus не засоряют журнал приложения
+            pass
+
+    return MetricsHandler
+
+
+def start_http_server(host: str, port: int):
+    """Запускает в фоновом потоке HTTP-сервер с /metrics и /summary."""
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host, port), _handler_class())
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"Метрики доступны на http://{host}:{server.server_address[1]}/metrics, сводка запуска — /summary.")
+    return server
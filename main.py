@@ -1,84 +1,345 @@
-import schedule
-import time
+"""
+Синхронизация показателей Altawin с Google Sheets.
+
+    python main.py                        # работа по расписанию
+    python main.py --once                 # один цикл по периоду выгрузки (для планировщика ОС)
+    python main.py --once --target site2  # один цикл одной цели
+    python main.py --since 2025-10-01 --until 2025-10-07 --dry-run  # показать данные, не записывая
+
+Модули работы с базой (fdb), Google Sheets (gspread, oauth2client)
+и дневными показателями (aggregates.py, numpy) импортируются при первом
+обращении к соответствующему этапу, чтобы процесс (и собранный
+PyInstaller exe) запускался быстро.
+"""
+import argparse
 import logging
+import sqlite3
 from datetime import date, timedelta, datetime
-from database import get_data_from_db
-from google_sheets import update_google_sheet
+from config import EVENTS_CONFIG, FETCH_CONFIG, HISTORY_CONFIG, INCREMENTAL_CONFIG, INSTRUMENTATION_CONFIG
+from history_store import get_store
+from incremental import SyncState, date_ranges
+from instrumentation import inc, run, set_gauge, span, start_http_server
+from metrics import HEADER
+from outbox import get_outbox
+from scheduling import CycleScheduler, get_window
+from targets import Target, find_target, runner, targets
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from aggregates import DailyAggregates
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def job():
+def fetch_data(target: Target, start_date: date, end_date: date) -> 'DailyAggregates | None':
+    """Выборка из базы цели с замером времени этапа."""
+    from database import get_data_from_db
+    with span('stage', stage='db_fetch'):
+        return get_data_from_db(start_date, end_date, target.db_config)
+
+def collect_rows(target: Target, dates: list[date], use_history: bool = True) -> 'DailyAggregates | None':
+    """
+    Строки показателей по списку дат (в формате fill_dates).
+
+    Устоявшиеся даты (раньше сегодняшней на HISTORY_CONFIG['settled_after_days']
+    дней) берутся из локальной истории, если она обновлялась не раньше
+    settled_max_age_minutes назад; остальные выбираются из базы
+    непрерывными периодами и сохраняются в историю.
+
+    Returns:
+        Строки по возрастанию даты или None, если выборка из базы не удалась.
+    """
+    from aggregates import DailyAggregates, fill_dates
+    store = get_store()
+    cached = {}
+    if store is not None and use_history:
+        settled_limit = date.today() - timedelta(days=HISTORY_CONFIG['settled_after_days'])
+        settled = [dt for dt in dates if dt <= settled_limit]
+        with span('history_load'):
+            cached = store.load(target.name, settled, timedelta(minutes=HISTORY_CONFIG['settled_max_age_minutes']))
+        if cached:
+            logging.info(f"[{target.name}] Из локальной истории взято дат: {len(cached)}.")
+            inc('history_dates_served', len(cached))
+
+    to_fetch = [dt for dt in dates if dt not in cached]
+    db_data = DailyAggregates.empty()
+    for range_start, range_end in date_ranges(to_fetch):
+        range_data = fetch_data(target, range_start, range_end)
+        if range_data is None:
+            return None
+        db_data = db_data.merge(range_data)
+
+    with span('fill_dates'):
+        fetched_rows = fill_dates(db_data, to_fetch)
+
+    if store is not None and fetched_rows:
+        with span('history_save'):
+            changed = store.save(target.name, fetched_rows.records())
+        inc('history_changed_dates', len(changed))
+        logging.info(f"[{target.name}] Изменившихся дат относительно локальной истории: {len(changed)}.")
+
+    return DailyAggregates.concat([DailyAggregates.from_records(list(cached.values())), fetched_rows])
+
+def update_sheet(target: Target, data: 'DailyAggregates', reread: bool = False) -> bool:
+    """
+    Запись на лист цели с замером времени этапа и учетом неудач.
+
+    При включенной очереди записи (OUTBOX_CONFIG) строки сначала ставятся
+    в очередь, и на лист отправляется вся очередь цели: вместе с data
+    дописываются строки, не записанные в прошлых запусках. После успешной
+    записи отправленное удаляется из очереди, при ошибке остается в ней.
+    С reread лист перечитывается целиком (см. update_google_sheet).
+    """
+    from aggregates import DailyAggregates
+    from google_sheets import update_google_sheet
+    outbox = get_outbox()
+    version = None
+    if outbox is not None:
+        try:
+            outbox.put(target.name, data.records())
+            pending, version = outbox.pending(target.name)
+        except sqlite3.Error as e:
+            logging.error(f"[{target.name}] Ошибка очереди записи {outbox.path}, строки отправляются напрямую: {e}")
+        else:
+            backlog = len(pending) - len(data)
+            if backlog > 0:
+                logging.info(f"[{target.name}] Из очереди записи добавлено дат, не записанных ранее: {backlog}.")
+            data = DailyAggregates.from_records(pending)
+            set_gauge('outbox_pending_dates', len(data), target=target.name)
+            if not data:
+                return True
+    with span('stage', stage='sheets_update'):
+        ok = update_google_sheet(data, target.sheets_config, reread)
+    inc('rows_pushed', len(data))
+    if not ok:
+        inc('sheet_update_failures')
+        if version is not None:
+            logging.warning(f"[{target.name}] Строки оставлены в очереди записи (дат: {len(data)}) "
+                            f"и будут отправлены при следующем запуске.")
+    elif version is not None:
+        outbox.ack(target.name, version)
+        set_gauge('outbox_pending_dates', outbox.pending_dates(target.name), target=target.name)
+    return ok
+
+def flush_outbox(target: Target) -> bool:
+    """Дописывает на лист строки из очереди записи, если они есть (без новых данных)."""
+    outbox = get_outbox()
+    if outbox is None or not outbox.pending_dates(target.name):
+        return True
+    from aggregates import DailyAggregates
+    logging.info(f"[{target.name}] Отправка строк, оставшихся в очереди записи...")
+    return update_sheet(target, DailyAggregates.empty())
+
+def incremental_job(target: Target, all_dates: list[date], full_window: bool = True) -> bool:
+    """
+    Пересчитывает и отправляет в таблицу только те из дат all_dates, у которых
+    изменился отпечаток строк orders/orderitems. Раз в
+    INCREMENTAL_CONFIG['full_refresh_minutes'] пересчитывается весь период
+    (в цикле, который охватывает весь период выгрузки, — full_window; по
+    расписанию такой цикл запускается по full_refresh_due).
+
+    Returns:
+        False, если не удалось получить данные или записать их на лист.
+    """
+    from database import get_date_fingerprints
+    if target.sync_state is None:
+        target.sync_state = SyncState(target.state_file)
+    state = target.sync_state
+
+    fingerprints = get_date_fingerprints(all_dates[0], all_dates[-1], target.db_config)
+    if fingerprints is None:
+        logging.warning(f"[{target.name}] Пропускаем обновление Google Sheets, так как отпечатки дат из БД не были получены.")
+        return False
+
+    full_refresh = full_window and state.full_refresh_due(INCREMENTAL_CONFIG['full_refresh_minutes'])
+    dates_to_refresh = all_dates if full_refresh else state.changed_dates(all_dates, fingerprints)
+    if not dates_to_refresh:
+        logging.info(f"[{target.name}] Изменений в заказах нет — пересчет и обновление таблицы не требуются.")
+        return flush_outbox(target)
+
+    logging.info(f"[{target.name}] {'Полный пересчет' if full_refresh else 'Изменившихся дат'}: {len(dates_to_refresh)}.")
+    # Даты с измененным отпечатком всегда перечитываются из базы
+    refreshed_rows = collect_rows(target, dates_to_refresh, use_history=False)
+    if refreshed_rows is None:
+        logging.warning(f"[{target.name}] Пропускаем обновление Google Sheets, так как данные из БД не были получены.")
+        return False
+
+    # При полном пересчете отправляются все строки по перечитанному листу: так
+    # исправляются значения, измененные на листе вручную или потерянные при записи.
+    # update_google_sheet дочитывает строки периода с листа и совпадающие не записывает.
+    rows_to_push = refreshed_rows if full_refresh else state.changed_rows(refreshed_rows)
+    ok = True
+    if rows_to_push:
+        ok = update_sheet(target, rows_to_push, reread=full_refresh)
+        outbox = get_outbox()
+        if not ok and (outbox is None or not outbox.pending_dates(target.name)):
+            # Состояние не сохраняем: эти даты будут отправлены при следующем запуске
+            return False
+        # Иначе строки сохранены в очереди записи — пересчитывать их повторно не нужно
+    else:
+        logging.info(f"[{target.name}] Значения показателей не изменились — обновление таблицы не требуется.")
+        ok = flush_outbox(target)
+
+    state.record(dates_to_refresh, fingerprints, refreshed_rows)
+    state.forget_before(get_window()[0])
+    if full_refresh:
+        state.last_full_refresh = datetime.now()
+    state.save()
+    return ok
+
+def full_refresh_due(target: Target) -> bool:
+    """Пора ли инкрементальной синхронизации цели пересчитать весь период выгрузки."""
+    if not INCREMENTAL_CONFIG['enabled']:
+        return False
+    if target.sync_state is None:
+        target.sync_state = SyncState(target.state_file)
+    return target.sync_state.full_refresh_due(INCREMENTAL_CONFIG['full_refresh_minutes'])
+
+def refresh_dates(target: Target, dates: list[date]) -> bool:
     """
-    Основная задача, которая выполняется по расписанию.
+    Пересчитывает и отправляет в таблицу цели только указанные даты
+    (используется при обновлении по событиям Firebird). Если цель занята
+    запуском по таймеру, ждет его завершения.
+
+    Returns:
+        False, если данные не получены или не записаны на лист и не
+        сохранены в очереди записи — тогда даты остаются в журнале событий.
+    """
+    start_date, end_date = get_window()
+    dates = sorted(dt for dt in set(dates) if start_date <= dt <= end_date)
+    if not dates:
+        logging.info(f"[{target.name}] Измененные даты вне периода выгрузки — обновление не требуется.")
+        return True
+
+    with target.lock, run('event_refresh', target.name):
+        logging.info(f"[{target.name}] Обновление по событию: {len(dates)} дат.")
+        # Даты из события изменились в базе — история для них устарела
+        full_data = collect_rows(target, dates, use_history=False)
+        if full_data is None:
+            logging.warning(f"[{target.name}] Пропускаем обновление Google Sheets, так как данные из БД не были получены.")
+            return False
+        if update_sheet(target, full_data):
+            return True
+        # Строки, оставшиеся в очереди записи, будут отправлены при следующем запуске
+        outbox = get_outbox()
+        return outbox is not None and bool(outbox.pending_dates(target.name))
+
+def job(wait: bool = True):
     """
-    logging.info("Запуск задачи по обновлению данных...")
-    
-    # Определяем период - за последние 14 дней и на 10 дней вперед
-    today = date.today()
-    start_date = today - timedelta(days=14)
-    end_date = today + timedelta(days=14)
-    
-    # 1. Получаем данные из Firebird
-    db_data = get_data_from_db(start_date, end_date)
-    
-    # 2. Если данные успешно получены, обрабатываем их и обновляем Google Sheet
-    if db_data is not None:
-        # Создаем полный список дат за период
-        all_dates = [start_date + timedelta(days=x) for x in range((end_date - start_date).days + 1)]
-        
-        # Преобразуем данные из БД в словарь для быстрого доступа по дате,
-        # нормализуя ключ к типу date.
-        db_data_map = {}
-        for row in db_data:
-            db_date = row['PRODDATE']
-            # Firebird может возвращать datetime, а мы сравниваем с date
-            if isinstance(db_date, datetime):
-                db_date = db_date.date()
-            db_data_map[db_date] = row
-        
-        full_data = []
-        for dt in all_dates:
-            if dt in db_data_map:
-                row = db_data_map[dt]
-                full_data.append({
-                    'PRODDATE': row.get('PRODDATE', dt),
-                    'QTY_IZD_PVH': row.get('QTY_IZD_PVH', 0),
-                    'QTY_RAZDV': row.get('QTY_RAZDV', 0),
-                    'QTY_MOSNET': row.get('QTY_MOSNET', 0),
-                    'QTY_GLASS_PACKS': row.get('QTY_GLASS_PACKS', 0),
-                    'QTY_SANDWICHES': row.get('QTY_SANDWICHES', 0),
-                    'QTY_WINDOWSILLS': row.get('QTY_WINDOWSILLS', 0),
-                    'QTY_IRON': row.get('QTY_IRON', 0)
-                })
-            else:
-                # Если данных за эту дату нет, добавляем строку с нулями
-                full_data.append({
-                    'PRODDATE': dt,
-                    'QTY_IZD_PVH': 0,
-                    'QTY_RAZDV': 0,
-                    'QTY_MOSNET': 0,
-                    'QTY_GLASS_PACKS': 0,
-                    'QTY_SANDWICHES': 0,
-                    'QTY_WINDOWSILLS': 0,
-                    'QTY_IRON': 0
-                })
-        
-        update_google_sheet(full_data)
+    Обновляет все цели по всему периоду выгрузки, не более
+    TARGETS_CONFIG['max_parallel'] одновременно. По расписанию цели
+    обновляются по полосам дат (scheduling.CycleScheduler).
+
+    Args:
+        wait: Ждать завершения всех целей.
+    """
+    runner.run_all(target_job, wait_for_all=wait)
+
+def target_job(target: Target, dates: list[date] | None = None) -> bool:
+    """Цикл обновления одной цели: по указанным датам или по всему периоду выгрузки."""
+    with run('job', target.name):
+        return _run_job(target, dates)
+
+def _run_job(target: Target, dates: list[date] | None = None) -> bool:
+    logging.info(f"[{target.name}] Запуск задачи по обновлению данных...")
+
+    # Определяем период - за последние 14 дней и на 14 дней вперед
+    start_date, end_date = get_window()
+
+    # Создаем полный список дат за период
+    window_dates = [start_date + timedelta(days=x) for x in range((end_date - start_date).days + 1)]
+    all_dates = window_dates if dates is None else sorted(dates)
+
+    if INCREMENTAL_CONFIG['enabled']:
+        ok = incremental_job(target, all_dates, full_window=len(all_dates) == len(window_dates))
+        logging.info(f"[{target.name}] Задача завершена.")
+        return ok
+
+    # 1. Получаем данные из Firebird (устоявшиеся даты — из локальной истории)
+    full_data = collect_rows(target, all_dates)
+
+    # 2. Если данные успешно получены, обновляем Google Sheet
+    ok = False
+    if full_data is not None:
+        ok = update_sheet(target, full_data)
     else:
-        logging.warning("Пропускаем обновление Google Sheets, так как данные из БД не были получены.")
-        
-    logging.info("Задача завершена. Следующий запуск через 5 минут.")
+        logging.warning(f"[{target.name}] Пропускаем обновление Google Sheets, так как данные из БД не были получены.")
+
+    logging.info(f"[{target.name}] Задача завершена.")
+    return ok
+
+def dry_run_job(target: Target, dates: list[date]) -> bool:
+    """Выбирает показатели из базы и печатает их таблицей, ничего не записывая на лист."""
+    with run('dry_run', target.name):
+        rows = collect_rows(target, dates, use_history=False)
+    if rows is None:
+        logging.warning(f"[{target.name}] Данные из БД не были получены.")
+        return False
+    print(f"# {target.name}")
+    print('\t'.join(HEADER))
+    for proddate, row in zip(rows.date_keys(), rows.sheet_rows(HEADER)):
+        print('\t'.join([proddate] + [str(value) for value in row[1:]]))
+    return True
+
+def run_once(selected: list[Target], dates: list[date] | None, dry_run: bool) -> bool:
+    """Один цикл по выбранным целям (параллельно, как по расписанию)."""
+    if dry_run:
+        window_start, window_end = get_window()
+        dates = dates or [window_start + timedelta(days=x) for x in range((window_end - window_start).days + 1)]
+        return all([dry_run_job(target, dates) for target in selected])
+    futures = [runner.submit(target, target_job, dates) for target in selected]
+    return all(future is not None and future.result() for future in futures)
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Синхронизация показателей Altawin с Google Sheets")
+    parser.add_argument('--once', action='store_true',
+                        help="Выполнить один цикл и завершиться (код возврата 1 при ошибке)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Только выбрать данные из базы и вывести их, без записи на лист и в историю")
+    parser.add_argument('--since', type=date.fromisoformat, help="Начало периода, ГГГГ-ММ-ДД (вместо периода выгрузки)")
+    parser.add_argument('--until', type=date.fromisoformat, help="Конец периода, ГГГГ-ММ-ДД (по умолчанию сегодня)")
+    parser.add_argument('--target', help="Имя цели из TARGETS_FILE (по умолчанию все цели)")
+    args = parser.parse_args(argv)
+    if args.until and not args.since:
+        parser.error("--until задается вместе с --since")
+    if args.since and args.since > (args.until or date.today()):
+        parser.error("--since не может быть позже --until")
+    if args.target:
+        try:
+            find_target(args.target)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    selected_targets = [find_target(args.target)] if args.target else targets
+
+    if FETCH_CONFIG['mode'] == 'single_scan':
+        # Показатель без условия в single_scan.METRIC_MASKS — ошибка при запуске, а не нули на листе
+        import single_scan  # noqa: F401
+
+    if args.once or args.dry_run or args.since:
+        if args.dry_run:
+            # Пробный запуск ничего не меняет: ни лист, ни локальную историю
+            HISTORY_CONFIG['enabled'] = False
+        period = None
+        if args.since:
+            until = args.until or date.today()
+            period = [args.since + timedelta(days=x) for x in range((until - args.since).days + 1)]
+        raise SystemExit(0 if run_once(selected_targets, period, args.dry_run) else 1)
+
     logging.info("Приложение запущено. Первая выгрузка данных начнется немедленно.")
-    
-    # Запускаем задачу сразу при старте
-    job()
-    
-    # Настраиваем расписание - каждые 5 минут
-    schedule.every(5).minutes.do(job)
-    
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+
+    if INSTRUMENTATION_CONFIG['port']:
+        start_http_server(INSTRUMENTATION_CONFIG['host'], INSTRUMENTATION_CONFIG['port'])
+
+    if EVENTS_CONFIG['enabled']:
+        # Обновление по событиям Firebird: свой слушатель у каждой базы; таймер ниже остается резервным
+        from events import EventListener
+        for event_target in selected_targets:
+            EventListener(on_change=lambda dates, t=event_target: refresh_dates(t, dates),
+                          db_config=event_target.db_config).start()
+
+    # Расписание по полосам дат; первый цикл по всему периоду начинается сразу
+    CycleScheduler(selected_targets, runner, target_job, get_window, full_refresh_due).run_forever()
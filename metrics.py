@@ -0,0 +1,94 @@
+import logging
+import re
+from config import FETCH_CONFIG, METRICS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Столбец даты — первый в таблице и общий ключ всех запросов
+DATE_KEY = 'PRODDATE'
+DATE_LABEL = 'Дата'
+
+BASE_FROM = """
+        FROM orders o
+        JOIN orderitems oi ON oi.orderid = o.orderid"""
+
+
+def _join_path(metric: dict) -> str:
+    """Нормализованные соединения показателя: по ним показатели объединяются в запросы."""
+    return re.sub(r'\s+', ' ', metric['joins']).strip().upper()
+
+
+def build_query(metrics: list[dict]) -> str:
+    """
+    Строит запрос по показателям с одинаковыми соединениями.
+
+    Один показатель считается простым SUM с его условием в WHERE.
+    Несколько — условными суммами SUM(CASE WHEN ...) за один проход
+    по соединенным таблицам; в WHERE остается объединение условий.
+    Для даты, где есть строки только по части показателей, остальные
+    вернутся как NULL и будут заменены значением по умолчанию.
+    """
+    if len(metrics) == 1:
+        metric = metrics[0]
+        select = f"SUM({metric['value']}) AS {metric['key']}"
+        condition = f"({metric['filter']})"
+    else:
+        select = ",\n            ".join(
+            f"SUM(CASE WHEN {metric['filter']} THEN {metric['value']} END) AS {metric['key']}"
+            for metric in metrics
+        )
+        condition = "(" + "\n            OR ".join(f"({metric['filter']})" for metric in metrics) + ")"
+
+    return f"""
+        SELECT
+            o.proddate,
+            {select}{BASE_FROM}
+        {metrics[0]['joins'].strip()}
+        WHERE o.proddate BETWEEN ? AND ?
+            AND {condition}
+        GROUP BY o.proddate
+    """
+
+
+def plan_queries(metrics: list[dict], fuse: bool = True) -> dict[str, str]:
+    """
+    Группирует показатели по соединениям и строит по запросу на группу.
+
+    Args:
+        metrics: Реестр показателей (config.METRICS).
+        fuse: False — отдельный запрос на каждый показатель.
+
+    Returns:
+        Словарь {имя запроса: SQL} в порядке первого показателя группы.
+        Имя запроса — имена показателей через '+'.
+    """
+    keys = [metric['key'] for metric in metrics]
+    duplicates = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicates:
+        raise ValueError(f"Повторяющиеся ключи показателей в METRICS: {', '.join(duplicates)}")
+
+    groups = {}
+    for metric in metrics:
+        group_key = _join_path(metric) if fuse else metric['key']
+        groups.setdefault(group_key, []).append(metric)
+
+    return {'+'.join(metric['name'] for metric in group): build_query(group) for group in groups.values()}
+
+
+METRIC_KEYS = [metric['key'] for metric in METRICS]
+
+METRIC_DEFAULTS = {metric['key']: metric.get('default', 0) for metric in METRICS}
+
+# Заголовок таблицы и соответствие ключей БД названиям столбцов
+HEADER = [DATE_LABEL] + [metric['label'] for metric in METRICS]
+
+COLUMN_NAMES = {DATE_KEY: DATE_LABEL, **{metric['key']: metric['label'] for metric in METRICS}}
+
+SQL_QUERIES = plan_queries(METRICS, FETCH_CONFIG['fuse_metrics'])
+
+
+if __name__ == '__main__':
+    # Просмотр плана: python metrics.py
+    logging.info(f"Показателей: {len(METRICS)}, запросов: {len(SQL_QUERIES)}.")
+    for name, query in SQL_QUERIES.items():
+        print(f"-- {name}{query}")
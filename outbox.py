@@ -0,0 +1,110 @@
+import logging
+import sqlite3
+import threading
+from datetime import date, datetime
+from config import OUTBOX_CONFIG
+from history_store import _to_stored, _to_value
+from metrics import METRIC_KEYS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pending_cells (
+        target TEXT NOT NULL,
+        proddate TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value REAL,
+        version INTEGER NOT NULL,
+        queued_at TEXT NOT NULL,
+        PRIMARY KEY (target, proddate, metric)
+    ) WITHOUT ROWID
+"""
+
+
+class Outbox:
+    """
+    Очередь записи на лист (SQLite), ключ — (цель, дата, показатель).
+
+    Строки, подготовленные для листа, сначала ставятся в очередь и удаляются
+    из нее только после успешной записи. Более новое значение ячейки
+    заменяет ожидающее, поэтому после сбоя Sheets API любой длительности
+    очередь содержит по одному последнему значению на ячейку и отправляется
+    одной записью, а не повторами всех неудавшихся запусков.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        with self._con:
+            self._con.execute(SCHEMA)
+
+    def put(self, target: str, rows: list[dict]):
+        """Ставит строки показателей (после fill_dates) в очередь, заменяя ожидающие значения тех же ячеек."""
+        if not rows:
+            return
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._con:
+            version = self._con.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM pending_cells WHERE target = ?", (target,)
+            ).fetchone()[0]
+            self._con.executemany(
+                "INSERT INTO pending_cells (target, proddate, metric, value, version, queued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (target, proddate, metric) DO UPDATE SET "
+                "value = excluded.value, version = excluded.version, queued_at = excluded.queued_at",
+                [
+                    (target, row['PRODDATE'].isoformat(), key, _to_stored(row[key]), version, now)
+                    for row in rows for key in METRIC_KEYS if key in row
+                ]
+            )
+
+    def pending(self, target: str) -> tuple[list[dict], int]:
+        """
+        Ожидающие записи строки цели в формате fill_dates.
+
+        Returns:
+            (строки по возрастанию даты, версия очереди для ack).
+        """
+        with self._lock:
+            cursor = self._con.execute(
+                "SELECT proddate, metric, value, version FROM pending_cells WHERE target = ? ORDER BY proddate",
+                (target,)
+            )
+            rows = {}
+            version = 0
+            for proddate, metric, value, row_version in cursor:
+                row = rows.setdefault(proddate, {'PRODDATE': date.fromisoformat(proddate)})
+                row[metric] = _to_value(value)
+                version = max(version, row_version)
+        return list(rows.values()), version
+
+    def pending_dates(self, target: str) -> int:
+        with self._lock:
+            return self._con.execute(
+                "SELECT COUNT(DISTINCT proddate) FROM pending_cells WHERE target = ?", (target,)
+            ).fetchone()[0]
+
+    def ack(self, target: str, version: int):
+        """Удаляет из очереди записанные значения: поставленные не позже версии version."""
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM pending_cells WHERE target = ? AND version <= ?", (target, version))
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox | None:
+    """Общая для процесса очередь записи или None, если она отключена."""
+    global _outbox
+    if not OUTBOX_CONFIG['enabled']:
+        return None
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(OUTBOX_CONFIG['path'])
+        return _outbox
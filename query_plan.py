@@ -0,0 +1,283 @@
+"""
+Диагностика выполнения запросов показателей в Firebird.
+
+Для каждого запроса из metrics.SQL_QUERIES (или по запросу на показатель
+с --per-metric) на отдельном соединении:
+  - запрос подготавливается, план берется из PreparedStatement.plan;
+  - запрос выполняется за период выгрузки, замеряются время, строки,
+    счетчики соединения (reads, writes, fetches, marks из db_info)
+    и чтения по таблицам (get_table_access_stats: sequential — полные
+    проходы, indexed — по индексу);
+  - таблицы, которые план читает NATURAL, отмечаются, а если полных
+    чтений не меньше --large-table-reads — по ним даются советы по индексам.
+
+Отчет сохраняется в JSON вместе с версией сервера и ODS, чтобы сравнивать
+выполнение на разных версиях базы Altawin (--compare).
+
+Пример:
+    python query_plan.py
+    python query_plan.py --per-metric --target site2 --output plan_site2.json
+    python query_plan.py --compare query_plan_report.json --output plan_new.json
+"""
+import argparse
+import json
+import logging
+import re
+import time
+from datetime import date, datetime
+import fdb
+from config import FINGERPRINT_QUERY, METRICS, RAW_EXTRACT_QUERY
+from metrics import SQL_QUERIES, plan_queries
+from scheduling import get_window
+from summary import SUMMARY_QUERY
+from targets import find_target
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_REPORT = 'query_plan_report.json'
+
+IO_COUNTERS = {
+    'reads': fdb.isc_info_reads,
+    'writes': fdb.isc_info_writes,
+    'fetches': fdb.isc_info_fetches,
+    'marks': fdb.isc_info_marks
+}
+
+# Псевдонимы таблиц запроса: FROM orders o, JOIN orderitems oi ...
+_ALIAS_RE = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_$][\w$]*)\s+(?:AS\s+)?([A-Za-z_$][\w$]*)', re.IGNORECASE)
+# Таблица, читаемая планом без индекса: "O NATURAL"
+_NATURAL_RE = re.compile(r'([A-Za-z_$][\w$]*)\s+NATURAL', re.IGNORECASE)
+_SQL_KEYWORDS = {'ON', 'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'GROUP', 'ORDER', 'UNION', 'SELECT'}
+
+
+def table_aliases(sql: str) -> dict[str, str]:
+    """Карта псевдоним -> таблица (в верхнем регистре, как в плане)."""
+    aliases = {}
+    for table, alias in _ALIAS_RE.findall(sql):
+        if alias.upper() in _SQL_KEYWORDS:
+            alias = table
+        aliases[alias.upper()] = table.upper()
+    return aliases
+
+
+def natural_scans(plan: str, aliases: dict[str, str]) -> list[tuple[str, str]]:
+    """Пары (псевдоним, таблица), которые план читает NATURAL."""
+    scans = []
+    for alias in _NATURAL_RE.findall(plan or ''):
+        alias = alias.upper()
+        scans.append((alias, aliases.get(alias, alias)))
+    return scans
+
+
+def predicate_columns(sql: str, alias: str) -> tuple[list[str], list[str]]:
+    """
+    Столбцы псевдонима alias в условиях запроса.
+
+    Returns:
+        (столбцы в сравнениях =, IN, BETWEEN, <, >; столбцы в LIKE с ведущим %).
+    """
+    prefix = re.escape(alias)
+    compared = re.findall(rf'\b{prefix}\.(\w+)\s*(?:=|<|>|IN\b|BETWEEN\b)', sql, re.IGNORECASE)
+    compared += re.findall(rf'(?:=|<|>)\s*{prefix}\.(\w+)', sql, re.IGNORECASE)
+    leading_like = re.findall(rf"\b{prefix}\.(\w+)\s+LIKE\s+'%", sql, re.IGNORECASE)
+    return (list(dict.fromkeys(name.upper() for name in compared)),
+            list(dict.fromkeys(name.upper() for name in leading_like)))
+
+
+def indexed_columns(cursor, table: str) -> set[str]:
+    """Столбцы, с которых начинается хотя бы один активный индекс таблицы."""
+    cursor.execute(
+        "SELECT TRIM(s.rdb$field_name) FROM rdb$indices i "
+        "JOIN rdb$index_segments s ON s.rdb$index_name = i.rdb$index_name "
+        "WHERE i.rdb$relation_name = ? AND s.rdb$field_position = 0 "
+        "AND COALESCE(i.rdb$index_inactive, 0) = 0",
+        (table,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _io_counters(con) -> dict:
+    info = con.db_info(list(IO_COUNTERS.values()))
+    return {name: info[code] for name, code in IO_COUNTERS.items()}
+
+
+def _table_counters(con) -> dict[str, tuple[int, int]]:
+    return {
+        stats.table_name.strip().upper(): (stats.sequential or 0, stats.indexed or 0)
+        for stats in con.get_table_access_stats()
+    }
+
+
+def advise(sql: str, scans: list[dict], cursor) -> list[str]:
+    """Советы по индексам для NATURAL-чтений больших таблиц."""
+    advice = []
+    for scan in scans:
+        if not scan['large']:
+            continue
+        table, alias = scan['table'], scan['alias']
+        compared, leading_like = predicate_columns(sql, alias)
+        existing = indexed_columns(cursor, table)
+        for column in compared:
+            if column in existing:
+                advice.append(f"{table}.{column}: индекс есть, но не используется — проверьте селективность "
+                              f"и статистику индекса (SET STATISTICS INDEX ...).")
+            else:
+                advice.append(f"{table}.{column}: индекса нет — кандидат: "
+                              f"CREATE INDEX IDX_{table}_{column} ON {table} ({column}).")
+        for column in leading_like:
+            advice.append(f"{table}.{column}: LIKE '%...' с ведущим % не использует индекс — "
+                          f"рассмотрите отдельный признак или справочник вместо поиска по подстроке.")
+        if not compared and not leading_like:
+            advice.append(f"{table}: полное чтение ({scan['sequential_reads']} записей) без условий "
+                          f"по своим столбцам — проверьте порядок соединений в плане.")
+    return advice
+
+
+def analyze_query(con, name: str, sql: str, params: tuple, large_table_reads: int) -> dict:
+    """План и статистика выполнения одного запроса."""
+    cursor = con.cursor()
+    statement = cursor.prep(sql)
+    plan = statement.plan
+
+    io_before, tables_before = _io_counters(con), _table_counters(con)
+    started = time.perf_counter()
+    cursor.execute(statement, params)
+    rows = len(cursor.fetchall())
+    elapsed = time.perf_counter() - started
+    io_after, tables_after = _io_counters(con), _table_counters(con)
+
+    tables = []
+    for table, (sequential, indexed) in sorted(tables_after.items()):
+        before = tables_before.get(table, (0, 0))
+        delta = (sequential - before[0], indexed - before[1])
+        if any(delta):
+            tables.append({'table': table, 'sequential': delta[0], 'indexed': delta[1]})
+    sequential_by_table = {item['table']: item['sequential'] for item in tables}
+
+    scans = [
+        {
+            'alias': alias,
+            'table': table,
+            'sequential_reads': sequential_by_table.get(table, 0),
+            'large': sequential_by_table.get(table, 0) >= large_table_reads
+        }
+        for alias, table in natural_scans(plan, table_aliases(sql))
+    ]
+    result = {
+        'name': name,
+        'plan': plan,
+        'rows': rows,
+        'elapsed_seconds': round(elapsed, 4),
+        **{counter: io_after[counter] - io_before[counter] for counter in IO_COUNTERS},
+        'tables': tables,
+        'natural_scans': scans,
+        'advice': advise(sql, scans, cursor),
+        'sql': ' '.join(sql.split())
+    }
+    con.commit()
+    return result
+
+
+def build_report(db_config: dict, queries: dict[str, str], start_date: date, end_date: date,
+                 large_table_reads: int) -> dict:
+    logging.info(f"Подключение к {db_config.get('host') or 'встроенной базе'}:{db_config['database']}...")
+    con = fdb.connect(**db_config)
+    try:
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'database': db_config['database'],
+            'server_version': con.server_version,
+            'ods': f"{con.ods_version}.{con.ods_minor_version}",
+            'period': [start_date.isoformat(), end_date.isoformat()],
+            'queries': []
+        }
+        for name, sql in queries.items():
+            logging.info(f"Анализ запроса: {name}...")
+            try:
+                report['queries'].append(analyze_query(con, name, sql, (start_date, end_date), large_table_reads))
+            except fdb.Error as e:
+                logging.error(f"Не удалось проанализировать запрос {name}: {e}")
+                report['queries'].append({'name': name, 'error': str(e)})
+                con.rollback()
+        return report
+    finally:
+        con.close()
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Планы запросов {report['created']}: {report['database']}, сервер {report['server_version']}, "
+        f"ODS {report['ods']}, период {report['period'][0]} — {report['period'][1]}",
+        ''
+    ]
+    for query in report['queries']:
+        if 'error' in query:
+            lines += [f"[{query['name']}] ошибка: {query['error']}", '']
+            continue
+        lines.append(f"[{query['name']}] {query['elapsed_seconds']:.3f} с, строк {query['rows']}, "
+                     f"reads {query['reads']}, fetches {query['fetches']}, "
+                     f"writes {query['writes']}, marks {query['marks']}")
+        lines.append(f"  {query['plan']}")
+        for table in query['tables']:
+            lines.append(f"  {table['table']:<20} полных чтений {table['sequential']:>10}, "
+                         f"по индексу {table['indexed']:>10}")
+        for scan in query['natural_scans']:
+            mark = '!' if scan['large'] else ' '
+            lines.append(f" {mark}NATURAL {scan['table']} ({scan['alias']}): {scan['sequential_reads']} записей")
+        for advice in query['advice']:
+            lines.append(f"  -> {advice}")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def compare_reports(old: dict, new: dict) -> str:
+    """Различия планов и счетчиков одних и тех же запросов в двух отчетах."""
+    lines = [f"Сравнение с отчетом {old['created']} (сервер {old['server_version']}, ODS {old['ods']}):"]
+    old_queries = {query['name']: query for query in old['queries'] if 'error' not in query}
+    for query in new['queries']:
+        previous = old_queries.get(query['name'])
+        if 'error' in query or previous is None:
+            lines.append(f"  [{query['name']}] нет данных для сравнения")
+            continue
+        changes = []
+        if previous['plan'] != query['plan']:
+            changes.append(f"план изменился:\n      было  {previous['plan']}\n      стало {query['plan']}")
+        for counter in ('elapsed_seconds', 'reads', 'fetches'):
+            before, after = previous[counter], query[counter]
+            if before and abs(after - before) / before >= 0.2:
+                changes.append(f"{counter}: {before} -> {after} ({after / before:.1f}x)")
+        lines.append(f"  [{query['name']}] " + ('; '.join(changes) if changes else "без существенных изменений"))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Планы и статистика выполнения запросов показателей")
+    parser.add_argument('--target', help="Имя цели из TARGETS_FILE (по умолчанию первая)")
+    parser.add_argument('--since', type=date.fromisoformat, help="Начало периода, ГГГГ-ММ-ДД (по умолчанию период выгрузки)")
+    parser.add_argument('--until', type=date.fromisoformat, help="Конец периода, ГГГГ-ММ-ДД")
+    parser.add_argument('--per-metric', action='store_true',
+                        help="По запросу на показатель вместо объединенных запросов SQL_QUERIES")
+    parser.add_argument('--all', action='store_true',
+                        help="Добавить запрос отпечатков дат и выборки режимов single_scan и summary")
+    parser.add_argument('--large-table-reads', type=int, default=10000,
+                        help="С какого числа полных чтений таблица считается большой")
+    parser.add_argument('--output', default=DEFAULT_REPORT, help="Файл JSON-отчета")
+    parser.add_argument('--compare', help="Предыдущий JSON-отчет для сравнения")
+    args = parser.parse_args()
+
+    window_start, window_end = get_window()
+    queries = plan_queries(METRICS, fuse=False) if args.per_metric else dict(SQL_QUERIES)
+    if args.all:
+        queries['fingerprints'] = FINGERPRINT_QUERY
+        queries['raw_extract'] = RAW_EXTRACT_QUERY
+        queries['summary'] = SUMMARY_QUERY
+
+    plan_report = build_report(find_target(args.target).db_config, queries,
+                               args.since or window_start, args.until or window_end, args.large_table_reads)
+    print(format_report(plan_report))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print(compare_reports(json.load(f), plan_report))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(plan_report, f, ensure_ascii=False, indent=2)
+    logging.info(f"Отчет сохранен в {args.output}.")
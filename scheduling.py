@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from config import HISTORY_CONFIG, SCHEDULER_CONFIG
+from instrumentation import inc, set_gauge
+from targets import Target, TargetRunner
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Полосы дат в порядке убывания частоты обновления
+BANDS = ('hot', 'recent', 'settled')
+
+
+def get_window() -> tuple[date, date]:
+    """Период выгрузки: за последние 14 дней и на 14 дней вперед."""
+    today = date.today()
+    return today - timedelta(days=14), today + timedelta(days=14)
+
+
+def _parse_time(value: str):
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def in_shift(now: datetime) -> bool:
+    """Входит ли момент в часы смены (смена может переходить через полночь)."""
+    start = _parse_time(SCHEDULER_CONFIG['shift_start'])
+    end = _parse_time(SCHEDULER_CONFIG['shift_end'])
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def band_interval(band: str, now: datetime) -> int:
+    """Период обновления полосы в секундах."""
+    if band == 'hot':
+        return SCHEDULER_CONFIG['hot_seconds' if in_shift(now) else 'hot_offshift_seconds']
+    return SCHEDULER_CONFIG[f'{band}_seconds']
+
+
+def band_dates(dates: list[date], today: date) -> dict[str, list[date]]:
+    """Раскладывает даты периода выгрузки по полосам."""
+    settled_limit = today - timedelta(days=HISTORY_CONFIG['settled_after_days'])
+    bands = {band: [] for band in BANDS}
+    for dt in dates:
+        if today <= dt <= today + timedelta(days=1):
+            bands['hot'].append(dt)
+        elif dt <= settled_limit:
+            bands['settled'].append(dt)
+        else:
+            bands['recent'].append(dt)
+    return bands
+
+
+class CycleScheduler:
+    """
+    Расписание циклов синхронизации с частотой по полосам дат.
+
+    Каждую секунду для каждой цели определяются полосы, срок обновления
+    которых наступил, и запускается один цикл по объединению их дат.
+    Циклы одной цели не накладываются: если цель еще занята (предыдущим
+    циклом или обновлением по событию), пропуск фиксируется один раз,
+    а просроченные полосы обновляются сразу после ее освобождения — без
+    накопления очереди. Когда пора полностью пересчитать период
+    (full_refresh_due), цикл, начатый по сроку любой полосы, охватывает
+    все полосы. Полосы неудачного цикла повторяются через
+    retry_seconds (или через свой период, если он короче). Сторожевой
+    поток сообщает о циклах дольше cycle_timeout_seconds (с exit_on_hang
+    завершает процесс для перезапуска службой); о циклах дольше периода
+    самой частой своей полосы сообщается по их завершении.
+    """
+
+    def __init__(self, targets: list[Target], runner: TargetRunner, fn, window, full_refresh_due=None):
+        """
+        Args:
+            fn: fn(target, dates) — цикл синхронизации цели по списку дат;
+                возвращает False при неудаче.
+            window: window() -> (начало, конец) периода выгрузки.
+            full_refresh_due: full_refresh_due(target) -> bool — пора ли
+                пересчитать весь период; тогда ближайший цикл цели
+                охватывает все полосы.
+        """
+        self.targets = targets
+        self.runner = runner
+        self.fn = fn
+        self.window = window
+        self.full_refresh_due = full_refresh_due
+        self._lock = threading.Lock()
+        # (цель, полоса) -> момент (time.monotonic), когда полосу пора обновить
+        self._next_due = {}
+        # (цель, полоса), пропуск которых из-за занятой цели уже зафиксирован
+        self._missed = set()
+        # цель -> (начало цикла по time.monotonic, полосы, сообщено о зависании)
+        self._running = {}
+
+    def due_bands(self, target: Target, now: float) -> list[str]:
+        with self._lock:
+            return [band for band in BANDS if now >= self._next_due.get((target.name, band), 0.0)]
+
+    def tick(self):
+        """Запускает циклы целей, у которых наступил срок обновления хотя бы одной полосы."""
+        now = time.monotonic()
+        now_dt = datetime.now()
+        window_start, window_end = self.window()
+        window_dates = [window_start + timedelta(days=x) for x in range((window_end - window_start).days + 1)]
+        bands = band_dates(window_dates, now_dt.date())
+
+        for target in self.targets:
+            due = [band for band in self.due_bands(target, now) if bands[band]]
+            if not due:
+                continue
+            if self.full_refresh_due is not None and self.full_refresh_due(target):
+                # Полный пересчет выполняется только в цикле по всему периоду
+                due = [band for band in BANDS if bands[band]]
+            if target.lock.locked():
+                self._report_missed(target, due)
+                continue
+            dates = sorted(dt for band in due for dt in bands[band])
+            # Срок сдвигается до запуска: неудачный цикл может сразу назначить повтор
+            with self._lock:
+                previous = {band: self._next_due.get((target.name, band), 0.0) for band in due}
+                for band in due:
+                    self._next_due[(target.name, band)] = now + band_interval(band, now_dt)
+            if self.runner.submit(target, self._run_cycle, due, dates) is None:
+                with self._lock:
+                    for band, due_at in previous.items():
+                        self._next_due[(target.name, band)] = due_at
+                self._report_missed(target, due)
+                continue
+            with self._lock:
+                for band in due:
+                    self._missed.discard((target.name, band))
+
+    def _report_missed(self, target: Target, bands: list[str]):
+        with self._lock:
+            new = [band for band in bands if (target.name, band) not in self._missed]
+            self._missed.update((target.name, band) for band in new)
+        for band in new:
+            logging.warning(f"[{target.name}] Цикл полосы '{band}' пропущен: предыдущий запуск цели еще не завершен. "
+                            f"Полоса будет обновлена сразу после его окончания.")
+            inc('cycles_missed', target=target.name, band=band)
+
+    def _run_cycle(self, target: Target, bands: list[str], dates: list[date]):
+        started = time.monotonic()
+        with self._lock:
+            self._running[target.name] = (started, bands, False)
+        logging.info(f"[{target.name}] Цикл по полосам {', '.join(bands)}: {len(dates)} дат.")
+        ok = False
+        try:
+            ok = self.fn(target, dates)
+        finally:
+            finished = time.monotonic()
+            duration = finished - started
+            with self._lock:
+                self._running.pop(target.name, None)
+                if not ok:
+                    # Неудачный цикл не должен откладывать полосу на весь ее период
+                    for band in bands:
+                        key = (target.name, band)
+                        retry = min(SCHEDULER_CONFIG['retry_seconds'], band_interval(band, datetime.now()))
+                        self._next_due[key] = min(self._next_due.get(key, 0.0), finished + retry)
+            interval = min(band_interval(band, datetime.now()) for band in bands)
+            if duration > interval:
+                logging.warning(f"[{target.name}] Цикл по полосам {', '.join(bands)} занял {duration:.1f} с — "
+                                f"дольше периода обновления {interval} с.")
+                inc('cycles_slow', target=target.name)
+
+    def check_watchdog(self):
+        """Сообщает о циклах дольше cycle_timeout_seconds (однажды на цикл)."""
+        timeout = SCHEDULER_CONFIG['cycle_timeout_seconds']
+        now = time.monotonic()
+        hung = []
+        with self._lock:
+            for name, (started, bands, reported) in self._running.items():
+                elapsed = now - started
+                set_gauge('cycle_running_seconds', elapsed, target=name)
+                if elapsed > timeout and not reported:
+                    self._running[name] = (started, bands, True)
+                    hung.append((name, elapsed))
+        for name, elapsed in hung:
+            logging.error(f"[{name}] Цикл выполняется {elapsed:.0f} с — дольше таймаута {timeout} с. "
+                          f"Вероятно, завис запрос к базе или к Google Sheets.")
+            inc('cycle_timeouts', target=name)
+        if hung and SCHEDULER_CONFIG['exit_on_hang']:
+            logging.critical("Процесс завершается из-за зависшего цикла (SCHEDULE_EXIT_ON_HANG=1).")
+            logging.shutdown()
+            # Зависший поток нельзя прервать — перезапуск процесса выполнит служба
+            os._exit(1)
+
+    def _watchdog_loop(self):
+        while True:
+            time.sleep(5)
+            try:
+                self.check_watchdog()
+            except Exception as e:
+                logging.error(f"Ошибка сторожевого таймера: {e}")
+
+    def run_forever(self):
+        """Основной цикл расписания; первый цикл по всем полосам запускается сразу."""
+        threading.Thread(target=self._watchdog_loop, name='watchdog', daemon=True).start()
+        logging.info(
+            f"Расписание: сегодня и завтра — раз в {SCHEDULER_CONFIG['hot_seconds']} с в смену "
+            f"({SCHEDULER_CONFIG['shift_start']}–{SCHEDULER_CONFIG['shift_end']}) и раз в "
+            f"{SCHEDULER_CONFIG['hot_offshift_seconds']} с вне смены; недавние даты — раз в "
+            f"{SCHEDULER_CONFIG['recent_seconds']} с; устоявшиеся — раз в {SCHEDULER_CONFIG['settled_seconds']} с."
+        )
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f"Ошибка планировщика: {e}")
+            time.sleep(1)
@@ -0,0 +1,251 @@
+import gspread
+import logging
+import numbers
+from datetime import date, datetime
+from sheets_quota import scheduler
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Строка заголовка на листе (1-based); первая строка — служебная (F1)
+HEADER_ROW = 2
+DATE_COLUMN = 'Дата'
+
+
+def cell_str(value) -> str:
+    """Приводит значение к строке в том виде, в котором оно хранится в зеркале."""
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%d.%m.%Y')
+    if isinstance(value, numbers.Number) and not isinstance(value, (bool, int)):
+        value = float(value)
+        return str(int(value)) if value.is_integer() else str(value)
+    if value is None:
+        return ''
+    return str(value)
+
+
+def column_letter(column_index: int) -> str:
+    """Буквенное обозначение столбца по 0-based индексу (0 -> A, 26 -> AA)."""
+    letters = ''
+    number = column_index + 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+class SheetMirror:
+    """
+    Локальное зеркало значений листа Google Sheets.
+
+    При загрузке читаются только строка заголовка и столбец 'Дата' (одним
+    запросом batch_get), поэтому объем чтения не зависит от числа столбцов
+    показателей. Остальные ячейки неизвестны (None) и считаются
+    отличающимися от новых значений, пока строки не дочитаны (fill_rows —
+    перед записью строк периода) или не записаны. Дальше зеркало обновляется
+    в памяти по мере планирования записей. В начале каждого запуска оно
+    сверяется с листом одним лёгким запросом — по столбцу 'Дата' (он же дает
+    число строк). При расхождении зеркало загружается заново.
+
+    Вместе со значениями хранится видимость строк, которую выставило
+    приложение (hidden[i] для строки i 0-based: True/False, None — неизвестно).
+    После загрузки видимость неизвестна, и окно отображения
+    выставляется на всех строках заново.
+    """
+
+    def __init__(self):
+        self.values = None
+        self.hidden = None
+        # Постоянное форматирование листа уже настроено (проверено по метаданным)
+        self.formatting_ready = False
+        # Кэш карты дат, сбрасывается при любом изменении зеркала
+        self._date_index = None
+        # Столбец 'Дата' последней загрузки: с него начинается следующая
+        self._date_column_hint = 0
+
+    def _load(self, sheet):
+        logging.info("Загрузка зеркала листа (заголовок и столбец 'Дата')...")
+        self._date_index = None
+        self.hidden = []
+        self.formatting_ready = False
+        try:
+            header, dates = self._read_index(sheet, self._date_column_hint)
+            if DATE_COLUMN in header and header.index(DATE_COLUMN) != self._date_column_hint:
+                # Столбец 'Дата' переместился — читаем его по новому месту
+                self._date_column_hint = header.index(DATE_COLUMN)
+                header, dates = self._read_index(sheet, self._date_column_hint)
+        except gspread.exceptions.GSpreadException as e:
+            logging.warning(f"Не удалось прочитать лист (возможно, он пуст): {e}")
+            self.values = []
+            return
+
+        if not header and not dates:
+            self.values = []
+            return
+        width = max(len(header), self._date_column_hint + 1)
+        self.values = []
+        for i in range(max(len(dates), HEADER_ROW)):
+            row = [None] * width
+            row[self._date_column_hint] = dates[i][0] if i < len(dates) and dates[i] else ''
+            self.values.append(row)
+        self.values[HEADER_ROW - 1] = header + [''] * (width - len(header))
+
+    @staticmethod
+    def _read_index(sheet, date_column_index: int) -> tuple[list[str], list[list[str]]]:
+        """Строка заголовка и столбец с индексом date_column_index одним запросом."""
+        letter = column_letter(date_column_index)
+        header_range, date_range = scheduler.call(
+            'read', sheet.batch_get, [f'{HEADER_ROW}:{HEADER_ROW}', f'{letter}:{letter}']
+        )
+        header = list(header_range[0]) if header_range else []
+        return header, [list(row) for row in date_range]
+
+    def fill_rows(self, sheet, row_indices: list[int]):
+        """
+        Дочитывает с листа строки (0-based индексы), значения которых
+        в зеркале известны не полностью, — одним запросом batch_get.
+        """
+        unknown = sorted(i for i in row_indices if None in self.values[i])
+        if not unknown:
+            return
+        ranges = []
+        for i in unknown:
+            if ranges and ranges[-1][1] == i:
+                ranges[-1][1] = i + 1
+            else:
+                ranges.append([i, i + 1])
+        results = scheduler.call('read', sheet.batch_get, [f'{start + 1}:{end}' for start, end in ranges])
+        for (start, end), value_range in zip(ranges, results):
+            for offset in range(end - start):
+                row = list(value_range[offset]) if offset < len(value_range) else []
+                width = len(self.values[start + offset])
+                self.values[start + offset] = row + [''] * (width - len(row))
+
+    def sync(self, sheet):
+        """Сверяет зеркало с листом и при необходимости перечитывает его."""
+        if self.values is None or self.date_column_index is None:
+            self._load(sheet)
+            return
+
+        sheet_dates = scheduler.call('read', sheet.col_values, self.date_column_index + 1)
+        mirror_dates = self.column(self.date_column_index)
+        # col_values не возвращает пустые ячейки в конце столбца
+        while mirror_dates and mirror_dates[-1] == '':
+            mirror_dates.pop()
+        if sheet_dates != mirror_dates:
+            logging.info("Лист изменен вне приложения — зеркало будет перечитано.")
+            self._load(sheet)
+        else:
+            logging.info("Зеркало листа актуально, полное чтение не требуется.")
+
+    def invalidate(self):
+        """Сбрасывает зеркало, например после ошибки записи."""
+        self.values = None
+        self.hidden = None
+        self.formatting_ready = False
+        self._date_index = None
+
+    @property
+    def header(self) -> list[str]:
+        if not self.values or len(self.values) < HEADER_ROW:
+            return []
+        return [str(h).strip() for h in self.values[HEADER_ROW - 1]]
+
+    @property
+    def date_column_index(self) -> int | None:
+        try:
+            return self.header.index(DATE_COLUMN)
+        except ValueError:
+            return None
+
+    def column(self, index: int) -> list[str]:
+        return [row[index] if index < len(row) else '' for row in self.values]
+
+    def date_to_row(self) -> dict[str, int]:
+        """Карта 'дд.мм.гггг' -> номер строки на листе (1-based)."""
+        if self._date_index is None:
+            index = self.date_column_index
+            self._date_index = {
+                row[index]: i
+                for i, row in enumerate(self.values[HEADER_ROW:], start=HEADER_ROW + 1)
+                if index < len(row)
+            }
+        return self._date_index
+
+    def row_matches(self, row_number: int, values: list) -> bool:
+        """Проверяет, что строка на листе уже содержит эти значения."""
+        if row_number > len(self.values):
+            return False
+        current = self.values[row_number - 1]
+        current = current + [''] * (len(values) - len(current))
+        return all(current[i] == cell_str(v) for i, v in enumerate(values))
+
+    def _changes_index(self, row_number: int, cells: dict) -> bool:
+        """
+        Меняет ли запись ячеек {столбец: значение} в строку row_number карту дат:
+        заголовок, дату строки или число строк.
+        """
+        if row_number > len(self.values) or row_number == HEADER_ROW:
+            return True
+        index = self.date_column_index
+        if row_number < HEADER_ROW or index not in cells:
+            return False
+        row = self.values[row_number - 1]
+        return (row[index] if index < len(row) else '') != cell_str(cells[index])
+
+    def set_row(self, row_number: int, values: list):
+        if self._changes_index(row_number, dict(enumerate(values))):
+            self._date_index = None
+        while len(self.values) < row_number:
+            self.values.append([])
+        row = self.values[row_number - 1]
+        row.extend([''] * (len(values) - len(row)))
+        for i, v in enumerate(values):
+            row[i] = cell_str(v)
+
+    def set_cell(self, row_number: int, column_index: int, value):
+        if self._changes_index(row_number, {column_index: value}):
+            self._date_index = None
+        while len(self.values) < row_number:
+            self.values.append([])
+        row = self.values[row_number - 1]
+        row.extend([''] * (column_index + 1 - len(row)))
+        row[column_index] = cell_str(value)
+
+    def insert_rows(self, row_number: int, rows: list[list]):
+        self._date_index = None
+        self.values[row_number - 1:row_number - 1] = [[cell_str(v) for v in row] for row in rows]
+        if self.hidden is not None and row_number - 1 < len(self.hidden):
+            # Вставленные строки наследуют свойства соседней — их видимость неизвестна
+            self.hidden[row_number - 1:row_number - 1] = [None] * len(rows)
+
+    def delete_rows(self, start_index: int, end_index: int):
+        """Удаляет строки [start_index, end_index) (0-based)."""
+        self._date_index = None
+        del self.values[start_index:end_index]
+        if self.hidden is not None:
+            del self.hidden[start_index:end_index]
+
+    def is_hidden(self, index: int) -> bool | None:
+        """Видимость строки index (0-based), выставленная приложением, или None."""
+        if self.hidden is None or index >= len(self.hidden):
+            return None
+        return self.hidden[index]
+
+    def set_hidden(self, start_index: int, end_index: int, hidden: bool):
+        """Отмечает видимость строк [start_index, end_index) (0-based)."""
+        if self.hidden is None:
+            self.hidden = []
+        if len(self.hidden) < end_index:
+            self.hidden.extend([None] * (end_index - len(self.hidden)))
+        self.hidden[start_index:end_index] = [hidden] * (end_index - start_index)
+
+
+_mirrors = {}
+
+
+def get_mirror(spreadsheet_name: str, worksheet_name: str) -> SheetMirror:
+    """Возвращает общее для процесса зеркало указанного листа."""
+    key = (spreadsheet_name, worksheet_name)
+    if key not in _mirrors:
+        _mirrors[key] = SheetMirror()
+    return _mirrors[key]
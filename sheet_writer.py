@@ -0,0 +1,177 @@
+import logging
+import numbers
+from datetime import date, datetime
+from instrumentation import inc
+from sheets_quota import scheduler
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Нулевая дата в сериальном представлении дат Google Sheets
+SHEETS_EPOCH = date(1899, 12, 30)
+
+
+def cell_data(value) -> dict:
+    """
+    Преобразует значение в CellData для updateCells.
+
+    Даты передаются числом (сериальный номер дня), как их хранит таблица:
+    формат даты у ячеек уже задан и наследуется новыми строками.
+    """
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return {'userEnteredValue': {'numberValue': (value - SHEETS_EPOCH).days}}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'userEnteredValue': {'numberValue': value}}
+    if isinstance(value, numbers.Number):
+        # Decimal из NUMERIC-столбцов Firebird
+        return {'userEnteredValue': {'numberValue': float(value)}}
+    if value is None or value == '':
+        return {}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+class WritePlan:
+    """
+    Планировщик записи на лист.
+
+    Собирает все изменения запуска — значения, вставку строк, видимость,
+    отметку времени и форматирование — в упорядоченный список запросов
+    и отправляет их одним вызовом spreadsheets.batchUpdate.
+    Номера строк во всех методах 1-based, как на листе.
+    """
+
+    def __init__(self, sheet_id: int):
+        self.sheet_id = sheet_id
+        self.requests = []
+
+    def __bool__(self):
+        return bool(self.requests)
+
+    def set_rows(self, row_number: int, rows: list[list], column_index: int = 0):
+        """Записывает значения в строки, начиная с row_number."""
+        self.requests.append({
+            'updateCells': {
+                'start': {'sheetId': self.sheet_id, 'rowIndex': row_number - 1, 'columnIndex': column_index},
+                'rows': [{'values': [cell_data(v) for v in row]} for row in rows],
+                'fields': 'userEnteredValue'
+            }
+        })
+
+    def set_cell(self, row_number: int, column_index: int, value):
+        self.set_rows(row_number, [[value]], column_index)
+
+    def insert_rows(self, row_number: int, rows: list[list]):
+        """Вставляет строки перед row_number, наследуя форматирование предыдущей строки."""
+        self.requests.append({
+            'insertDimension': {
+                'range': {
+                    'sheetId': self.sheet_id,
+                    'dimension': 'ROWS',
+                    'startIndex': row_number - 1,
+                    'endIndex': row_number - 1 + len(rows)
+                },
+                'inheritFromBefore': row_number > 1
+            }
+        })
+        self.set_rows(row_number, rows)
+
+    def append_grid_rows(self, count: int):
+        """Добавляет пустые строки в конец сетки листа."""
+        self.requests.append({
+            'appendDimension': {'sheetId': self.sheet_id, 'dimension': 'ROWS', 'length': count}
+        })
+
+    def set_rows_hidden(self, start_index: int, end_index: int, hidden: bool):
+        """Скрывает или показывает строки в диапазоне [start_index, end_index) (0-based)."""
+        self.requests.append({
+            'updateDimensionProperties': {
+                'range': {
+                    'sheetId': self.sheet_id,
+                    'dimension': 'ROWS',
+                    'startIndex': start_index,
+                    'endIndex': end_index
+                },
+                'properties': {
+                    'hiddenByUser': hidden
+                },
+                'fields': 'hiddenByUser'
+            }
+        })
+
+    def delete_rows(self, start_index: int, end_index: int):
+        """Удаляет строки в диапазоне [start_index, end_index) (0-based)."""
+        self.requests.append({
+            'deleteDimension': {
+                'range': {
+                    'sheetId': self.sheet_id,
+                    'dimension': 'ROWS',
+                    'startIndex': start_index,
+                    'endIndex': end_index
+                }
+            }
+        })
+
+    def add_sheet(self, sheet_id: int, title: str):
+        """Создает лист с заданным идентификатором (на него можно ссылаться в этом же плане)."""
+        self.requests.append({
+            'addSheet': {'properties': {'sheetId': sheet_id, 'title': title}}
+        })
+
+    def append_rows(self, sheet_id: int, rows: list[list]):
+        """Дописывает строки после последней заполненной строки листа sheet_id."""
+        self.requests.append({
+            'appendCells': {
+                'sheetId': sheet_id,
+                'rows': [{'values': [cell_data(v) for v in row]} for row in rows],
+                'fields': 'userEnteredValue'
+            }
+        })
+
+    def cells_count(self) -> int:
+        """Количество ячеек, значения которых записываются (запросы updateCells и appendCells)."""
+        return sum(len(row.get('values', []))
+                   for request in self.requests
+                   for kind in ('updateCells', 'appendCells') if kind in request
+                   for row in request[kind]['rows'])
+
+    def add(self, request: dict):
+        """Добавляет произвольный запрос batchUpdate (например, форматирование)."""
+        self.requests.append(request)
+
+    def replayable(self) -> bool:
+        """
+        План можно отправить повторно: в нем только запись значений (updateCells).
+        Вставка и удаление строк, дописывание и создание листа при повторе
+        применились бы дважды.
+        """
+        return all('updateCells' in request for request in self.requests)
+
+    def execute(self, spreadsheet):
+        """
+        Отправляет все запланированные изменения одним запросом.
+
+        Запрос проходит через планировщик квоты. Если он не удался даже
+        после повторов, план из одних updateCells остается в очереди
+        и будет отправлен или заменен планом следующего запуска для этого
+        же листа; остальные планы из очереди убираются — их собирают
+        заново по перечитанному листу.
+        """
+        # Ключ очереди — лист: планы разных листов (и разных целей) не заменяют друг друга
+        key = ('batch_update', spreadsheet.id, self.sheet_id)
+        if self.requests:
+            logging.info(f"Отправка {len(self.requests)} изменений одним запросом batchUpdate...")
+            scheduler.submit_write(key, spreadsheet.batch_update, {'requests': self.requests})
+        else:
+            logging.info("Изменений для записи на лист нет.")
+        try:
+            scheduler.flush(key)
+        except Exception:
+            if not self.replayable():
+                scheduler.discard(key)
+            raise
+        if self.requests:
+            inc('sheet_cells_written', self.cells_count())
+            inc('sheet_batch_requests', len(self.requests))
@@ -0,0 +1,114 @@
+import gspread
+import logging
+import threading
+from oauth2client.service_account import ServiceAccountCredentials
+from config import SCHEDULER_CONFIG
+from sheets_quota import scheduler
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCOPE = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/spreadsheets',
+         "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
+
+
+class SheetsSession:
+    """
+    Долгоживущая авторизованная сессия Google Sheets.
+
+    Клиент gspread создается один раз: его HTTP-сессия держит соединения
+    открытыми (keep-alive), а токен доступа переиспользуется до истечения
+    срока действия и обновляется автоматически. Идентификаторы таблицы
+    и листа определяются один раз, дальше обращение идет напрямую по ключу,
+    без поиска таблицы по имени через Drive.
+    """
+
+    def __init__(self, sheets_config: dict):
+        self.config = sheets_config
+        self.spreadsheet_id = sheets_config.get('spreadsheet_id') or None
+        self.worksheet_id = sheets_config.get('worksheet_id')
+        self._client = None
+        self._spreadsheet = None
+        self._worksheet = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = _get_client(self.config['credentials_file'])
+        return self._client
+
+    @property
+    def spreadsheet(self):
+        if self._spreadsheet is None:
+            if self.spreadsheet_id:
+                logging.info(f"Открытие таблицы по ключу {self.spreadsheet_id}...")
+                self._spreadsheet = scheduler.call('read', self.client.open_by_key, self.spreadsheet_id)
+            else:
+                logging.info(f"Открытие таблицы '{self.config['spreadsheet_name']}' (поиск по имени)...")
+                self._spreadsheet = scheduler.call('read', self.client.open, self.config['spreadsheet_name'])
+                self.spreadsheet_id = self._spreadsheet.id
+                logging.info(f"Ключ таблицы: {self.spreadsheet_id}. Укажите его в GOOGLE_SPREADSHEET_ID, "
+                             f"чтобы не искать таблицу по имени после перезапуска.")
+        return self._spreadsheet
+
+    @property
+    def worksheet(self):
+        if self._worksheet is None:
+            spreadsheet = self.spreadsheet
+            if self.worksheet_id is not None:
+                self._worksheet = scheduler.call('read', spreadsheet.get_worksheet_by_id, self.worksheet_id)
+            else:
+                self._worksheet = scheduler.call('read', spreadsheet.worksheet, self.config['worksheet_name'])
+                self.worksheet_id = self._worksheet.id
+        return self._worksheet
+
+    def reset(self, keep_ids: bool = True):
+        """
+        Сбрасывает клиента и найденные объекты, чтобы при следующем
+        обращении авторизоваться и открыть таблицу заново.
+        """
+        with _sessions_lock:
+            _clients.pop(self.config['credentials_file'], None)
+        self._client = None
+        self._spreadsheet = None
+        self._worksheet = None
+        if not keep_ids:
+            self.spreadsheet_id = self.config.get('spreadsheet_id') or None
+            self.worksheet_id = self.config.get('worksheet_id')
+
+
+def is_session_error(error: Exception) -> bool:
+    """Ошибки, после которых сессию нужно пересоздать (авторизация, таблица не найдена)."""
+    if isinstance(error, (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound)):
+        return True
+    if isinstance(error, gspread.exceptions.APIError):
+        return getattr(error.response, 'status_code', None) in (401, 403, 404)
+    return False
+
+
+_clients = {}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_client(credentials_file: str):
+    """Клиент gspread, общий для всех сессий с одним сервисным аккаунтом."""
+    with _sessions_lock:
+        client = _clients.get(credentials_file)
+        if client is None:
+            logging.info("Авторизация в Google Sheets...")
+            creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, SCOPE)
+            client = gspread.authorize(creds)
+            # Зависший HTTP-запрос не должен держать цикл синхронизации дольше таймаута
+            client.set_timeout(SCHEDULER_CONFIG['sheets_http_timeout_seconds'])
+            _clients[credentials_file] = client
+        return client
+
+
+def get_session(sheets_config: dict) -> SheetsSession:
+    """Возвращает общую для процесса сессию для указанной таблицы и листа."""
+    key = (sheets_config['credentials_file'], sheets_config.get('spreadsheet_id') or sheets_config['spreadsheet_name'],
+           sheets_config.get('worksheet_id') or sheets_config['worksheet_name'])
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = SheetsSession(sheets_config)
+        return _sessions[key]
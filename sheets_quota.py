@@ -0,0 +1,186 @@
+import gspread
+import logging
+import random
+import requests
+import threading
+import time
+from collections import Counter, deque
+from config import SHEETS_QUOTA_CONFIG
+from instrumentation import inc, span
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Длина окна учета квоты Sheets API
+QUOTA_WINDOW_SECONDS = 60
+
+_local = threading.local()
+
+
+def thread_api_calls() -> Counter:
+    """
+    Счетчик обращений к Sheets API ('read' и 'write') в текущем потоке.
+    Цели обрабатываются в разных потоках, поэтому у каждой свой счетчик.
+    """
+    if not hasattr(_local, 'api_calls'):
+        _local.api_calls = Counter()
+    return _local.api_calls
+
+
+def _status(error: Exception) -> int | None:
+    if isinstance(error, gspread.exceptions.APIError):
+        return getattr(error.response, 'status_code', None)
+    return None
+
+
+def is_retryable(error: Exception, kind: str = 'read') -> bool:
+    """
+    Чтение можно повторить при превышении квоты (429), ошибках сервера (5xx)
+    и сетевых сбоях. Запись повторяется только при 429: запрос отклонен
+    до выполнения. После 5xx или обрыва соединения неизвестно, применен ли
+    batchUpdate, а вставку и удаление строк или создание листа повторять нельзя.
+    """
+    if kind == 'write':
+        return _status(error) == 429
+    return _status(error) == 429 or is_outcome_unknown(error)
+
+
+def is_outcome_unknown(error: Exception) -> bool:
+    """Ошибка сервера (5xx) или сетевой сбой: запрос мог быть выполнен, но ответ потерян."""
+    status = _status(error)
+    if status is not None:
+        return status >= 500
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class QuotaScheduler:
+    """
+    Планировщик запросов к Sheets API с учетом квоты.
+
+    Ведет поминутный бюджет чтений и записей и при его исчерпании ждет
+    освобождения окна, вместо того чтобы получать 429. Ошибки повторяются
+    с экспоненциальной задержкой со случайным разбросом: чтения — при
+    429/5xx и сетевых сбоях, записи — только при 429 (см. is_retryable).
+    Отложенные записи хранятся в очереди по ключу: новая запись с тем же
+    ключом заменяет невыполненную старую, поэтому после сбоя отправляется
+    только последнее состояние.
+    """
+
+    def __init__(self, read_per_minute: int, write_per_minute: int, max_retries: int,
+                 backoff_seconds: float, max_backoff_seconds: float):
+        self.budgets = {'read': read_per_minute, 'write': write_per_minute}
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._windows = {'read': deque(), 'write': deque()}
+        self._lock = threading.Lock()
+        self.pending = {}
+        self.counters = Counter()
+
+    def _reserve(self, kind: str):
+        """Занимает место в поминутном бюджете, при необходимости дожидаясь его."""
+        while True:
+            with self._lock:
+                window = self._windows[kind]
+                now = time.monotonic()
+                while window and now - window[0] >= QUOTA_WINDOW_SECONDS:
+                    window.popleft()
+                if len(window) < self.budgets[kind]:
+                    window.append(now)
+                    return
+                wait = QUOTA_WINDOW_SECONDS - (now - window[0])
+            self.counters[f'{kind}_throttled'] += 1
+            inc('sheets_throttled', kind=kind)
+            logging.info(f"Бюджет Sheets API ({kind}) на минуту исчерпан, ожидание {wait:.1f} с...")
+            time.sleep(wait)
+
+    def call(self, kind: str, fn, *args, **kwargs):
+        """
+        Выполняет обращение к API с учетом бюджета и повторами.
+
+        Args:
+            kind: 'read' или 'write'.
+            fn: Вызываемая функция gspread.
+
+        Raises:
+            Последнюю ошибку, если повторы не помогли или ошибка не повторяемая.
+        """
+        delay = self.backoff_seconds
+        for attempt in range(self.max_retries + 1):
+            self._reserve(kind)
+            self.counters[f'{kind}_spent'] += 1
+            thread_api_calls()[kind] += 1
+            method = getattr(fn, '__name__', 'call')
+            inc('sheets_api_calls', kind=kind, method=method)
+            try:
+                with span('sheets_api', kind=kind, method=method):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e, kind) or attempt == self.max_retries:
+                    self.counters[f'{kind}_failed'] += 1
+                    inc('sheets_api_errors', kind=kind, method=method)
+                    raise
+                self.counters['retries'] += 1
+                inc('sheets_retries', kind=kind, method=method)
+                sleep_for = random.uniform(0, delay)
+                logging.warning(f"Sheets API вернул ошибку ({e}), повтор {attempt + 1} из {self.max_retries} "
+                                f"через {sleep_for:.1f} с.")
+                time.sleep(sleep_for)
+                delay = min(delay * 2, self.max_backoff_seconds)
+
+    def discard(self, key):
+        """Убирает отложенную запись из очереди (ее нельзя безопасно повторить)."""
+        with self._lock:
+            self.pending.pop(key, None)
+
+    def submit_write(self, key, fn, *args, **kwargs):
+        """Ставит запись в очередь; невыполненная запись с тем же ключом заменяется."""
+        with self._lock:
+            if key in self.pending:
+                self.counters['writes_coalesced'] += 1
+            self.pending[key] = (fn, args, kwargs)
+
+    def flush(self, key=None):
+        """
+        Выполняет отложенные записи: все или только запись с ключом key.
+        Запись, которая не удалась, остается в очереди до следующего вызова.
+
+        Raises:
+            Первую ошибку записи после попытки выполнить все записи.
+        """
+        first_error = None
+        with self._lock:
+            entries = [(k, entry) for k, entry in self.pending.items() if key is None or k == key]
+        for entry_key, entry in entries:
+            fn, args, kwargs = entry
+            try:
+                self.call('write', fn, *args, **kwargs)
+                with self._lock:
+                    # Пока шла запись, ее могла заменить более новая — ту оставляем
+                    if self.pending.get(entry_key) is entry:
+                        del self.pending[entry_key]
+            except Exception as e:
+                first_error = first_error or e
+        if first_error is not None:
+            raise first_error
+
+    def stats(self) -> dict:
+        """Потраченный и оставшийся бюджет за текущую минуту и накопленные счетчики."""
+        with self._lock:
+            now = time.monotonic()
+            spent = {kind: sum(1 for t in window if now - t < QUOTA_WINDOW_SECONDS)
+                     for kind, window in self._windows.items()}
+        return {
+            'minute_spent': spent,
+            'minute_remaining': {kind: max(0, self.budgets[kind] - spent[kind]) for kind in spent},
+            'pending_writes': len(self.pending),
+            **self.counters
+        }
+
+
+scheduler = QuotaScheduler(
+    read_per_minute=SHEETS_QUOTA_CONFIG['read_per_minute'],
+    write_per_minute=SHEETS_QUOTA_CONFIG['write_per_minute'],
+    max_retries=SHEETS_QUOTA_CONFIG['max_retries'],
+    backoff_seconds=SHEETS_QUOTA_CONFIG['backoff_seconds'],
+    max_backoff_seconds=SHEETS_QUOTA_CONFIG['max_backoff_seconds']
+)
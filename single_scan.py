@@ -0,0 +1,115 @@
+import logging
+import numpy as np
+import pandas as pd
+from aggregates import DailyAggregates
+from config import METRICS
+from datetime import date, timedelta
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Источники строк в RAW_EXTRACT_QUERY
+SOURCE_MODELS = 1
+SOURCE_FILLINGS = 2
+SOURCE_DETAILS = 3
+SOURCE_SETS = 4
+
+IRON_MARKINGS = ['Водоотлив', 'Железо', 'Козырек', 'Нащельник']
+
+# Условия отбора строк фактов для каждого показателя. Повторяют фильтры
+# соответствующих показателей из config.METRICS; новый показатель
+# для режима single_scan нужно добавить и сюда — иначе импорт модуля
+# завершится ошибкой (check_masks).
+METRIC_MASKS = {
+    'QTY_IZD_PVH': lambda f: (f['SOURCE'] == SOURCE_MODELS) & (f['SYSTEMTYPE'] == 0) & (f['RSYSTEMID'] != 8),
+    'QTY_RAZDV': lambda f: (f['SOURCE'] == SOURCE_MODELS) & ((f['SYSTEMTYPE'] == 1) | (f['RSYSTEMID'] == 8)),
+    'QTY_MOSNET': lambda f: (f['SOURCE'] == SOURCE_DETAILS) & (f['GRGOODSID'] == 46110),
+    'QTY_GLASS_PACKS': lambda f: (f['SOURCE'] == SOURCE_FILLINGS) & f['RSYSTEMID'].isin([3, 21]),
+    'QTY_SANDWICHES': lambda f: (f['SOURCE'] == SOURCE_FILLINGS) & (f['RSYSTEMID'] == 22),
+    'QTY_WINDOWSILLS': lambda f: (f['SOURCE'] == SOURCE_DETAILS) & (f['GGTYPEID'] == 42),
+    'QTY_IRON': lambda f: (f['SOURCE'] == SOURCE_SETS)
+                          & f['MARKING'].fillna('').str.contains('|'.join(IRON_MARKINGS), regex=True),
+}
+
+
+def check_masks(metrics: list[dict] = METRICS):
+    """
+    Проверяет, что для каждого показателя реестра есть условие в METRIC_MASKS.
+
+    Raises:
+        ValueError: Если условие есть не у всех показателей — без него
+            режим single_scan молча заполнял бы показатель нулями.
+    """
+    missing = [metric['key'] for metric in metrics if metric['key'] not in METRIC_MASKS]
+    if missing:
+        raise ValueError(f"Для показателей {', '.join(missing)} нет условия в single_scan.METRIC_MASKS "
+                         f"(и, возможно, столбцов в RAW_EXTRACT_QUERY) — режим single_scan их не посчитает.")
+
+
+check_masks()
+
+
+def aggregate_facts(columns: list[str], rows: list[tuple]) -> DailyAggregates:
+    """
+    Вычисляет все показатели по строкам фактов RAW_EXTRACT_QUERY
+    группировкой по дате производства.
+
+    Args:
+        columns: Имена столбцов результата запроса.
+        rows: Строки результата запроса.
+
+    Returns:
+        Показатели в том же виде, что и при выполнении отдельных запросов:
+        показатель заполнен (не NaN) только для дат, где по нему есть строки.
+    """
+    all_data = DailyAggregates.empty()
+    if not rows:
+        return all_data
+
+    facts = pd.DataFrame.from_records(rows, columns=columns)
+    facts['PRODDATE'] = pd.to_datetime(facts['PRODDATE']).dt.date
+    for column in ('SOURCE', 'RSYSTEMID', 'SYSTEMTYPE', 'GRGOODSID', 'GGTYPEID'):
+        facts[column] = pd.to_numeric(facts[column])
+    facts['WEIGHT'] = facts['ITEM_QTY'].to_numpy(dtype=np.float64) * facts['DETAIL_QTY'].to_numpy(dtype=np.float64)
+
+    for metric, mask in METRIC_MASKS.items():
+        sums = facts.loc[mask(facts)].groupby('PRODDATE', sort=False)['WEIGHT'].sum()
+        all_data = all_data.merge(DailyAggregates.from_query(['PRODDATE', metric], list(sums.items())))
+
+    return all_data
+
+
+def check_parity(start_date: date, end_date: date, rel_tol: float = 1e-9) -> bool:
+    """
+    Сравнивает результат режима single_scan с выполнением запросов
+    показателей (metrics.SQL_QUERIES) за один и тот же период на рабочей
+    базе. Без нее то же сравнение выполняет tests/test_single_scan.py
+    на синтетической базе (python -m pytest tests).
+
+    Returns:
+        True, если все даты и значения совпадают.
+    """
+    from config import DB_CONFIG, FETCH_CONFIG
+    from database import _fetch_sequential, _fetch_single_scan
+    from db_pool import get_pool
+
+    pool = get_pool(DB_CONFIG, FETCH_CONFIG['pool_size'])
+    date1_str = start_date.strftime('%Y-%m-%d')
+    date2_str = end_date.strftime('%Y-%m-%d')
+
+    expected = _fetch_sequential(pool, date1_str, date2_str)
+    actual = _fetch_single_scan(pool, date1_str, date2_str)
+
+    mismatches = expected.compare(actual, list(METRIC_MASKS), rel_tol)
+
+    for proddate, metric, a, b in mismatches:
+        logging.error(f"Расхождение {proddate} {metric}: отдельные запросы = {a}, single_scan = {b}")
+    if not mismatches:
+        logging.info(f"Результаты single_scan совпадают с отдельными запросами по {len(expected)} датам.")
+    return not mismatches
+
+
+if __name__ == '__main__':
+    # Проверка совпадения результатов за последние 30 дней и 14 дней вперед
+    today = date.today()
+    ok = check_parity(today - timedelta(days=30), today + timedelta(days=14))
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,454 @@
+"""
+Сводная таблица дневных показателей в базе Altawin (режим выборки 'summary').
+
+Миграция устанавливает в базу:
+  - ALTAWIN_DAILY_SUMMARY — значение каждого показателя за каждую дату
+    (PRODDATE x METRIC, первичный ключ по дате — чтение периода идет
+    одним проходом по индексу);
+  - ALTAWIN_SUMMARY_DIRTY и триггеры на orders, orderitems, models,
+    modelparts, modelfillings, itemsdetail, itemssets — триггеры только
+    отмечают затронутые даты, не замедляя сохранение заказов в Altawin;
+  - процедуру ALTAWIN_SUMMARY_REFRESH — пересчитывает отмеченные даты
+    запросами показателей (metrics.plan_queries) и снимает отметки.
+
+В режиме DB_FETCH_MODE=summary каждая выборка вызывает процедуру
+(пересчитываются только изменившиеся даты) и читает сводную таблицу.
+Если объекты не установлены или устарели (изменился реестр METRICS),
+выборка выполняется обычными запросами показателей.
+
+Изменения справочников (r_systems, gpackettypes, goods, groupgoods)
+триггерами не отслеживаются — после них нужна пересборка (rebuild).
+
+Примененные миграции и подписи их DDL хранятся в ALTAWIN_SUMMARY_MIGRATIONS.
+Процедура строится из реестра показателей и переустанавливается
+командой install, если ее текст изменился; после этого сводная таблица
+пересобирается.
+
+Установку, пересчет и сверку на встроенном Firebird проверяет
+tests/test_summary.py (FIREBIRD_EMBEDDED_LIB — путь к fbclient).
+
+Пример (встроенная база: DB_HOST= DB_DATABASE=C:/tmp/altawin_test.fdb):
+    python summary.py install
+    python summary.py verify
+    python summary.py check --since 2025-10-01 --until 2025-10-31   # только чтение
+    python summary.py check --refresh    # сначала пересчитать отмеченные даты
+    python summary.py rebuild --since 2025-01-01
+    python summary.py uninstall
+"""
+import argparse
+import hashlib
+import logging
+from datetime import date, datetime, timedelta
+import fdb
+from config import METRICS
+from instrumentation import run
+from metrics import plan_queries
+from scheduling import get_window
+from targets import find_target
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SUMMARY_TABLE = 'ALTAWIN_DAILY_SUMMARY'
+DIRTY_TABLE = 'ALTAWIN_SUMMARY_DIRTY'
+MIGRATIONS_TABLE = 'ALTAWIN_SUMMARY_MIGRATIONS'
+REFRESH_PROCEDURE = 'ALTAWIN_SUMMARY_REFRESH'
+
+# Транзакция пересчета: запись, SNAPSHOT, без ожидания блокировок —
+# если пересчет уже выполняет другой процесс, выборка идет обычными запросами
+REFRESH_TPB = bytes([fdb.isc_tpb_version3, fdb.isc_tpb_write, fdb.isc_tpb_concurrency, fdb.isc_tpb_nowait])
+
+MIGRATIONS_TABLE_DDL = f"""
+    CREATE TABLE {MIGRATIONS_TABLE} (
+        NAME VARCHAR(63) NOT NULL PRIMARY KEY,
+        SIGNATURE VARCHAR(40) NOT NULL,
+        APPLIED_AT TIMESTAMP NOT NULL
+    )
+"""
+
+TABLES_DDL = [
+    f"""
+    CREATE TABLE {SUMMARY_TABLE} (
+        PRODDATE DATE NOT NULL,
+        METRIC VARCHAR(31) NOT NULL,
+        VAL DOUBLE PRECISION,
+        CONSTRAINT PK_{SUMMARY_TABLE} PRIMARY KEY (PRODDATE, METRIC)
+    )
+    """,
+    f"""
+    CREATE TABLE {DIRTY_TABLE} (
+        PRODDATE DATE NOT NULL
+    )
+    """,
+    f"CREATE INDEX {DIRTY_TABLE}_PRODDATE ON {DIRTY_TABLE} (PRODDATE)",
+]
+
+ORDERS_TRIGGER_DDL = f"""
+    CREATE OR ALTER TRIGGER ALTAWIN_SUMMARY_ORDERS FOR ORDERS
+    ACTIVE AFTER INSERT OR UPDATE OR DELETE POSITION 101
+    AS
+    BEGIN
+        IF (NOT INSERTING AND OLD.PRODDATE IS NOT NULL) THEN
+            INSERT INTO {DIRTY_TABLE} (PRODDATE) VALUES (OLD.PRODDATE);
+        IF (NOT DELETING AND NEW.PRODDATE IS NOT NULL
+            AND (INSERTING OR NEW.PRODDATE IS DISTINCT FROM OLD.PRODDATE)) THEN
+            INSERT INTO {DIRTY_TABLE} (PRODDATE) VALUES (NEW.PRODDATE);
+    END
+"""
+
+# Таблицы позиций заказа: (таблица, столбец связи, ключ связи в пути к orders, путь к orders)
+CHILD_TABLES = [
+    ('ORDERITEMS', 'ORDERID', 'o.orderid', "FROM orders o"),
+    ('MODELS', 'ORDERITEMSID', 'oi.orderitemsid',
+     "FROM orderitems oi JOIN orders o ON o.orderid = oi.orderid"),
+    ('ITEMSDETAIL', 'ORDERITEMSID', 'oi.orderitemsid',
+     "FROM orderitems oi JOIN orders o ON o.orderid = oi.orderid"),
+    ('ITEMSSETS', 'ORDERITEMSID', 'oi.orderitemsid',
+     "FROM orderitems oi JOIN orders o ON o.orderid = oi.orderid"),
+    ('MODELPARTS', 'MODELID', 'm.modelid',
+     "FROM models m JOIN orderitems oi ON oi.orderitemsid = m.orderitemsid JOIN orders o ON o.orderid = oi.orderid"),
+    ('MODELFILLINGS', 'MODELPARTID', 'mp.modelpartid',
+     "FROM modelparts mp JOIN models m ON m.modelid = mp.modelid "
+     "JOIN orderitems oi ON oi.orderitemsid = m.orderitemsid JOIN orders o ON o.orderid = oi.orderid"),
+]
+
+
+def _child_trigger_ddl(table: str, column: str, key: str, path: str) -> str:
+    """Триггер, отмечающий дату заказа, к которому относится измененная строка table."""
+    return f"""
+    CREATE OR ALTER TRIGGER ALTAWIN_SUMMARY_{table} FOR {table}
+    ACTIVE AFTER INSERT OR UPDATE OR DELETE POSITION 101
+    AS
+    BEGIN
+        INSERT INTO {DIRTY_TABLE} (PRODDATE)
+        SELECT o.proddate
+        {path}
+        WHERE o.proddate IS NOT NULL
+            AND ({key} = IIF(DELETING, OLD.{column}, NEW.{column})
+                 OR (UPDATING AND {key} = OLD.{column} AND OLD.{column} IS DISTINCT FROM NEW.{column}));
+    END
+"""
+
+
+TRIGGERS_DDL = [ORDERS_TRIGGER_DDL] + [_child_trigger_ddl(*child) for child in CHILD_TABLES]
+TRIGGER_NAMES = ['ALTAWIN_SUMMARY_ORDERS'] + [f'ALTAWIN_SUMMARY_{child[0]}' for child in CHILD_TABLES]
+
+
+def refresh_procedure_ddl(metrics: list[dict] = METRICS) -> str:
+    """
+    Процедура пересчета отмеченных дат. Для каждой даты выполняются
+    запросы показателей (объединенные по соединениям, как в metrics.py)
+    с периодом из одной даты; пустые (NULL) показатели не сохраняются.
+    """
+    keys_by_name = {metric['name']: metric['key'] for metric in metrics}
+    queries = plan_queries(metrics, fuse=True)
+    width = max(len(name.split('+')) for name in queries)
+
+    blocks = []
+    for name, sql in queries.items():
+        assert sql.count('?') == 2, f"Запрос {name}: ожидается период 'BETWEEN ? AND ?'"
+        keys = [keys_by_name[metric_name] for metric_name in name.split('+')]
+        variables = [f'V{index + 1}' for index in range(len(keys))]
+        inserts = '\n'.join(
+            f"                IF ({variable} IS NOT NULL) THEN\n"
+            f"                    INSERT INTO {SUMMARY_TABLE} (PRODDATE, METRIC, VAL) VALUES (:D, '{key}', :{variable});"
+            for key, variable in zip(keys, variables)
+        )
+        blocks.append(
+            f"            -- {name}\n"
+            f"            FOR {sql.strip().replace('?', ':D')}\n"
+            f"            INTO :PD, {', '.join(':' + variable for variable in variables)} DO\n"
+            f"            BEGIN\n{inserts}\n            END"
+        )
+
+    declarations = '\n'.join(f"    DECLARE VARIABLE V{index + 1} DOUBLE PRECISION;" for index in range(width))
+    body = '\n'.join(blocks)
+    return f"""
+    CREATE OR ALTER PROCEDURE {REFRESH_PROCEDURE}
+    RETURNS (REFRESHED INTEGER)
+    AS
+    DECLARE VARIABLE D DATE;
+    DECLARE VARIABLE PD DATE;
+{declarations}
+    BEGIN
+        REFRESHED = 0;
+        FOR SELECT DISTINCT PRODDATE FROM {DIRTY_TABLE} INTO :D DO
+        BEGIN
+            DELETE FROM {SUMMARY_TABLE} WHERE PRODDATE = :D;
+{body}
+            DELETE FROM {DIRTY_TABLE} WHERE PRODDATE = :D;
+            REFRESHED = REFRESHED + 1;
+        END
+        SUSPEND;
+    END
+"""
+
+
+# Миграции по порядку: (имя, DDL, повторяемая). Повторяемая миграция
+# (CREATE OR ALTER) применяется заново, если ее DDL изменился; изменение
+# неповторяемой требует новой миграции в конце списка.
+MIGRATIONS = [
+    ('001_summary_tables', TABLES_DDL, False),
+    ('002_dirty_triggers', TRIGGERS_DDL, True),
+    ('003_refresh_procedure', [refresh_procedure_ddl()], True),
+]
+
+REFRESH_PROCEDURE_MIGRATION = '003_refresh_procedure'
+
+REFRESH_SQL = f"SELECT REFRESHED FROM {REFRESH_PROCEDURE}"
+
+SUMMARY_QUERY = f"""
+    SELECT s.proddate, s.metric, s.val
+    FROM {SUMMARY_TABLE} s
+    WHERE s.proddate BETWEEN ? AND ?
+"""
+
+DIRTY_DATES_QUERY = f"SELECT DISTINCT PRODDATE FROM {DIRTY_TABLE} WHERE PRODDATE BETWEEN ? AND ?"
+
+SIGNATURE_QUERY = f"SELECT SIGNATURE FROM {MIGRATIONS_TABLE} WHERE NAME = '{REFRESH_PROCEDURE_MIGRATION}'"
+
+
+def signature(statements: list[str]) -> str:
+    """Подпись DDL миграции: SHA-1 текста без различий в пробелах."""
+    return hashlib.sha1('\n'.join(' '.join(ddl.split()) for ddl in statements).encode('utf-8')).hexdigest()
+
+
+def procedure_signature() -> str:
+    """Подпись процедуры пересчета для текущего реестра показателей."""
+    return signature(dict((name, statements) for name, statements, _ in MIGRATIONS)[REFRESH_PROCEDURE_MIGRATION])
+
+
+def _relation_exists(cur, name: str) -> bool:
+    cur.execute("SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = ?", (name,))
+    return cur.fetchone() is not None
+
+
+def _applied(con) -> dict[str, str]:
+    """Примененные миграции {имя: подпись}; пусто, если таблицы миграций нет."""
+    cur = con.cursor()
+    if not _relation_exists(cur, MIGRATIONS_TABLE):
+        return {}
+    cur.execute(f"SELECT NAME, SIGNATURE FROM {MIGRATIONS_TABLE}")
+    return {name.strip(): value.strip() for name, value in cur.fetchall()}
+
+
+def install(con, since: date | None = None) -> bool:
+    """
+    Применяет недостающие и измененные миграции. Если процедура пересчета
+    установлена впервые или изменилась, пересобирает сводную таблицу
+    (с since или за всю историю заказов).
+
+    Returns:
+        False, если изменилась неповторяемая миграция.
+    """
+    cur = con.cursor()
+    if not _relation_exists(cur, MIGRATIONS_TABLE):
+        logging.info(f"Создание таблицы {MIGRATIONS_TABLE}...")
+        con.execute_immediate(MIGRATIONS_TABLE_DDL)
+        con.commit()
+
+    applied = _applied(con)
+    procedure_changed = False
+    for name, statements, repeatable in MIGRATIONS:
+        current = signature(statements)
+        if applied.get(name) == current:
+            continue
+        if name in applied and not repeatable:
+            logging.error(f"Миграция {name} уже применена с другим DDL. Изменения схемы "
+                          f"добавляются новой миграцией в конец summary.MIGRATIONS.")
+            return False
+        logging.info(f"Применение миграции {name}...")
+        for ddl in statements:
+            con.execute_immediate(ddl)
+        con.commit()
+        cur.execute(
+            f"UPDATE OR INSERT INTO {MIGRATIONS_TABLE} (NAME, SIGNATURE, APPLIED_AT) VALUES (?, ?, ?) MATCHING (NAME)",
+            (name, current, datetime.now())
+        )
+        con.commit()
+        procedure_changed = procedure_changed or name == REFRESH_PROCEDURE_MIGRATION
+
+    if procedure_changed:
+        logging.info("Процедура пересчета установлена или изменилась — сводная таблица будет пересобрана.")
+        rebuild(con, since)
+    logging.info("Объекты сводной таблицы установлены.")
+    return True
+
+
+def rebuild(con, since: date | None = None, until: date | None = None, chunk_days: int = 31):
+    """
+    Пересчитывает сводную таблицу за период (по умолчанию — за всю историю
+    заказов) частями по chunk_days дней, каждая в своей транзакции.
+    """
+    cur = con.cursor()
+    cur.execute("SELECT MIN(proddate), MAX(proddate) FROM orders")
+    first, last = cur.fetchone()
+    con.commit()
+    if first is None:
+        logging.info("В базе нет заказов — пересчитывать нечего.")
+        return
+    # Firebird может возвращать datetime
+    first, last = [value.date() if isinstance(value, datetime) else value for value in (first, last)]
+    start, end = since or first, until or last
+
+    total = 0
+    while start <= end:
+        chunk_end = min(start + timedelta(days=chunk_days - 1), end)
+        cur.execute(f"DELETE FROM {SUMMARY_TABLE} WHERE PRODDATE BETWEEN ? AND ?", (start, chunk_end))
+        cur.execute(f"INSERT INTO {DIRTY_TABLE} (PRODDATE) "
+                    f"SELECT DISTINCT o.proddate FROM orders o WHERE o.proddate BETWEEN ? AND ?", (start, chunk_end))
+        cur.execute(REFRESH_SQL)
+        refreshed = cur.fetchone()[0]
+        con.commit()
+        total += refreshed
+        logging.info(f"Пересчитано {start.strftime('%d.%m.%Y')} — {chunk_end.strftime('%d.%m.%Y')}: дат {refreshed}.")
+        start = chunk_end + timedelta(days=1)
+    logging.info(f"Пересборка сводной таблицы завершена, дат с заказами: {total}.")
+
+
+def verify(con) -> bool:
+    """Проверяет миграции, триггеры и процедуру; сообщает об ожидающих пересчета датах."""
+    ok = True
+    applied = _applied(con)
+    for name, statements, _ in MIGRATIONS:
+        if name not in applied:
+            logging.error(f"Миграция {name} не применена — выполните python summary.py install.")
+            ok = False
+        elif applied[name] != signature(statements):
+            logging.error(f"Миграция {name} устарела (изменился реестр показателей или DDL) — "
+                          f"выполните python summary.py install.")
+            ok = False
+    if not applied:
+        return False
+
+    cur = con.cursor()
+    cur.execute("SELECT TRIM(RDB$TRIGGER_NAME), COALESCE(RDB$TRIGGER_INACTIVE, 0) FROM RDB$TRIGGERS "
+                "WHERE RDB$TRIGGER_NAME STARTING WITH 'ALTAWIN_SUMMARY_'")
+    triggers = dict(cur.fetchall())
+    for name in TRIGGER_NAMES:
+        if name not in triggers:
+            logging.error(f"Триггер {name} не найден.")
+            ok = False
+        elif triggers[name]:
+            logging.error(f"Триггер {name} отключен — изменения не попадают в сводную таблицу.")
+            ok = False
+
+    cur.execute(f"SELECT COUNT(DISTINCT PRODDATE) FROM {DIRTY_TABLE}")
+    dirty = cur.fetchone()[0]
+    cur.execute(f"SELECT COUNT(*), MIN(PRODDATE), MAX(PRODDATE) FROM {SUMMARY_TABLE}")
+    rows, first, last = cur.fetchone()
+    con.commit()
+    logging.info(f"Сводная таблица: записей {rows}, даты {first} — {last}; ожидают пересчета дат: {dirty}.")
+    if ok:
+        logging.info("Объекты сводной таблицы в порядке.")
+    return ok
+
+
+def check(db_config: dict, start_date: date, end_date: date, refresh: bool = False,
+          rel_tol: float = 1e-9) -> bool:
+    """
+    Сравнивает сводную таблицу с результатом запросов показателей
+    (metrics.SQL_QUERIES) за период.
+
+    Проверка только читает базу: сводная таблица, отметки и запросы
+    показателей выполняются в одной транзакции только для чтения (на одном
+    снимке), а даты, ожидающие пересчета, в сравнение не входят. С refresh
+    отмеченные даты сначала пересчитываются процедурой — это запись в базу.
+
+    Returns:
+        True, если все даты и значения совпадают.
+    """
+    from aggregates import DailyAggregates
+    from config import FETCH_CONFIG
+    from database import _query_metrics
+    from db_pool import get_pool
+
+    pool = get_pool(db_config, FETCH_CONFIG['pool_size'])
+    date1_str = start_date.strftime('%Y-%m-%d')
+    date2_str = end_date.strftime('%Y-%m-%d')
+
+    try:
+        with pool.connection() as pooled:
+            if refresh:
+                pooled.begin(REFRESH_TPB)
+                try:
+                    _, rows = pooled.execute(REFRESH_SQL)
+                finally:
+                    pooled.commit()
+                logging.info(f"Пересчитано отмеченных дат: {rows[0][0]}.")
+            pooled.begin()
+            try:
+                _, rows = pooled.execute(SUMMARY_QUERY, (date1_str, date2_str))
+                actual = DailyAggregates.from_cells(rows)
+                _, rows = pooled.execute(DIRTY_DATES_QUERY, (date1_str, date2_str))
+                dirty = {row[0].date() if isinstance(row[0], datetime) else row[0] for row in rows}
+                expected = _query_metrics(pooled, date1_str, date2_str)
+            finally:
+                pooled.commit()
+    except fdb.Error as e:
+        logging.error(f"Не удалось сверить сводную таблицу (установлена ли она? python summary.py verify): {e}")
+        return False
+
+    if dirty:
+        logging.info(f"Даты, ожидающие пересчета, не сверяются: {len(dirty)} (пересчитать перед проверкой — --refresh).")
+    mismatches = [m for m in expected.compare(actual, rel_tol=rel_tol) if m[0] not in dirty]
+    for proddate, metric, a, b in mismatches:
+        logging.error(f"Расхождение {proddate} {metric}: запросы показателей = {a}, сводная таблица = {b}")
+    if mismatches:
+        logging.error("Сводная таблица расходится с заказами — выполните rebuild за этот период.")
+    else:
+        logging.info(f"Сводная таблица совпадает с запросами показателей по {len(expected)} датам.")
+    return not mismatches
+
+
+def uninstall(con):
+    """Удаляет триггеры, процедуру и таблицы сводной таблицы."""
+    statements = [f"DROP TRIGGER {name}" for name in TRIGGER_NAMES] + [
+        f"DROP PROCEDURE {REFRESH_PROCEDURE}",
+        f"DROP TABLE {SUMMARY_TABLE}",
+        f"DROP TABLE {DIRTY_TABLE}",
+        f"DROP TABLE {MIGRATIONS_TABLE}",
+    ]
+    for ddl in statements:
+        try:
+            con.execute_immediate(ddl)
+            con.commit()
+        except fdb.Error as e:
+            con.rollback()
+            logging.warning(f"Не удалось выполнить '{ddl}': {e}")
+    logging.info("Объекты сводной таблицы удалены.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сводная таблица дневных показателей в базе Altawin")
+    parser.add_argument('command', choices=['install', 'verify', 'rebuild', 'check', 'uninstall'])
+    parser.add_argument('--target', help="Имя цели из TARGETS_FILE (по умолчанию первая)")
+    parser.add_argument('--since', type=date.fromisoformat,
+                        help="Начало периода, ГГГГ-ММ-ДД (rebuild, install: по умолчанию вся история; "
+                             "check: период выгрузки)")
+    parser.add_argument('--until', type=date.fromisoformat, help="Конец периода, ГГГГ-ММ-ДД")
+    parser.add_argument('--refresh', action='store_true',
+                        help="check: сначала пересчитать отмеченные даты (запись в базу)")
+    args = parser.parse_args()
+
+    summary_target = find_target(args.target)
+    if args.command == 'check':
+        window_start, window_end = get_window()
+        with run('summary_check', summary_target.name):
+            ok = check(summary_target.db_config, args.since or window_start, args.until or window_end,
+                       refresh=args.refresh)
+        raise SystemExit(0 if ok else 1)
+
+    connection = fdb.connect(**summary_target.db_config)
+    try:
+        ok = True
+        if args.command == 'install':
+            ok = install(connection, args.since)
+        elif args.command == 'verify':
+            ok = verify(connection)
+        elif args.command == 'rebuild':
+            rebuild(connection, args.since, args.until)
+        else:
+            uninstall(connection)
+    finally:
+        connection.close()
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import INCREMENTAL_CONFIG, TARGETS, TARGETS_CONFIG
+from instrumentation import inc
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class Target:
+    """
+    Цель синхронизации: база Altawin и лист Google Sheets.
+
+    Пулы соединений и сессии Sheets общие для процесса (по параметрам
+    базы и таблицы), а состояние инкрементальной синхронизации
+    и блокировка от наложения запусков — свои у каждой цели.
+    """
+
+    def __init__(self, name: str, db_config: dict, sheets_config: dict):
+        self.name = name
+        self.db_config = db_config
+        self.sheets_config = sheets_config
+        self.lock = threading.Lock()
+        self.sync_state = None
+
+    def local_file(self, path: str) -> str:
+        """Локальный файл цели: для 'default' — path как есть, иначе <имя>.<цель>.<расширение>."""
+        if self.name == 'default':
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.name}{ext or '.json'}"
+
+    @property
+    def state_file(self) -> str:
+        """Файл состояния инкрементальной синхронизации: sync_state.json, sync_state.<цель>.json."""
+        return self.local_file(INCREMENTAL_CONFIG['state_file'])
+
+
+class TargetRunner:
+    """
+    Запускает обработку целей параллельно, не более max_parallel одновременно.
+
+    Цель, предыдущий запуск которой еще не завершился, в этом цикле
+    пропускается — медленная база или таблица не задерживает остальные
+    цели и не накапливает очередь запусков. Ошибка одной цели
+    записывается в журнал и не влияет на другие.
+    """
+
+    def __init__(self, targets: list[Target], max_parallel: int):
+        self.targets = targets
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix='target')
+
+    def submit(self, target: Target, fn, *args):
+        """
+        Ставит fn(target, *args) в очередь; None, если цель еще занята.
+        Результат future — значение fn или None при необработанной ошибке.
+        """
+        if not target.lock.acquire(blocking=False):
+            logging.warning(f"[{target.name}] Предыдущий запуск еще не завершен — цель пропущена в этом цикле.")
+            inc('target_skipped', target=target.name)
+            return None
+
+        def task():
+            try:
+                return fn(target, *args)
+            except Exception as e:
+                logging.exception(f"[{target.name}] Необработанная ошибка при синхронизации цели: {e}")
+                inc('target_errors', target=target.name)
+                return None
+            finally:
+                target.lock.release()
+
+        return self._executor.submit(task)
+
+    def run_all(self, fn, wait_for_all: bool = True):
+        """Запускает fn для всех целей; при wait_for_all ждет завершения всех запущенных."""
+        futures = [future for future in (self.submit(target, fn) for target in self.targets) if future is not None]
+        if wait_for_all:
+            wait(futures)
+
+
+def load_targets() -> list[Target]:
+    return [Target(target['name'], target['db'], target['sheets']) for target in TARGETS]
+
+
+def find_target(name: str | None) -> Target:
+    """Цель по имени; без имени — первая из списка."""
+    if name is None:
+        return targets[0]
+    for target in targets:
+        if target.name == name:
+            return target
+    raise ValueError(f"Цель '{name}' не найдена. Доступные цели: {', '.join(t.name for t in targets)}")
+
+
+targets = load_targets()
+
+runner = TargetRunner(targets, TARGETS_CONFIG['max_parallel'])
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# Модули приложения лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+
+@pytest.fixture
+def embedded_db(tmp_path):
+    """
+    Пустая база со схемой Altawin (benchmark.SCHEMA) на встроенном Firebird.
+
+    Путь к библиотеке fbclient встроенного сервера задается переменной
+    FIREBIRD_EMBEDDED_LIB (например, /opt/firebird/lib/libfbclient.so
+    или C:/Firebird/fbclient.dll); без нее тест пропускается.
+
+    Returns:
+        Параметры подключения (как DB_CONFIG) и открытое соединение.
+    """
+    library = os.getenv('FIREBIRD_EMBEDDED_LIB')
+    if not library:
+        pytest.skip("FIREBIRD_EMBEDDED_LIB не задана — нет встроенного Firebird")
+    import fdb
+
+    path = str(tmp_path / 'altawin.fdb')
+    con = fdb.create_database(
+        sql=f"CREATE DATABASE '{path}' USER 'SYSDBA' PASSWORD 'masterkey' DEFAULT CHARACTER SET UTF8",
+        fb_library_name=library
+    )
+    for ddl in benchmark.SCHEMA:
+        con.execute_immediate(ddl.replace('INTEGER PRIMARY KEY', 'INTEGER NOT NULL PRIMARY KEY'))
+        con.commit()
+    db_config = {'host': None, 'port': None, 'database': path, 'user': 'SYSDBA', 'password': 'masterkey',
+                 'charset': 'UTF8', 'fb_library_name': library}
+    try:
+        yield db_config, con
+    finally:
+        con.drop_database()
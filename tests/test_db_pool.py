@@ -0,0 +1,52 @@
+"""
+Пул соединений (db_pool.py) без сервера Firebird: формирование TPB
+(snapshot_tpb) и выдача соединений параллельной выборке на SQLite из benchmark.py.
+"""
+from datetime import date, timedelta
+
+import fdb
+import pytest
+
+import benchmark
+from database import _fetch_parallel, _fetch_sequential
+from db_pool import SNAPSHOT_READ_TPB, ConnectionPool, snapshot_tpb
+
+
+def test_snapshot_tpb_without_number():
+    assert snapshot_tpb() == bytes([fdb.isc_tpb_version3, fdb.isc_tpb_read, fdb.isc_tpb_concurrency,
+                                    fdb.isc_tpb_wait])
+
+
+def test_snapshot_tpb_with_number():
+    # isc_tpb_at_snapshot_number (23 в Firebird 4), длина 8, номер снимка little-endian
+    assert snapshot_tpb(0x0102030405) == SNAPSHOT_READ_TPB + bytes([23, 8, 5, 4, 3, 2, 1, 0, 0, 0])
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    path = str(tmp_path / 'altawin.sqlite')
+    benchmark.build_database(path, days=2, orders_per_day=5, seed=1)
+    stats = benchmark.DbStats()
+    monkeypatch.setattr(fdb, 'connect', lambda **kwargs: benchmark.SqliteConnection(path, stats))
+    pool = ConnectionPool({}, max_size=3)
+    yield pool
+    pool.close()
+
+
+def test_non_blocking_connection_when_pool_is_full(pool):
+    with pool.connection(), pool.connection(), pool.connection():
+        with pool.connection(blocking=False) as pooled:
+            assert pooled is None
+    with pool.connection(blocking=False) as pooled:
+        assert pooled is not None
+
+
+def test_parallel_fetch_uses_free_connections_only(pool):
+    today = date.today()
+    period = ((today - timedelta(days=2)).isoformat(), (today + timedelta(days=2)).isoformat())
+    expected = _fetch_sequential(pool, *period)
+
+    # Две выборки заняли бы все места пула: вторая работает с тем, что осталось, а не ждет
+    with pool.connection(), pool.connection():
+        actual = _fetch_parallel(pool, *period)
+    assert expected.compare(actual) == []
@@ -0,0 +1,246 @@
+"""
+Событийное обновление: разбор журнала и ожидание паузы в событиях — без
+сервера; на встроенном Firebird — установка журнала и триггеров, события
+и повторная попытка после неудачного обновления.
+
+    FIREBIRD_EMBEDDED_LIB=/opt/firebird/lib/libfbclient.so python -m pytest tests/test_events.py
+"""
+import threading
+import time
+from datetime import date, datetime
+
+import events
+from config import EVENTS_CONFIG
+
+PRODDATE = date(2025, 3, 1)
+
+
+class _FakeTransaction:
+    """Транзакция над журналом _FakeConnection: DELETE применяется только при commit."""
+
+    def __init__(self, con):
+        self._con = con
+        self._delete = False
+        self.active = True
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql: str):
+        if sql.startswith("DELETE"):
+            self._delete = True
+        else:
+            assert sql == "SELECT DISTINCT PRODDATE FROM ALTAWIN_SYNC_CHANGES"
+
+    def fetchall(self) -> list[tuple]:
+        return [(value,) for value in dict.fromkeys(self._con.journal)]
+
+    def commit(self):
+        if self._delete:
+            self._con.journal.clear()
+        self._con.outcomes.append('commit')
+        self.active = False
+
+    def rollback(self):
+        self._con.outcomes.append('rollback')
+        self.active = False
+
+    def close(self):
+        assert not self.active, "close() зафиксировал бы незавершенную транзакцию"
+
+
+class _FakeConnection:
+    def __init__(self, journal: list):
+        self.journal = journal
+        self.outcomes = []
+
+    def trans(self, default_tpb=None) -> _FakeTransaction:
+        return _FakeTransaction(self)
+
+
+class _FakeConduit:
+    """
+    Канал событий, как fdb.EventConduit: wait() по таймауту возвращает
+    нулевые счетчики, а признак готовности держится до flush().
+    Первые events_count вызовов wait() приносят по новому событию;
+    events_count=None — события идут непрерывно.
+    """
+
+    def __init__(self, events_count: int | None):
+        self.events_count = events_count
+        self.waits = 0
+        self.flushes = 0
+        self._counts = {events.EVENT_NAME: 0}
+
+    def wait(self, timeout=None):
+        self.waits += 1
+        if self.events_count is None or self.events_count > 0:
+            if self.events_count is not None:
+                self.events_count -= 1
+            self._counts[events.EVENT_NAME] += 1
+        if not self._counts[events.EVENT_NAME]:
+            time.sleep(timeout)
+        return dict(self._counts)
+
+    def flush(self):
+        self.flushes += 1
+        self._counts = {events.EVENT_NAME: 0}
+
+
+def test_drain_commits_only_after_successful_refresh():
+    con = _FakeConnection([datetime(2025, 3, 2), PRODDATE, PRODDATE])
+
+    assert not events.drain_changes(con, lambda dates: False)
+    assert con.outcomes == ['rollback']
+    assert len(con.journal) == 3
+
+    def failing(dates):
+        raise RuntimeError("Sheets недоступен")
+
+    assert not events.drain_changes(con, failing)
+    assert con.outcomes == ['rollback', 'rollback']
+    assert len(con.journal) == 3
+
+    received = []
+    assert events.drain_changes(con, lambda dates: received.extend(dates) or True)
+    assert received == [PRODDATE, date(2025, 3, 2)]
+    assert con.outcomes[-1] == 'commit'
+    assert con.journal == []
+
+
+def test_drain_with_empty_journal_skips_refresh():
+    con = _FakeConnection([])
+    calls = []
+    assert events.drain_changes(con, calls.append)
+    assert calls == []
+    assert con.outcomes == ['rollback']
+
+
+def test_debounce_waits_for_quiet_period(monkeypatch):
+    monkeypatch.setitem(EVENTS_CONFIG, 'debounce_seconds', 0.05)
+    monkeypatch.setitem(EVENTS_CONFIG, 'max_delay_seconds', 5)
+    listener = events.EventListener(lambda dates: True, {})
+
+    conduit = _FakeConduit(3)
+    started = time.monotonic()
+    listener._debounce(conduit)
+    # Три события подряд продлевают ожидание, первая тишина его завершает
+    assert conduit.waits == 4
+    assert conduit.flushes == 3
+    assert 0.05 <= time.monotonic() - started < 1
+
+
+def test_pending_event_without_flush_is_not_quiet(monkeypatch):
+    monkeypatch.setitem(EVENTS_CONFIG, 'debounce_seconds', 0.05)
+    conduit = _FakeConduit(1)
+    conduit.wait()  # событие получено, но канал не очищен
+
+    assert events.EventListener._wait_event(conduit, 0.05)
+    assert conduit.flushes == 1
+    assert not events.EventListener._wait_event(conduit, 0.05)
+
+
+def test_debounce_gives_up_after_max_delay(monkeypatch):
+    monkeypatch.setitem(EVENTS_CONFIG, 'debounce_seconds', 0.05)
+    monkeypatch.setitem(EVENTS_CONFIG, 'max_delay_seconds', 0.2)
+    listener = events.EventListener(lambda dates: True, {})
+
+    started = time.monotonic()
+    listener._debounce(_FakeConduit(None))
+    assert 0.2 <= time.monotonic() - started < 1
+
+
+def test_failed_dispatch_schedules_retry(monkeypatch):
+    monkeypatch.setitem(EVENTS_CONFIG, 'max_delay_seconds', 30)
+    listener = events.EventListener(lambda dates: False, {})
+
+    assert listener._dispatch(_FakeConnection([])) is None
+    retry_at = listener._dispatch(_FakeConnection([PRODDATE]))
+    assert 29 < retry_at - time.monotonic() <= 30
+
+
+def _insert_order(con, order_id: int, proddate: date):
+    cur = con.cursor()
+    cur.execute("INSERT INTO orders (orderid, proddate) VALUES (?, ?)", (order_id, proddate))
+    cur.execute("INSERT INTO orderitems (orderitemsid, orderid, qty) VALUES (?, ?, 1)", (order_id, order_id))
+    con.commit()
+
+
+def _journal_dates(con) -> list[date]:
+    cur = con.cursor()
+    cur.execute("SELECT DISTINCT PRODDATE FROM ALTAWIN_SYNC_CHANGES ORDER BY PRODDATE")
+    dates = [row[0] for row in cur.fetchall()]
+    con.commit()
+    return dates
+
+
+def test_failed_refresh_keeps_dates(embedded_db):
+    _, con = embedded_db
+    events.install(con)
+    _insert_order(con, 1, PRODDATE)
+    assert _journal_dates(con) == [PRODDATE]
+
+    assert not events.drain_changes(con, lambda dates: False)
+    assert _journal_dates(con) == [PRODDATE]
+
+    def failing(dates):
+        raise RuntimeError("Sheets недоступен")
+
+    assert not events.drain_changes(con, failing)
+    assert _journal_dates(con) == [PRODDATE]
+
+    received = []
+    assert events.drain_changes(con, lambda dates: received.extend(dates) or True)
+    assert received == [PRODDATE]
+    assert _journal_dates(con) == []
+
+
+def test_moving_order_marks_both_dates(embedded_db):
+    _, con = embedded_db
+    events.install(con)
+    _insert_order(con, 1, PRODDATE)
+    assert events.drain_changes(con, lambda dates: True)
+
+    con.cursor().execute("UPDATE orders SET proddate = ? WHERE orderid = 1", (date(2025, 3, 5),))
+    con.commit()
+    assert _journal_dates(con) == [PRODDATE, date(2025, 3, 5)]
+
+    events.uninstall(con)
+
+
+def test_listener_refreshes_changed_dates(embedded_db, monkeypatch):
+    db_config, con = embedded_db
+    events.install(con)
+    monkeypatch.setitem(EVENTS_CONFIG, 'debounce_seconds', 0.2)
+    monkeypatch.setitem(EVENTS_CONFIG, 'max_delay_seconds', 2)
+
+    received, attempts, done = [], [], threading.Event()
+
+    def on_change(dates):
+        attempts.append(dates)
+        if len(attempts) == 1:
+            # Первое обновление не удалось — даты должны прийти снова со следующим событием
+            return False
+        received.extend(dates)
+        done.set()
+        return True
+
+    listener = events.EventListener(on_change, db_config)
+    listener.start()
+    try:
+        # Первое изменение
+        _insert_order(con, 1, PRODDATE)
+        # Второе изменение после неудачи: событие приносит и старую, и новую дату
+        for _ in range(50):
+            if attempts:
+                break
+            time.sleep(0.1)
+        _insert_order(con, 2, date(2025, 3, 2))
+        assert done.wait(10)
+    finally:
+        listener.stop()
+        listener.join(5)
+
+    assert attempts[0] == [PRODDATE]
+    assert received == [PRODDATE, date(2025, 3, 2)]
+    assert _journal_dates(con) == []
@@ -0,0 +1,95 @@
+"""
+Расписание по полосам дат (scheduling.CycleScheduler): повтор после неудачного
+цикла и периодический цикл по всему периоду для полного пересчета.
+"""
+import time
+from datetime import date, datetime, timedelta
+
+from config import SCHEDULER_CONFIG
+from incremental import SyncState
+from scheduling import CycleScheduler, get_window
+from targets import Target, TargetRunner
+
+SETTLED_DATE = date.today() - timedelta(days=365)
+
+
+def _scheduler(results: list[bool]) -> tuple[CycleScheduler, Target, list]:
+    target = Target('default', {}, {})
+    runner = TargetRunner([target], max_parallel=1)
+    calls = []
+
+    def fn(target, dates):
+        calls.append(dates)
+        return results.pop(0)
+
+    scheduler = CycleScheduler([target], runner, fn, lambda: (SETTLED_DATE, SETTLED_DATE))
+    return scheduler, target, calls
+
+
+def _tick(scheduler: CycleScheduler, target: Target):
+    scheduler.tick()
+    # Дожидаемся завершения цикла в потоке исполнителя
+    while target.lock.locked():
+        time.sleep(0.01)
+
+
+def test_failed_cycle_is_retried_before_band_interval(monkeypatch):
+    monkeypatch.setitem(SCHEDULER_CONFIG, 'settled_seconds', 3600)
+    monkeypatch.setitem(SCHEDULER_CONFIG, 'retry_seconds', 60)
+    scheduler, target, calls = _scheduler([False, True])
+
+    _tick(scheduler, target)
+    assert calls == [[SETTLED_DATE]]
+    retry_at = scheduler._next_due[('default', 'settled')]
+    assert 0 < retry_at - time.monotonic() <= 60
+
+    # Срок повтора наступил — полоса обновляется снова, после успеха ждет весь период
+    assert 'settled' in scheduler.due_bands(target, retry_at)
+    scheduler._next_due[('default', 'settled')] = 0.0
+    _tick(scheduler, target)
+    assert len(calls) == 2
+    assert scheduler._next_due[('default', 'settled')] - time.monotonic() > 3000
+
+
+def test_raising_cycle_is_retried(monkeypatch):
+    monkeypatch.setitem(SCHEDULER_CONFIG, 'retry_seconds', 5)
+
+    scheduler, target, calls = _scheduler([])  # pop из пустого списка — ошибка цикла
+    _tick(scheduler, target)
+    assert len(calls) == 1
+    assert scheduler._next_due[('default', 'settled')] - time.monotonic() <= 5
+
+
+def test_full_refresh_cycle_covers_whole_window(tmp_path):
+    target = Target('default', {}, {})
+    runner = TargetRunner([target], max_parallel=1)
+    state = SyncState(str(tmp_path / 'sync_state.json'))
+    calls = []
+
+    def fn(target, dates):
+        calls.append(dates)
+        # Как incremental_job: полный пересчет отмечается после цикла по всему периоду
+        if len(dates) == len(window_dates):
+            state.last_full_refresh = datetime.now()
+        return True
+
+    window_start, window_end = get_window()
+    window_dates = [window_start + timedelta(days=x) for x in range((window_end - window_start).days + 1)]
+    scheduler = CycleScheduler([target], runner, fn, get_window, lambda target: state.full_refresh_due(60))
+
+    _tick(scheduler, target)
+    assert calls[-1] == window_dates
+
+    # Наступил срок только горячей полосы — цикл идет по ней одной
+    scheduler._next_due[('default', 'hot')] = 0.0
+    _tick(scheduler, target)
+    assert len(calls) == 2 and len(calls[-1]) < len(window_dates)
+
+    # Прошел интервал полного пересчета — ближайший цикл охватывает весь период
+    state.last_full_refresh = datetime.now() - timedelta(minutes=61)
+    _tick(scheduler, target)
+    assert len(calls) == 2
+    scheduler._next_due[('default', 'hot')] = 0.0
+    _tick(scheduler, target)
+    assert calls[-1] == window_dates
+    assert not state.full_refresh_due(60)
@@ -0,0 +1,110 @@
+"""
+Совпадение режима single_scan с запросами показателей (metrics.SQL_QUERIES)
+на синтетической базе SQLite из benchmark.py — без рабочей базы Firebird.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import fdb
+import pytest
+
+import benchmark
+from config import METRICS
+from database import _fetch_sequential, _fetch_single_scan
+from db_pool import ConnectionPool
+from single_scan import check_masks
+
+FIRST_DATE = date(2025, 3, 1)
+
+
+class _NumericCursor(benchmark._Cursor):
+    """Курсор, который, как fdb для NUMERIC-столбцов, возвращает дробные значения в Decimal."""
+
+    def fetchall(self) -> list[tuple]:
+        return [tuple(Decimal(str(v)) if isinstance(v, float) else v for v in row) for row in super().fetchall()]
+
+
+class _NumericTransaction(benchmark._Transaction):
+    def cursor(self) -> benchmark._Cursor:
+        return _NumericCursor(self._con, self._stats)
+
+
+class _NumericConnection(benchmark.SqliteConnection):
+    def trans(self, default_tpb: bytes | None = None) -> benchmark._Transaction:
+        return _NumericTransaction(self._con, self._stats)
+
+
+def _day(offset: int) -> str:
+    return (FIRST_DATE - timedelta(days=offset)).isoformat()
+
+
+def _insert_edge_cases(path: str):
+    """Даты с особыми случаями после синтетических заказов."""
+    con = benchmark.sqlite3.connect(path)
+    con.executemany("INSERT INTO groupgoods VALUES (?, ?, ?, ?)", [
+        (700, 0, 1, None),              # набор без маркировки
+        (701, 0, 1, 'Железо оцинк.'),
+        (702, 42, 0, 'Подоконник 0.6'),
+    ])
+    con.executemany("INSERT INTO goods VALUES (?, ?)", [(702, 702)])
+    con.executemany("INSERT INTO orders VALUES (?, ?)", [(-1, _day(1)), (-2, _day(2)), (-3, _day(3)), (-4, _day(4))])
+    con.executemany("INSERT INTO orderitems VALUES (?, ?, ?)", [
+        (-1, -1, 2),      # только изделие ПВХ: остальные показатели за дату пусты
+        (-2, -2, 3),      # rsystemid 8 с systemtype 0 — раздвижка, а не изделие ПВХ
+        (-3, -3, 1.5),    # дробные количества (NUMERIC)
+        (-4, -4, 2),      # наборы с маркировкой NULL и с маркировкой
+    ])
+    con.executemany("INSERT INTO models VALUES (?, ?, ?)", [(-1, -1, 1), (-2, -2, 8)])
+    con.executemany("INSERT INTO itemsdetail VALUES (?, ?, ?, ?, ?)", [
+        (-1, -3, 46110, 46110, 0.25),
+        (-2, -3, 702, 702, 2.75),
+    ])
+    con.executemany("INSERT INTO itemssets VALUES (?, ?, ?, ?)", [(-1, -4, 700, 5), (-2, -4, 701, 1)])
+    con.commit()
+    con.close()
+
+
+@pytest.fixture(scope='module')
+def pool(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('db') / 'altawin.sqlite')
+    benchmark.build_database(path, days=10, orders_per_day=20, seed=7)
+    _insert_edge_cases(path)
+    stats = benchmark.DbStats()
+    original_connect = fdb.connect
+    fdb.connect = lambda **kwargs: _NumericConnection(path, stats)
+    pool = ConnectionPool({}, max_size=1)
+    yield pool
+    pool.close()
+    fdb.connect = original_connect
+
+
+def _fetch_both(pool: ConnectionPool, start: date, end: date):
+    date1_str, date2_str = start.isoformat(), end.isoformat()
+    return _fetch_sequential(pool, date1_str, date2_str), _fetch_single_scan(pool, date1_str, date2_str)
+
+
+def test_single_scan_matches_queries(pool):
+    today = date.today()
+    expected, actual = _fetch_both(pool, today - timedelta(days=10), today + timedelta(days=10))
+    assert len(expected) == 21
+    assert expected.compare(actual) == []
+
+
+def test_single_scan_matches_queries_on_edge_cases(pool):
+    expected, actual = _fetch_both(pool, FIRST_DATE - timedelta(days=4), FIRST_DATE - timedelta(days=1))
+    assert expected.compare(actual) == []
+
+    # Случаи действительно попали в выборку: с пустыми показателями, раздвижкой, дробями и наборами
+    records = {row['PRODDATE']: row for row in actual.records()}
+    assert records[FIRST_DATE - timedelta(days=1)] == {'PRODDATE': FIRST_DATE - timedelta(days=1), 'QTY_IZD_PVH': 2}
+    assert records[FIRST_DATE - timedelta(days=2)] == {'PRODDATE': FIRST_DATE - timedelta(days=2), 'QTY_RAZDV': 3}
+    assert records[FIRST_DATE - timedelta(days=3)]['QTY_MOSNET'] == pytest.approx(0.375)
+    assert records[FIRST_DATE - timedelta(days=3)]['QTY_WINDOWSILLS'] == pytest.approx(4.125)
+    assert records[FIRST_DATE - timedelta(days=4)]['QTY_IRON'] == 2
+
+
+def test_metric_without_mask_is_rejected():
+    check_masks(METRICS)
+    new_metric = {**METRICS[0], 'name': 'new', 'key': 'QTY_NEW'}
+    with pytest.raises(ValueError, match='QTY_NEW'):
+        check_masks(METRICS + [new_metric])
@@ -0,0 +1,209 @@
+"""
+Сводная таблица (summary.py): текст триггеров и процедуры пересчета
+и подписи миграций — без сервера; на встроенном Firebird — миграции,
+пересчет отмеченных триггерами дат и сверка с запросами показателей.
+
+    FIREBIRD_EMBEDDED_LIB=/opt/firebird/lib/libfbclient.so python -m pytest tests/test_summary.py
+"""
+import re
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import benchmark
+import summary
+from config import METRICS, MODELS_JOINS
+from db_pool import close_all_pools
+from metrics import plan_queries
+
+NEW_METRIC = {'name': 'new', 'key': 'QTY_NEW', 'label': 'Новый', 'default': 0, 'joins': MODELS_JOINS,
+              'filter': "rs.rsystemid = 99", 'value': "oi.qty"}
+
+
+class _FakeCursor:
+    """Курсор, отвечающий на запросы install() к системным таблицам и таблице миграций."""
+
+    def __init__(self, con):
+        self._con = con
+        self._rows = []
+
+    def execute(self, sql: str, params: tuple = ()):
+        if 'RDB$RELATIONS' in sql:
+            self._rows = [(1,)] if params[0] in self._con.tables else []
+        elif sql.startswith(f"SELECT NAME, SIGNATURE FROM {summary.MIGRATIONS_TABLE}"):
+            self._rows = list(self._con.migrations.items())
+        elif sql.startswith(f"UPDATE OR INSERT INTO {summary.MIGRATIONS_TABLE}"):
+            self._con.migrations[params[0]] = params[1]
+        elif sql == "SELECT MIN(proddate), MAX(proddate) FROM orders":
+            self._rows = [(None, None)]
+        else:
+            raise AssertionError(f"Неожиданный запрос: {sql}")
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.tables = set()
+        self.migrations = {}
+        self.executed = []
+
+    def cursor(self) -> _FakeCursor:
+        return _FakeCursor(self)
+
+    def execute_immediate(self, ddl: str):
+        self.executed.append(ddl)
+        if ddl == summary.MIGRATIONS_TABLE_DDL:
+            self.tables.add(summary.MIGRATIONS_TABLE)
+
+    def commit(self):
+        pass
+
+
+def test_child_triggers_mark_order_dates():
+    assert len(summary.TRIGGERS_DDL) == len(summary.TRIGGER_NAMES) == len(summary.CHILD_TABLES) + 1
+    for (table, column, key, path), ddl, name in zip(summary.CHILD_TABLES, summary.TRIGGERS_DDL[1:],
+                                                      summary.TRIGGER_NAMES[1:]):
+        assert f"CREATE OR ALTER TRIGGER {name} FOR {table}" in ddl
+        assert f"INSERT INTO {summary.DIRTY_TABLE} (PRODDATE)" in ddl
+        # Дата берется по старому и новому значению связи, а путь доходит до orders
+        assert f"{key} = IIF(DELETING, OLD.{column}, NEW.{column})" in ddl
+        assert f"OLD.{column} IS DISTINCT FROM NEW.{column}" in ddl
+        assert 'orders o' in path
+
+
+def test_refresh_procedure_covers_every_metric():
+    ddl = summary.refresh_procedure_ddl()
+    queries = plan_queries(METRICS, fuse=True)
+    width = max(len(name.split('+')) for name in queries)
+
+    assert '?' not in ddl
+    assert ddl.count('BETWEEN :D AND :D') == len(queries)
+    assert re.findall(r'DECLARE VARIABLE (V\d+)', ddl) == [f'V{index + 1}' for index in range(width)]
+    for name in queries:
+        assert f"-- {name}\n" in ddl
+    for metric in METRICS:
+        assert ddl.count(f"VALUES (:D, '{metric['key']}', :V") == 1
+
+
+def test_new_metric_changes_procedure_signature():
+    ddl = summary.refresh_procedure_ddl(METRICS + [NEW_METRIC])
+    # Показатель на уже используемых соединениях попадает в тот же запрос
+    assert "-- izd_pvh+razdv+new\n" in ddl
+    assert "VALUES (:D, 'QTY_NEW', :V3)" in ddl
+    assert summary.signature([ddl]) != summary.procedure_signature()
+
+
+def test_signature_ignores_whitespace_only():
+    assert summary.signature(["SELECT  1\n FROM   t"]) == summary.signature(["SELECT 1 FROM t"])
+    assert summary.signature(["SELECT 1 FROM t"]) != summary.signature(["SELECT 2 FROM t"])
+
+
+def test_install_applies_only_changed_migrations():
+    con = _FakeConnection()
+    assert summary.install(con)
+    assert con.migrations == {name: summary.signature(statements) for name, statements, _ in summary.MIGRATIONS}
+
+    # Повторная установка ничего не выполняет
+    con.executed.clear()
+    assert summary.install(con)
+    assert con.executed == []
+
+    # Измененная повторяемая миграция применяется заново
+    con.migrations['003_refresh_procedure'] = 'old'
+    assert summary.install(con)
+    assert con.executed == [summary.refresh_procedure_ddl()]
+
+
+def test_install_refuses_changed_table_migration():
+    con = _FakeConnection()
+    assert summary.install(con)
+    con.migrations['001_summary_tables'] = 'old'
+    con.executed.clear()
+    assert not summary.install(con)
+    assert con.executed == []
+
+TABLES = ['r_systems', 'gpackettypes', 'groupgoods', 'goods', 'orders', 'orderitems', 'models', 'modelparts',
+          'modelfillings', 'itemsdetail', 'itemssets']
+
+
+@pytest.fixture
+def altawin_db(embedded_db, tmp_path):
+    """Встроенная база с синтетическими заказами из benchmark.build_database."""
+    db_config, con = embedded_db
+    source_path = str(tmp_path / 'source.sqlite')
+    benchmark.build_database(source_path, days=3, orders_per_day=5, seed=3)
+    source = sqlite3.connect(source_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    cur = con.cursor()
+    for table in TABLES:
+        rows = source.execute(f"SELECT * FROM {table}").fetchall()
+        if rows:
+            cur.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    con.commit()
+    source.close()
+    yield db_config, con
+    close_all_pools()
+
+
+def _period() -> tuple[date, date]:
+    today = date.today()
+    return today - timedelta(days=3), today + timedelta(days=3)
+
+
+def _dirty_count(con) -> int:
+    cur = con.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM {summary.DIRTY_TABLE}")
+    count = cur.fetchone()[0]
+    con.commit()
+    return count
+
+
+def test_install_and_check(altawin_db):
+    db_config, con = altawin_db
+    assert summary.install(con)
+    assert summary.verify(con)
+    assert _dirty_count(con) == 0
+    assert summary.check(db_config, *_period())
+
+    # Повторная установка ничего не меняет
+    assert summary.install(con)
+    assert summary.verify(con)
+
+
+def test_check_is_read_only_until_refresh(altawin_db):
+    db_config, con = altawin_db
+    assert summary.install(con)
+
+    # Новая позиция с изделием ПВХ: триггеры отмечают дату, сводная таблица пока старая
+    cur = con.cursor()
+    cur.execute("INSERT INTO orderitems (orderitemsid, orderid, qty) VALUES (-1, 1, 7)")
+    cur.execute("INSERT INTO models (modelid, orderitemsid, sysprofid) VALUES (-1, -1, 1)")
+    con.commit()
+    assert _dirty_count(con) > 0
+
+    # Отмеченные даты не сверяются и не пересчитываются
+    assert summary.check(db_config, *_period())
+    assert _dirty_count(con) > 0
+
+    assert summary.check(db_config, *_period(), refresh=True)
+    assert _dirty_count(con) == 0
+
+
+def test_check_finds_mismatch(altawin_db):
+    db_config, con = altawin_db
+    assert summary.install(con)
+    cur = con.cursor()
+    cur.execute(f"UPDATE {summary.SUMMARY_TABLE} SET VAL = VAL + 1 WHERE METRIC = 'QTY_RAZDV'")
+    con.commit()
+    assert not summary.check(db_config, *_period())
+
+    summary.rebuild(con, *_period())
+    assert summary.check(db_config, *_period())
+
+    summary.uninstall(con)
+    assert not summary.verify(con)